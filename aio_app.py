@@ -0,0 +1,707 @@
+"""
+Async serving mode for the public API
+
+Serves the /api/* and /proxy/stream routes of routes.py natively on asyncio:
+JioSaavnService is awaited directly on the server's loop and MongoDB is
+accessed through motor. The admin panel stays on the Flask app.
+
+Run with:
+    gunicorn aio_app:create_app --worker-class aiohttp.GunicornWebWorker --bind 0.0.0.0:5000
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+
+import aiohttp
+from aiohttp import web
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import metrics
+from audio_cache import AudioDiskCache, create_audio_cache
+from key_validation import check_key_data
+from music_sources import MusicSources
+from proxy_handler import ProxyHandler
+from proxy_tokens import create_token_codec, is_proxy_token
+from stream_urls import get_stream_url_ttl
+from trending_cache import REGION_PATTERN, TRENDING_SOURCES
+from usage_rollups import keep_raw_log
+from ttl_cache import TTLCache
+from usage_writer import AsyncUsageWriter
+
+logger = logging.getLogger(__name__)
+
+MONGO_DB_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
+BATCH_MAX_QUERIES = 50
+BATCH_CONCURRENCY = 8
+PROXY_CACHE_DURATION = 3600
+PROXY_REWRITE_INTERVAL = int(os.environ.get("PROXY_REWRITE_INTERVAL", 300))
+PROXY_MAX_ENTRY_TTL = int(os.environ.get("PROXY_MAX_ENTRY_TTL", 86400))
+PROXY_CHUNK_SIZE = int(os.environ.get("PROXY_CHUNK_SIZE", 64 * 1024))
+
+API_OWNER = 'https://t.me/INNOCENT_FUCKER'
+POWERED_BY = 'Flaks Music API'
+
+class AsyncAPIKeys:
+    """motor-backed equivalent of models.APIKey for the async server"""
+
+    def __init__(self, collection, usage_writer):
+        self.collection = collection
+        self.usage_writer = usage_writer
+        self.cache = TTLCache(
+            max_entries=int(os.environ.get("API_KEY_CACHE_SIZE", 10000)),
+            default_ttl=float(os.environ.get("API_KEY_CACHE_TTL", 5))
+        )
+
+    async def get_api_key(self, api_key):
+        cached = self.cache.get(api_key)
+        if cached is not None:
+            return cached or None  # {} marks a key known not to exist
+        key_data = await self.collection.find_one({"api_key": api_key})
+        self.cache.set(api_key, key_data or {})
+        return key_data
+
+    async def validate_api_key(self, api_key, cost=1):
+        return check_key_data(await self.get_api_key(api_key), cost)
+
+    def increment_usage(self, api_key, count=1):
+        self.usage_writer.increment_usage(api_key, count)
+        self._adjust_cached_usage(api_key, count)
+
+    def _adjust_cached_usage(self, api_key, count):
+        key_data, ttl = self.cache.get_with_ttl(api_key)
+        if key_data:
+            key_data = dict(key_data)
+            key_data["requests_today"] = key_data.get("requests_today", 0) + count
+            key_data["total_requests"] = key_data.get("total_requests", 0) + count
+            self.cache.set(api_key, key_data, ttl=ttl)
+
+    async def reserve_usage(self, api_key, count):
+        """Charge count requests in one conditional update, only if they fit today's limit (see APIKey.reserve_usage)"""
+        key_data = await self.get_api_key(api_key) or {}
+        limit = key_data.get("daily_limit", 1000)
+        result = await self.collection.update_one(
+            {"api_key": api_key, "requests_today": {"$lte": limit - count}},
+            {
+                "$inc": {"requests_today": count, "total_requests": count},
+                "$set": {"last_used": datetime.utcnow()}
+            }
+        )
+        if not result.modified_count:
+            return False
+        self._adjust_cached_usage(api_key, count)
+        return True
+
+    def log_request(self, api_key, endpoint, query, response_time, success):
+        self.usage_writer.log_request({
+            "api_key": api_key,
+            "endpoint": endpoint,
+            "query": query,
+            "response_time": response_time,
+            "success": success,
+            "timestamp": datetime.utcnow()
+        }, keep_raw=keep_raw_log(success))
+
+def error(message, status, **extra):
+    return web.json_response(dict({'error': message}, **extra), status=status)
+
+def entry_ttl(original_url, song_id=None):
+    """Proxy entry lifetime from the upstream URL's expiry (see ProxyHandler.entry_ttl)"""
+    ttl = get_stream_url_ttl(original_url, default_ttl=PROXY_CACHE_DURATION, max_ttl=PROXY_MAX_ENTRY_TTL)
+    return max(ttl, PROXY_CACHE_DURATION) if song_id else ttl
+
+async def create_proxy_url(request, original_url, api_key, song_id=None):
+    """Register original_url in proxy_cache (or sign a token) and return the proxy URL for it"""
+    ttl = entry_ttl(original_url, song_id)
+    token_codec = request.app['token_codec']
+    if token_codec:
+        token = token_codec.encode(original_url, ttl, song_id=song_id)
+        return f"{request.scheme}://{request.host}/proxy/stream/{token}"
+
+    url_hash = ProxyHandler.make_url_hash(original_url, api_key)
+    entry = {'original_url': original_url, 'api_key': api_key, 'song_id': song_id}
+    proxy_entries = request.app['proxy_entries']
+    known, remaining = proxy_entries.get_with_ttl(url_hash)
+    # Skip rewriting an identical document until its expiry is worth extending
+    if known != entry or remaining <= ttl - PROXY_REWRITE_INTERVAL:
+        proxy_entries.set(url_hash, entry, ttl=ttl)
+        try:
+            await request.app['db'].proxy_cache.replace_one(
+                {'hash': url_hash},
+                {
+                    'hash': url_hash,
+                    'original_url': original_url,
+                    'api_key': api_key,
+                    'song_id': song_id,
+                    'created_at': datetime.utcnow(),
+                    'expires_at': datetime.utcnow() + timedelta(seconds=ttl)
+                },
+                upsert=True
+            )
+        except Exception as e:
+            # The in-memory entry still serves this worker
+            logger.error(f"MongoDB cache error: {e}")
+    return f"{request.scheme}://{request.host}/proxy/stream/{url_hash}"
+
+async def build_stream_url(request, original_stream_url, api_key, direct, song_id=None):
+    if direct:
+        return original_stream_url
+    if original_stream_url:
+        return await create_proxy_url(request, original_stream_url, api_key, song_id)
+    return ""
+
+async def refresh_entry(app, url_hash, entry):
+    """Re-resolve a proxy entry whose upstream URL was rejected (see ProxyHandler.refresh_entry)"""
+    song_id = entry.get('song_id')
+    if not song_id:
+        return None
+
+    # One lookup per song however many range requests hit the dead URL at once
+    refreshing = app['refreshing']
+    if song_id not in refreshing:
+        refreshing[song_id] = asyncio.ensure_future(
+            app['music_sources'].jiosaavn_service.get_song_details(song_id)
+        )
+        refreshing[song_id].add_done_callback(lambda _: refreshing.pop(song_id, None))
+    try:
+        details = await asyncio.shield(refreshing[song_id])
+    except Exception as e:
+        logger.error(f"Error re-resolving song {song_id}: {e}")
+        return None
+
+    stream_url = (details or {}).get('stream_url')
+    if not stream_url or stream_url == entry['original_url']:
+        return None
+
+    refreshed = dict(entry, original_url=stream_url)
+    ttl = entry_ttl(stream_url, song_id)
+    if entry.get('expires_at'):
+        ttl = min(ttl, entry['expires_at'] - time.time())
+    app['proxy_entries'].set(url_hash, refreshed, ttl=ttl)
+    if not is_proxy_token(url_hash):
+        try:
+            await app['db'].proxy_cache.update_one(
+                {'hash': url_hash},
+                {'$set': {'original_url': stream_url, 'expires_at': datetime.utcnow() + timedelta(seconds=ttl)}}
+            )
+        except Exception as e:
+            logger.error(f"MongoDB cache error: {e}")
+
+    logger.info(f"Re-resolved expired stream URL for song {song_id}")
+    return refreshed
+
+async def stream_music(request):
+    """Main music streaming endpoint"""
+    start_time = time.time()
+    api_keys = request.app['api_keys']
+
+    api_key = request.query.get('api_key')
+    query = request.query.get('query')
+    source = request.query.get('source', 'auto')
+    direct = request.query.get('direct', 'false').lower() == 'true'
+
+    if not api_key:
+        return error('API key is required', 400)
+    if not query:
+        return error('Query is required', 400)
+
+    is_valid, message = await api_keys.validate_api_key(api_key)
+    if not is_valid:
+        return error(message, 401)
+
+    try:
+        result = await request.app['music_sources'].search_music_async(query, source)
+        response_time = time.time() - start_time
+
+        if result:
+            api_keys.increment_usage(api_key)
+            api_keys.log_request(api_key, '/api/stream', query, response_time, True)
+
+            final_stream_url = await build_stream_url(request, result.get('stream_url', ''), api_key, direct, result.get('song_id'))
+
+            return web.json_response({
+                'success': True,
+                'title': result.get('title', ''),
+                'artist': result.get('artist', ''),
+                'duration': result.get('duration', ''),
+                'stream_url': final_stream_url,
+                'quality': result.get('quality', '320kbps'),
+                'response_time': round(response_time, 2),
+                'api_owner': API_OWNER,
+                'powered_by': POWERED_BY,
+                'status': 'SUPERFAST_OPTIMIZED'
+            })
+
+        api_keys.log_request(api_key, '/api/stream', query, response_time, False)
+        return error('No music found for the given query', 404, response_time=response_time)
+
+    except Exception as e:
+        logger.error(f"Stream music error: {str(e)}")
+        response_time = time.time() - start_time
+        api_keys.log_request(api_key, '/api/stream', query, response_time, False)
+        return error('Internal server error', 500, response_time=response_time)
+
+async def stream_music_batch(request):
+    """Resolve many queries under one API key; optionally streamed back as NDJSON"""
+    start_time = time.time()
+    api_keys = request.app['api_keys']
+    music_sources = request.app['music_sources']
+
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+
+    api_key = data.get('api_key') or request.query.get('api_key')
+    queries = data.get('queries')
+    source = data.get('source', 'auto')
+    direct = str(data.get('direct', 'false')).lower() == 'true'
+    stream = str(data.get('stream', request.query.get('stream', 'false'))).lower() == 'true'
+
+    if not api_key:
+        return error('API key is required', 400)
+    if not queries or not isinstance(queries, list) or not all(isinstance(q, str) and q.strip() for q in queries):
+        return error('Queries must be a non-empty list of strings', 400)
+    if len(queries) > BATCH_MAX_QUERIES:
+        return error(f'At most {BATCH_MAX_QUERIES} queries per batch', 400)
+
+    is_valid, message = await api_keys.validate_api_key(api_key, cost=len(queries))
+    if not is_valid:
+        return error(message, 401)
+    # Charge the whole batch atomically up front; queries that find nothing are refunded below
+    try:
+        reserved = await api_keys.reserve_usage(api_key, len(queries))
+    except Exception as e:
+        logger.error(f"Batch quota reservation error: {str(e)}")
+        return error('Internal server error', 500)
+    if not reserved:
+        return error('Batch exceeds remaining daily request limit', 401)
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def resolve(index, query):
+        item_start = time.time()
+        async with semaphore:
+            try:
+                result = await music_sources.search_music_async(query, source)
+            except Exception as e:
+                logger.error(f"Batch item error for '{query}': {str(e)}")
+                result = None
+        item_time = time.time() - item_start
+
+        if not result:
+            return item_time, {'index': index, 'query': query, 'success': False, 'error': 'No music found for the given query'}
+        return item_time, {
+            'index': index,
+            'query': query,
+            'success': True,
+            'title': result.get('title', ''),
+            'artist': result.get('artist', ''),
+            'duration': result.get('duration', ''),
+            'stream_url': await build_stream_url(request, result.get('stream_url', ''), api_key, direct, result.get('song_id')),
+            'quality': result.get('quality', '320kbps')
+        }
+
+    def summary(items):
+        resolved = sum(1 for item in items if item['success'])
+        return {
+            'success': resolved > 0,
+            'resolved': resolved,
+            'failed': len(queries) - resolved,
+            'response_time': round(time.time() - start_time, 2),
+            'api_owner': API_OWNER,
+            'powered_by': POWERED_BY
+        }
+
+    tasks = [asyncio.create_task(resolve(index, query)) for index, query in enumerate(queries)]
+    items = []
+    response = None
+    try:
+        if stream:
+            response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+            await response.prepare(request)
+
+        for next_done in asyncio.as_completed(tasks):
+            item_time, item = await next_done
+            items.append(item)
+            api_keys.log_request(api_key, '/api/stream/batch', item['query'], item_time, item['success'])
+            if response is not None:
+                await response.write((json.dumps(item) + '\n').encode())
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Only resolved tracks are charged: refund the rest of the reservation
+        unresolved = len(queries) - sum(1 for item in items if item['success'])
+        if unresolved:
+            api_keys.increment_usage(api_key, -unresolved)
+
+    if response is not None:
+        await response.write((json.dumps(dict(summary(items), done=True)) + '\n').encode())
+        await response.write_eof()
+        return response
+
+    items.sort(key=lambda item: item['index'])
+    return web.json_response(dict(summary(items), results=items))
+
+async def search_music(request):
+    """Search music without streaming"""
+    api_keys = request.app['api_keys']
+    api_key = request.query.get('api_key')
+    query = request.query.get('query')
+    source = request.query.get('source', 'auto')
+
+    if not api_key:
+        return error('API key is required', 400)
+    if not query:
+        return error('Query is required', 400)
+
+    is_valid, message = await api_keys.validate_api_key(api_key)
+    if not is_valid:
+        return error(message, 401)
+
+    try:
+        result = await request.app['music_sources'].search_music_async(query, source)
+        if result:
+            api_keys.increment_usage(api_key)
+            return web.json_response({
+                'success': True,
+                'title': result['title'],
+                'artist': result['artist'],
+                'duration': result.get('duration', ''),
+                'quality': result.get('quality', '320kbps'),
+                'api_owner': API_OWNER,
+                'powered_by': POWERED_BY
+            })
+        return error('No music found', 404)
+
+    except Exception as e:
+        logger.error(f"Search music error: {str(e)}")
+        return error('Internal server error', 500)
+
+async def get_trending(request):
+    """Get trending music"""
+    api_keys = request.app['api_keys']
+    api_key = request.query.get('api_key')
+    source = request.query.get('source', 'jiosaavn')
+    region = request.query.get('region', 'in').lower()
+
+    if not api_key:
+        return error('API key is required', 400)
+
+    try:
+        limit = min(max(int(request.query.get('limit', 10)), 1), 100)
+        page = max(int(request.query.get('page', 1)), 1)
+    except ValueError:
+        return error('limit and page must be integers', 400)
+    if not REGION_PATTERN.match(region):
+        return error('region must be a two-letter country code', 400)
+    if source not in TRENDING_SOURCES:
+        return error(f"source must be one of: {', '.join(TRENDING_SOURCES)}", 400)
+
+    is_valid, message = await api_keys.validate_api_key(api_key)
+    if not is_valid:
+        return error(message, 401)
+
+    try:
+        music_sources = request.app['music_sources']
+        # Warm feeds answer from memory; only a feed's first request may wait on its initial fetch
+        trending_cache = music_sources.trending_cache
+        if trending_cache.is_warm(source, region):
+            result = music_sources.get_trending_page(source, limit, region, page)
+        else:
+            result = await asyncio.to_thread(music_sources.get_trending_page, source, limit, region, page)
+        trending, total, updated_at, stale = result
+        api_keys.increment_usage(api_key)
+        return web.json_response({
+            'success': True,
+            'trending': trending,
+            'source': source,
+            'region': region,
+            'page': page,
+            'limit': limit,
+            'total': total,
+            'updated_at': int(updated_at) or None,
+            'stale': stale
+        })
+
+    except Exception as e:
+        logger.error(f"Trending music error: {str(e)}")
+        return error('Internal server error', 500)
+
+async def api_status(request):
+    """Check API status"""
+    api_key = request.query.get('api_key')
+    if not api_key:
+        return error('API key is required', 400)
+
+    key_data = await request.app['api_keys'].get_api_key(api_key)
+    if not key_data:
+        return error('Invalid API key', 401)
+
+    return web.json_response({
+        'success': True,
+        'owner': key_data.get('owner_name'),
+        'daily_limit': key_data.get('daily_limit'),
+        'requests_today': key_data.get('requests_today'),
+        'total_requests': key_data.get('total_requests'),
+        'expires_at': key_data.get('expires_at').isoformat() if key_data.get('expires_at') else None,
+        'is_active': key_data.get('is_active')
+    })
+
+class CachedAudioResponse(web.FileResponse):
+    """
+    FileResponse for a disk-cached track that carries the stored upstream validators.
+    Conditional headers are answered against those before it is built, so it is
+    prepared with them stripped and only applies Range (and sendfile).
+    """
+
+    def __init__(self, path, validators, range_applies, **kwargs):
+        super().__init__(path, **kwargs)
+        self.validators = validators
+        self.range_applies = range_applies
+
+    async def prepare(self, request):
+        headers = request.headers.copy()
+        for name in ('If-None-Match', 'If-Modified-Since', 'If-Range', 'If-Match', 'If-Unmodified-Since'):
+            headers.popall(name, None)
+        if not self.range_applies:
+            headers.popall('Range', None)
+        return await super().prepare(request.clone(headers=headers))
+
+async def apply_cached_validators(request, response):
+    """FileResponse sets its own file-based ETag/Last-Modified; put the stored ones back"""
+    if isinstance(response, CachedAudioResponse):
+        response.headers.pop('Last-Modified', None)
+        response.headers.update(response.validators)
+
+def send_cached_audio(request, cache_key, path, meta):
+    """Serve a cached track with the same validators as the relayed response (see ProxyHandler.send_cached_audio)"""
+    validators = ProxyHandler.stored_validators(meta, cache_key)
+    if ProxyHandler.is_not_modified(request.headers, validators):
+        return web.Response(status=304, headers=dict(validators, **{
+            'Cache-Control': 'public, max-age=3600',
+            'Access-Control-Allow-Origin': '*'
+        }))
+    return CachedAudioResponse(
+        path,
+        validators,
+        ProxyHandler.if_range_matches(request.headers.get('If-Range'), validators),
+        chunk_size=PROXY_CHUNK_SIZE,
+        headers={
+            'Content-Type': meta.get('content_type', 'audio/mpeg'),
+            'Cache-Control': 'public, max-age=3600',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': 'Range'
+        }
+    )
+
+async def proxy_stream(request):
+    """Relay a proxied stream without holding a worker for the whole track"""
+    url_hash = request.match_info['url_hash']
+    # Tokens are looked up locally too, in case their URL has been re-resolved
+    cached_item = request.app['proxy_entries'].get(url_hash)
+    if cached_item is None and is_proxy_token(url_hash):
+        token_codec = request.app['token_codec']
+        cached_item = token_codec.decode(url_hash) if token_codec else None
+    elif cached_item is None:
+        try:
+            doc = await request.app['db'].proxy_cache.find_one({'hash': url_hash})
+        except Exception as e:
+            logger.error(f"MongoDB cache read error: {e}")
+            doc = None
+        remaining = (doc['expires_at'] - datetime.utcnow()).total_seconds() if doc else 0
+        if remaining > 0:
+            cached_item = {
+                'original_url': doc['original_url'],
+                'api_key': doc.get('api_key'),
+                'song_id': doc.get('song_id')
+            }
+            request.app['proxy_entries'].set(url_hash, cached_item, ttl=remaining)
+    if not cached_item:
+        return web.Response(text="Stream not found or expired", status=404)
+
+    cache_key = AudioDiskCache.make_key(cached_item['original_url'], cached_item.get('song_id'))
+    audio_cache = request.app['audio_cache']
+    cached = audio_cache.get(cache_key) if audio_cache else None
+    if cached:
+        return send_cached_audio(request, cache_key, *cached)
+
+    forward_headers = ProxyHandler.upstream_headers(request.headers, cache_key)
+    if forward_headers is None:
+        return web.Response(status=304, headers={
+            'ETag': ProxyHandler.make_etag(cache_key),
+            'Cache-Control': 'public, max-age=3600',
+            'Access-Control-Allow-Origin': '*'
+        })
+
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+        'Accept': 'audio/webm,audio/ogg,audio/wav,audio/*;q=0.9,application/ogg;q=0.7,video/*;q=0.6,*/*;q=0.5',
+        'Accept-Encoding': 'identity'
+    }
+    headers.update(forward_headers)
+
+    try:
+        timeout = aiohttp.ClientTimeout(sock_connect=10, sock_read=30)
+        upstream = await request.app['http'].request(request.method, cached_item['original_url'],
+                                                     headers=headers, timeout=timeout)
+        # Signed CDN URLs expire mid-session; fetch a fresh one and carry on
+        if upstream.status in (403, 410):
+            refreshed = await refresh_entry(request.app, url_hash, cached_item)
+            if refreshed:
+                upstream.release()
+                upstream = await request.app['http'].request(request.method, refreshed['original_url'],
+                                                             headers=headers, timeout=timeout)
+
+        async with upstream:
+            if upstream.status == 304:
+                return web.Response(status=304, headers=dict(
+                    ProxyHandler.validator_headers(upstream.headers, cache_key),
+                    **{'Cache-Control': 'public, max-age=3600', 'Access-Control-Allow-Origin': '*'}
+                ))
+            if upstream.status == 416:
+                return web.Response(text="Requested range not satisfiable", status=416,
+                                    headers={'Content-Range': upstream.headers.get('Content-Range', '')})
+            if upstream.status not in (200, 206):
+                logger.error(f"Failed to fetch audio: {upstream.status}")
+                return web.Response(text="Failed to fetch audio", status=500)
+
+            validators = ProxyHandler.validator_headers(upstream.headers, cache_key)
+            response = web.StreamResponse(status=upstream.status, headers=dict({
+                'Content-Type': upstream.headers.get('Content-Type', 'audio/mpeg'),
+                'Accept-Ranges': 'bytes',
+                'Cache-Control': 'public, max-age=3600',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Range'
+            }, **validators))
+            if upstream.content_length is not None:
+                response.content_length = upstream.content_length
+            if 'Content-Range' in upstream.headers:
+                response.headers['Content-Range'] = upstream.headers['Content-Range']
+
+            if request.method == 'HEAD':
+                await response.prepare(request)
+                await response.write_eof()
+                return response
+
+            writer = None
+            body_size = AudioDiskCache.complete_body_size(
+                upstream.status,
+                upstream.headers.get('Content-Length'),
+                upstream.headers.get('Content-Range')
+            )
+            if audio_cache and body_size:
+                writer = audio_cache.open_writer(cache_key)
+
+            try:
+                await response.prepare(request)
+                async for chunk in upstream.content.iter_chunked(PROXY_CHUNK_SIZE):
+                    if writer:
+                        writer.write(chunk)
+                    await response.write(chunk)
+                if writer:
+                    writer.commit(response.headers['Content-Type'], body_size, validators)
+            finally:
+                if writer:
+                    writer.abort()
+            await response.write_eof()
+            return response
+
+    except (ConnectionResetError, asyncio.CancelledError):
+        raise
+    except Exception as e:
+        logger.error(f"Error streaming audio: {str(e)}")
+        return web.Response(text="Error streaming audio", status=500)
+
+@web.middleware
+async def json_not_found(request, handler):
+    try:
+        return await handler(request)
+    except web.HTTPNotFound:
+        return error('Endpoint not found', 404)
+
+@web.middleware
+async def request_timer(request, handler):
+    """Per-endpoint latency; handlers that stream the body are timed to the end of the stream"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        if resource is not None and resource.canonical != '/metrics':
+            metrics.request_duration.observe(
+                time.perf_counter() - start,
+                endpoint=resource.canonical,
+                method=request.method,
+                status=str(status)
+            )
+
+async def metrics_endpoint(request):
+    """Prometheus scrape endpoint for this worker's latency histograms"""
+    token = request.query.get('token') or request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not metrics.is_authorized(token):
+        return error('Unauthorized', 401)
+    return web.Response(text=metrics.render(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+async def on_startup(app):
+    app['mongo'] = AsyncIOMotorClient(MONGO_DB_URI)
+    app['db'] = app['mongo'].flaks_music_api
+    await app['db'].proxy_cache.create_index("expires_at", expireAfterSeconds=0)
+    await app['db'].usage_rollups.create_index([("api_key", 1), ("endpoint", 1), ("minute", 1)], unique=True)
+
+    app['usage_writer'] = AsyncUsageWriter(
+        app['db'].api_keys,
+        app['db'].usage_stats,
+        max_queue=int(os.environ.get("USAGE_WRITE_QUEUE_SIZE", 10000)),
+        batch_size=int(os.environ.get("USAGE_WRITE_BATCH_SIZE", 500)),
+        flush_interval=float(os.environ.get("USAGE_WRITE_FLUSH_INTERVAL", 1.0)),
+        usage_rollups_collection=app['db'].usage_rollups
+    )
+    await app['usage_writer'].start()
+    app['api_keys'] = AsyncAPIKeys(app['db'].api_keys, app['usage_writer'])
+
+    # No mongo_client: the shared cache tier and cross-worker leases use blocking pymongo
+    app['music_sources'] = MusicSources()
+    app['music_sources'].trending_cache.warm('jiosaavn', 'in')
+    app['audio_cache'] = create_audio_cache()
+    app['token_codec'] = create_token_codec()
+    app['refreshing'] = {}
+    app['proxy_entries'] = TTLCache(
+        max_entries=int(os.environ.get("PROXY_LOCAL_CACHE_SIZE", 10000)),
+        default_ttl=PROXY_CACHE_DURATION
+    )
+    app['http'] = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0, keepalive_timeout=30))
+
+async def on_cleanup(app):
+    await app['usage_writer'].stop()
+    await app['music_sources'].jiosaavn_service.close()
+    await app['http'].close()
+    app['mongo'].close()
+
+async def create_app():
+    """aiohttp application factory (also used by gunicorn's aiohttp worker)"""
+    app = web.Application(middlewares=[request_timer, json_not_found])
+    app.router.add_get('/api/stream', stream_music)
+    app.router.add_post('/api/stream/batch', stream_music_batch)
+    app.router.add_get('/api/search', search_music)
+    app.router.add_get('/api/trending', get_trending)
+    app.router.add_get('/api/status', api_status)
+    app.router.add_get('/proxy/stream/{url_hash}', proxy_stream)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.on_response_prepare.append(apply_cached_validators)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(), host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
@@ -30,6 +30,7 @@ except Exception as e:
 # Collections
 api_keys_collection = db.api_keys
 usage_stats_collection = db.usage_stats
+usage_rollups_collection = db.usage_rollups
 admin_users_collection = db.admin_users
 
 # Initialize admin user if not exists
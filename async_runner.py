@@ -0,0 +1,105 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+class AsyncLoopRunner:
+    """Long-lived background event loop for running async services from sync code"""
+
+    def __init__(self, name="async-runner"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._shutdown_callbacks = []
+        atexit.register(self.stop)
+
+    @property
+    def loop(self):
+        """Event loop of the current process, started on first use"""
+        self._ensure_started()
+        return self._loop
+
+    def _ensure_started(self):
+        # A loop thread does not survive fork(), so gunicorn workers get their own
+        if self._loop is not None and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid():
+                return
+
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            thread = threading.Thread(target=run, name=self.name, daemon=True)
+            thread.start()
+            ready.wait()
+
+            self._loop = loop
+            self._thread = thread
+            self._pid = os.getpid()
+            logger.info(f"Started background event loop in process {self._pid}")
+
+    def submit(self, coro):
+        """Schedule a coroutine on the background loop and return a concurrent.futures.Future"""
+        loop = self.loop
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("AsyncLoopRunner.submit() called from the loop thread; await the coroutine instead")
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the background loop and block until it finishes"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def add_shutdown_callback(self, callback):
+        """Register an async callable to be awaited on the loop before it stops"""
+        self._shutdown_callbacks.append(callback)
+
+    def stop(self, timeout=5):
+        """Run shutdown callbacks and stop the loop of the current process"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if loop is None or self._pid != os.getpid():
+                return
+            self._loop = None
+            self._thread = None
+
+        async def shutdown():
+            for callback in self._shutdown_callbacks:
+                try:
+                    await callback()
+                except Exception as e:
+                    logger.error(f"Event loop shutdown callback error: {str(e)}")
+
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout)
+        except Exception as e:
+            logger.error(f"Error during event loop shutdown: {str(e)}")
+
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+
+# Global runner shared by every sync caller in this worker
+async_runner = AsyncLoopRunner()
+
+def run_async(coro, timeout=None):
+    """Run a coroutine on the shared background event loop"""
+    return async_runner.run(coro, timeout)
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-(\d+)/(\d+)$')
+
+class AudioCacheWriter:
+    """Write-through sink for one cache entry; only complete bodies become visible"""
+
+    def __init__(self, cache, key, part_path, fd):
+        self.cache = cache
+        self.key = key
+        self.part_path = part_path
+        self.file = os.fdopen(fd, 'wb')
+        self.size = 0
+        self.closed = False
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self, content_type, expected_size=None, validators=None):
+        """Publish the entry if the whole body arrived; otherwise discard it"""
+        if self.closed:
+            return False
+        if expected_size is not None and self.size != expected_size:
+            logger.debug(f"Audio cache: incomplete body for {self.key} ({self.size}/{expected_size} bytes)")
+            self.abort()
+            return False
+        try:
+            self.file.close()
+            meta = {'content_type': content_type, 'size': self.size, 'stored_at': time.time()}
+            # ETag / Last-Modified the relayed response carried, replayed on hits
+            for name, value in (validators or {}).items():
+                meta[name.lower().replace('-', '_')] = value
+            self.cache._write_meta(self.key, meta)
+            # Atomic rename: readers in other workers never see a partial file
+            os.replace(self.part_path, self.cache.data_path(self.key))
+        except Exception as e:
+            logger.error(f"Audio cache commit error: {e}")
+            self.abort()
+            return False
+        self.closed = True
+        self.cache._added(self.size)
+        return True
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.file.close()
+            os.unlink(self.part_path)
+        except OSError:
+            pass
+
+class AudioDiskCache:
+    """Byte-bounded on-disk LRU of audio bodies, shared by every worker on the host"""
+
+    def __init__(self, directory, max_bytes=1024 ** 3, stale_part_seconds=120, evict_interval=30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stale_part_seconds = stale_part_seconds
+        self.evict_interval = evict_interval
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._bytes_since_evict = 0
+        self._last_evict = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(url, song_id=None):
+        """Cache key from song identity: the song id, or the CDN path without its signed query"""
+        if song_id:
+            identity = f"song:{song_id}:{os.path.basename(urlparse(url).path)}"
+        else:
+            parsed = urlparse(url)
+            identity = f"url:{parsed.netloc}{parsed.path}"
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    @staticmethod
+    def complete_body_size(status, content_length=None, content_range=None):
+        """Size of the body if an upstream response carries the whole track, else None"""
+        if status == 200:
+            return int(content_length) if content_length and content_length.isdigit() else None
+        # Players usually open with "Range: bytes=0-", answered as 206 for the full file
+        if status == 206 and content_range:
+            match = CONTENT_RANGE_PATTERN.match(content_range)
+            if match and int(match.group(1)) == 0 and int(match.group(2)) + 1 == int(match.group(3)):
+                return int(match.group(3))
+        return None
+
+    def data_path(self, key):
+        return os.path.join(self.directory, f"{key}.audio")
+
+    def meta_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def part_path(self, key):
+        return os.path.join(self.directory, f"{key}.part")
+
+    def _write_meta(self, key, meta):
+        tmp_path = f"{self.meta_path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path(key))
+
+    def get(self, key):
+        """Return (path, meta) for a complete entry and mark it recently used, or None"""
+        path = self.data_path(key)
+        try:
+            with open(self.meta_path(key)) as f:
+                meta = json.load(f)
+            if os.path.getsize(path) != meta.get('size'):
+                raise ValueError("size mismatch")
+            # The sidecar's mtime is the LRU clock, so the audio file's own
+            # mtime (and any ETag derived from it) stays stable
+            os.utime(self.meta_path(key))
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path, meta
+
+    def open_writer(self, key):
+        """Claim the entry for writing; None if another worker is already filling it"""
+        part_path = self.part_path(key)
+        for _ in range(2):
+            try:
+                fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                return AudioCacheWriter(self, key, part_path, fd)
+            except FileExistsError:
+                # A worker that died mid-download leaves its .part behind
+                try:
+                    if time.time() - os.path.getmtime(part_path) < self.stale_part_seconds:
+                        return None
+                    os.unlink(part_path)
+                except OSError:
+                    pass
+            except OSError as e:
+                logger.error(f"Audio cache open error: {e}")
+                return None
+        return None
+
+    def _added(self, size):
+        with self._lock:
+            self.stores += 1
+            self._bytes_since_evict += size
+            due = (self._bytes_since_evict > self.max_bytes // 20
+                   or time.time() - self._last_evict > self.evict_interval)
+        if due:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the store fits in max_bytes"""
+        with self._lock:
+            self._bytes_since_evict = 0
+            self._last_evict = time.time()
+
+        sizes = {}
+        last_used = {}
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    key, ext = os.path.splitext(entry.name)
+                    if ext not in ('.audio', '.json'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    if ext == '.audio':
+                        sizes[key] = stat.st_size
+                    else:
+                        last_used[key] = stat.st_mtime
+        except OSError as e:
+            logger.error(f"Audio cache scan error: {e}")
+            return 0
+
+        total = sum(sizes.values())
+        entries = sorted((last_used.get(key, 0), size, key) for key, size in sizes.items())
+
+        removed = 0
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for path in (self.meta_path(key), self.data_path(key)):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            total -= size
+            removed += 1
+
+        if removed:
+            with self._lock:
+                self.evictions += removed
+            logger.info(f"Audio cache evicted {removed} entries")
+        return removed
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'max_bytes': self.max_bytes
+            }
+
+def create_audio_cache():
+    """Build the cache from AUDIO_CACHE_DIR / AUDIO_CACHE_MAX_BYTES; None when disabled"""
+    max_bytes = int(os.environ.get("AUDIO_CACHE_MAX_BYTES", 1024 ** 3))
+    if max_bytes <= 0:
+        return None
+    directory = os.environ.get("AUDIO_CACHE_DIR") or os.path.join(
+        os.environ.get("TMPDIR", "/tmp"), "flaks_audio_cache"
+    )
+    try:
+        return AudioDiskCache(directory, max_bytes=max_bytes)
+    except OSError as e:
+        logger.error(f"Audio cache disabled: {e}")
+        return None
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark: pooled JioSaavnService session vs a new session per call
+Reports time to first byte (response headers) and full search latency.
+
+By default it runs against a local fake upstream, which only shows the
+TCP connect + DNS saving. Point --url at https://saavn.dev/api to include
+the TLS handshake that production pays on every unpooled request.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import aiohttp
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jiosaavn_service import JioSaavnService
+from benchmarks.fake_saavn import start_in_thread
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'mean_ms': round(statistics.mean(samples) * 1000, 3),
+        'p50_ms': round(samples[len(samples) // 2] * 1000, 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+    }
+
+
+async def ttfb(session, url, params):
+    start = time.perf_counter()
+    async with session.get(url, params=params) as response:
+        elapsed = time.perf_counter() - start
+        await response.read()
+    return elapsed
+
+
+async def bench_ttfb(service, requests):
+    params = {'query': 'benchmark', 'page': 1, 'limit': 3}
+
+    unpooled = []
+    for _ in range(requests):
+        connector = aiohttp.TCPConnector(**service.connector_settings)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            unpooled.append(await ttfb(session, service.search_url, params))
+
+    pooled = []
+    connector = aiohttp.TCPConnector(**service.connector_settings)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await ttfb(session, service.search_url, params)  # warm the pool
+        for _ in range(requests):
+            pooled.append(await ttfb(session, service.search_url, params))
+
+    return summarize(unpooled), summarize(pooled)
+
+
+async def bench_search(service, requests):
+    unpooled = []
+    for i in range(requests):
+        start = time.perf_counter()
+        await service.search_songs(f"song {i}")
+        unpooled.append(time.perf_counter() - start)
+        await service.close()  # what every call used to do
+
+    pooled = []
+    await service.search_songs("warm up")
+    for i in range(requests):
+        start = time.perf_counter()
+        await service.search_songs(f"song {i}")
+        pooled.append(time.perf_counter() - start)
+    await service.close()
+
+    return summarize(unpooled), summarize(pooled)
+
+
+async def main(args):
+    base_url = args.url or start_in_thread(latency=args.latency)
+    service = JioSaavnService(base_url=base_url)
+
+    ttfb_unpooled, ttfb_pooled = await bench_ttfb(service, args.requests)
+    search_unpooled, search_pooled = await bench_search(service, args.requests)
+
+    report = {
+        'upstream': base_url,
+        'requests': args.requests,
+        'ttfb': {
+            'new_session_per_call': ttfb_unpooled,
+            'shared_session': ttfb_pooled,
+            'p50_saving_ms': round(ttfb_unpooled['p50_ms'] - ttfb_pooled['p50_ms'], 3)
+        },
+        'search_songs': {
+            'new_session_per_call': search_unpooled,
+            'shared_session': search_pooled,
+            'p50_saving_ms': round(search_unpooled['p50_ms'] - search_pooled['p50_ms'], 3)
+        }
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help="Upstream API base URL (default: local fake server)")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help="Latency of the fake upstream in seconds")
+    asyncio.run(main(parser.parse_args()))
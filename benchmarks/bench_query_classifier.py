@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark: compiled lyrics/title query classifier vs the original substring checks
+Reports per-query latency and routing accuracy on a labelled query corpus,
+plus accuracy across decision thresholds for tuning.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from query_classifier import QueryClassifier
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'lyrics_queries.json')
+
+
+def legacy_is_lyrics_query(query):
+    """MusicSources._is_lyrics_query before the compiled classifier"""
+    lyrics_indicators = [
+        'lyrics', 'गाने के बोल', 'बोल', 'song with lyrics',
+        'the song that goes', 'song with words',
+        'मैं', 'तू', 'तेरे', 'मेरे', 'प्यार', 'दिल', 'इश्क',
+        'i love', 'you are', 'baby', 'heart', 'love you',
+        'na na na', 'la la la', 'oh oh oh', 'hey hey'
+    ]
+    query_lower = query.lower()
+    for indicator in lyrics_indicators:
+        if indicator in query_lower:
+            return True
+    if len(query.split()) >= 4:
+        return True
+    if any(word in query_lower for word in ['में', 'है', 'हैं', 'को', 'से', 'and', 'the', 'of', 'in', 'on']):
+        return True
+    return False
+
+
+def accuracy(predict, corpus):
+    """Accuracy plus precision/recall of the 'lyrics' label"""
+    tp = fp = fn = correct = 0
+    misses = []
+    for item in corpus:
+        predicted = 'lyrics' if predict(item['query']) else 'title'
+        if predicted == item['label']:
+            correct += 1
+        else:
+            misses.append(item['query'])
+        if predicted == 'lyrics':
+            tp += item['label'] == 'lyrics'
+            fp += item['label'] != 'lyrics'
+        elif item['label'] == 'lyrics':
+            fn += 1
+    return {
+        'accuracy': round(correct / len(corpus), 4),
+        'lyrics_precision': round(tp / (tp + fp), 4) if tp + fp else 0.0,
+        'lyrics_recall': round(tp / (tp + fn), 4) if tp + fn else 0.0,
+        'misclassified': misses
+    }
+
+
+def latency(predict, queries, rounds):
+    predict(queries[0])  # warm up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            predict(query)
+    elapsed = time.perf_counter() - start
+    return round(elapsed / (rounds * len(queries)) * 1e6, 3)
+
+
+def main(args):
+    with open(args.corpus, encoding='utf-8') as f:
+        corpus = json.load(f)
+    queries = [item['query'] for item in corpus]
+
+    classifier = QueryClassifier()
+
+    report = {
+        'corpus': os.path.relpath(args.corpus),
+        'queries': len(corpus),
+        'legacy': dict(
+            accuracy(legacy_is_lyrics_query, corpus),
+            us_per_query=latency(legacy_is_lyrics_query, queries, args.rounds)
+        ),
+        'compiled': dict(
+            accuracy(classifier.is_lyrics, corpus),
+            us_per_query=latency(classifier.is_lyrics, queries, args.rounds),
+            us_per_query_with_confidence=latency(classifier.classify, queries, args.rounds)
+        ),
+        'thresholds': {}
+    }
+
+    # Scores do not depend on the threshold, so sweep it over precomputed scores
+    scores = [(classifier.score(item['query']), item['label']) for item in corpus]
+    for step in range(1, 9):
+        threshold = step * 0.5
+        correct = sum((score >= threshold) == (label == 'lyrics') for score, label in scores)
+        report['thresholds'][str(threshold)] = round(correct / len(scores), 4)
+
+    if not args.show_misses:
+        for name in ('legacy', 'compiled'):
+            report[name]['misclassified'] = len(report[name]['misclassified'])
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help="Labelled queries: [{\"query\", \"label\": \"lyrics\"|\"title\"}]")
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--show-misses', action='store_true', help="List misclassified queries instead of counting them")
+    main(parser.parse_args())
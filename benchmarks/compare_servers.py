@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark: Flask (gunicorn sync workers) vs the aiohttp/motor server (aio_app)
+
+Starts the fake JioSaavn upstream, boots each server under gunicorn with the
+same number of workers, and drives /api/stream with a closed-loop client at
+several concurrency levels. Both servers need a reachable MongoDB: set
+MONGO_URI (the Flask app falls back to its built-in Atlas URI otherwise).
+A throwaway API key is inserted before the run and removed afterwards.
+
+    MONGO_URI=mongodb://localhost:27017 python benchmarks/compare_servers.py --latency 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import aiohttp
+from pymongo import MongoClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from benchmarks.fake_saavn import start_in_thread
+
+SERVERS = {
+    'flask-sync': ['main:app'],
+    'aiohttp': ['aio_app:create_app', '--worker-class', 'aiohttp.GunicornWebWorker'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'mean_ms': round(statistics.mean(samples) * 1000, 3),
+        'p50_ms': round(samples[len(samples) // 2] * 1000, 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+    }
+
+
+def start_server(name, port, workers, env):
+    command = [
+        sys.executable, '-m', 'gunicorn',
+        '--bind', f'127.0.0.1:{port}',
+        '--workers', str(workers),
+        '--timeout', '120',
+        '--log-level', 'warning',
+    ] + SERVERS[name][1:] + [SERVERS[name][0]]
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    wait_for_port(port, process, name)
+    return process
+
+
+def wait_for_port(port, process, name, timeout=30):
+    """Block until the server accepts connections; terminate it if it never does"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"{name} server exited with code {process.returncode}")
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{name} server did not start on port {port}")
+
+
+async def drive(base_url, api_key, concurrency, duration, unique_queries):
+    """Closed loop: each client sends its next request as soon as the last one returns"""
+    latencies = []
+    errors = 0
+    counter = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(session):
+        nonlocal errors, counter
+        while time.perf_counter() < deadline:
+            counter += 1
+            query = f'bench song {counter % unique_queries if unique_queries else counter}'
+            start = time.perf_counter()
+            try:
+                async with session.get(f'{base_url}/api/stream', params={'api_key': api_key, 'query': query}) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    result = {'concurrency': concurrency, 'errors': errors, 'requests_per_second': round(len(latencies) / elapsed, 1)}
+    if latencies:
+        result.update(summarize(latencies))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per concurrency level')
+    parser.add_argument('--latency', type=float, default=0.2, help='fake upstream latency in seconds')
+    parser.add_argument('--unique-queries', type=int, default=0,
+                        help='cycle through N queries (0 = every request is a cache miss)')
+    parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=sorted(SERVERS))
+    args = parser.parse_args()
+
+    mongo_uri = os.environ.get('MONGO_URI', 'mongodb://localhost:27017')
+    api_keys = MongoClient(mongo_uri).flaks_music_api.api_keys
+    api_key = 'bench_' + secrets.token_hex(12)
+    api_keys.insert_one({
+        "api_key": api_key,
+        "owner_name": "benchmark",
+        "daily_limit": 10 ** 9,
+        "requests_today": 0,
+        "total_requests": 0,
+        "created_at": datetime.utcnow(),
+        "expires_at": datetime.utcnow() + timedelta(days=1),
+        "is_active": True,
+        "last_used": None
+    })
+
+    upstream = start_in_thread('127.0.0.1', latency=args.latency)
+    env = dict(os.environ, MONGO_URI=mongo_uri, JIOSAAVN_API_URL=upstream)
+
+    results = {'workers': args.workers, 'upstream_latency_s': args.latency, 'servers': {}}
+    try:
+        for name in args.servers:
+            port = free_port()
+            process = start_server(name, port, args.workers, env)
+            try:
+                results['servers'][name] = [
+                    asyncio.run(drive(f'http://127.0.0.1:{port}', api_key, concurrency,
+                                      args.duration, args.unique_queries))
+                    for concurrency in args.concurrency
+                ]
+            finally:
+                process.terminate()
+                process.wait(10)
+    finally:
+        api_keys.delete_one({"api_key": api_key})
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
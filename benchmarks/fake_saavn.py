@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the saavn.dev API used by the benchmarks
+Serves /api/search/songs and /api/songs/<id> with configurable latency,
+error rate and result count, and /audio/<file> as fixed-size audio bodies
+with single-range support.
+With url_ttl set, audio URLs are signed with an expiry and rejected (403) after it.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import random
+import threading
+import time
+
+from aiohttp import web
+
+
+def make_song(song_id, query, base_url, expires=None):
+    """Build a song object shaped like a saavn.dev search result"""
+    signature = f"?expires={expires}" if expires else ""
+    return {
+        'id': song_id,
+        'name': f"{query.title()} ({song_id[:4]})",
+        'duration': 215,
+        'album': {'name': 'Benchmark Album'},
+        'artists': {'primary': [{'name': 'Benchmark Artist'}]},
+        'image': [
+            {'quality': '150x150', 'url': f"{base_url}/images/{song_id}_150.jpg"},
+            {'quality': '500x500', 'url': f"{base_url}/images/{song_id}_500.jpg"}
+        ],
+        'downloadUrl': [
+            {'quality': '96kbps', 'url': f"{base_url}/audio/{song_id}_96.mp4{signature}"},
+            {'quality': '160kbps', 'url': f"{base_url}/audio/{song_id}_160.mp4{signature}"},
+            {'quality': '320kbps', 'url': f"{base_url}/audio/{song_id}_320.mp4{signature}"}
+        ]
+    }
+
+
+def song_id_for(query, index=0):
+    return hashlib.md5(f"{query.lower()}:{index}".encode()).hexdigest()[:10]
+
+
+def create_app(latency=0.0, audio_size=1024 * 1024, url_ttl=0, error_rate=0.0, results=None):
+    """Create the fake upstream aiohttp application"""
+    app = web.Application()
+    audio_body = bytes(range(256)) * (audio_size // 256) + bytes(audio_size % 256)
+
+    def base_url(request):
+        return f"{request.scheme}://{request.host}"
+
+    def expires():
+        return int(time.time() + url_ttl) if url_ttl else None
+
+    def failed():
+        return error_rate and random.random() < error_rate
+
+    async def search_songs(request):
+        if latency:
+            await asyncio.sleep(latency)
+        if failed():
+            return web.json_response({'success': False, 'message': 'Injected failure'}, status=503)
+        query = request.query.get('query', '')
+        limit = results if results is not None else int(request.query.get('limit', 10))
+        songs = [make_song(song_id_for(query, i), query, base_url(request), expires()) for i in range(limit)]
+        return web.json_response({
+            'success': True,
+            'data': {'total': len(songs), 'start': 0, 'results': songs}
+        })
+
+    async def song_details(request):
+        if latency:
+            await asyncio.sleep(latency)
+        if failed():
+            return web.json_response({'success': False, 'message': 'Injected failure'}, status=503)
+        song_id = request.match_info['song_id']
+        return web.json_response({
+            'success': True,
+            'data': [make_song(song_id, 'benchmark song', base_url(request), expires())]
+        })
+
+    async def audio(request):
+        if int(request.query.get('expires', time.time() + 1)) < time.time():
+            return web.Response(status=403, text="URL expired")
+        headers = {'Content-Type': 'audio/mp4', 'Accept-Ranges': 'bytes'}
+        range_header = request.headers.get('Range', '')
+        if range_header.startswith('bytes='):
+            start, _, end = range_header[6:].partition('-')
+            if not start:
+                start, end = audio_size - int(end), audio_size - 1
+            start, end = int(start), min(int(end) if end else audio_size - 1, audio_size - 1)
+            if start >= audio_size or start > end:
+                headers['Content-Range'] = f"bytes */{audio_size}"
+                return web.Response(status=416, headers=headers)
+            headers['Content-Range'] = f"bytes {start}-{end}/{audio_size}"
+            return web.Response(status=206, body=audio_body[start:end + 1], headers=headers)
+        return web.Response(body=audio_body, headers=headers)
+
+    app.router.add_get('/api/search/songs', search_songs)
+    app.router.add_get('/api/songs/{song_id}', song_details)
+    app.router.add_get('/audio/{name}', audio)
+    return app
+
+
+def start_in_thread(host='127.0.0.1', port=0, **options):
+    """Start the fake upstream on a background thread and return its base API URL"""
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state = {}
+
+    async def start():
+        runner = web.AppRunner(create_app(**options))
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        state['port'] = runner.addresses[0][1]
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name='fake-saavn', daemon=True).start()
+    started.wait()
+    return f"http://{host}:{state['port']}/api"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake saavn.dev upstream for benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every API response")
+    parser.add_argument('--audio-size', type=int, default=1024 * 1024, help="Bytes in every /audio body")
+    parser.add_argument('--url-ttl', type=int, default=0, help="Seconds until issued audio URLs expire (0 = never)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of API calls answered with 503")
+    parser.add_argument('--results', type=int, default=None, help="Songs per search response (default: the request's limit)")
+    args = parser.parse_args()
+
+    web.run_app(create_app(latency=args.latency, audio_size=args.audio_size, url_ttl=args.url_ttl,
+                           error_rate=args.error_rate, results=args.results),
+                host=args.host, port=args.port)
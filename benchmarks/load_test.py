@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+End-to-end load benchmark: /api/stream, /api/search and /proxy/stream/<hash>
+
+Starts the fake saavn.dev upstream (configurable latency, error rate, result
+count and audio size), boots the app under gunicorn and drives each scenario
+with a closed-loop client at several concurrency levels. Prints JSON with
+RPS, mean/p50/p95/p99 latency and error counts per server, scenario and
+concurrency; write it with --output and pass an earlier run as --baseline to
+get the relative change between two commits.
+
+MongoDB is either a real server (MONGO_URI, needed for the aiohttp server) or
+an in-memory mongomock (--mongomock, Flask only). With mongomock every worker
+holds its own copy of the data, so proxy URLs are issued as signed tokens
+when more than one worker runs.
+
+    python benchmarks/load_test.py --mongomock --latency 0.05 --output before.json
+    python benchmarks/load_test.py --mongomock --latency 0.05 --baseline before.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from benchmarks.compare_servers import free_port, wait_for_port
+from benchmarks.fake_saavn import start_in_thread
+
+SERVERS = ('flask', 'aiohttp')
+SCENARIOS = ('stream', 'search', 'proxy')
+KEY_DOCUMENT = {
+    "owner_name": "benchmark",
+    "daily_limit": 10 ** 9,
+    "requests_today": 0,
+    "total_requests": 0,
+    "is_active": True,
+    "last_used": None
+}
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of sorted samples"""
+    return samples[min(len(samples) - 1, max(0, int(round(q * len(samples))) - 1))]
+
+
+def summarize(latencies, statuses, errors, elapsed, body_bytes):
+    latencies = sorted(latencies)
+    result = {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'statuses': dict(sorted(statuses.items())),
+        'requests_per_second': round(len(latencies) / elapsed, 1)
+    }
+    if latencies:
+        result.update({
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3)
+        })
+    if body_bytes:
+        result['mb_per_second'] = round(body_bytes / elapsed / 1e6, 2)
+    return result
+
+
+async def drive(make_request, concurrency, duration):
+    """Closed loop: each client sends its next request as soon as the last one returns"""
+    latencies = []
+    statuses = Counter()
+    errors = 0
+    body_bytes = 0
+    counter = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(session):
+        nonlocal errors, body_bytes, counter
+        while time.perf_counter() < deadline:
+            counter += 1
+            url, params, headers = make_request(counter)
+            start = time.perf_counter()
+            try:
+                async with session.get(url, params=params, headers=headers) as response:
+                    body = await response.read()
+                    statuses[str(response.status)] += 1
+                    if response.status not in (200, 206):
+                        errors += 1
+                        continue
+                    body_bytes += len(body)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                statuses[type(e).__name__] += 1
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return dict({'concurrency': concurrency}, **summarize(latencies, statuses, errors, elapsed, body_bytes))
+
+
+async def collect_proxy_paths(base_url, api_key, count):
+    """Issue proxy URLs through /api/stream for the proxy scenario to replay"""
+    paths = []
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
+        for index in range(count):
+            params = {'api_key': api_key, 'query': f'proxy bench song {index}'}
+            async with session.get(f'{base_url}/api/stream', params=params) as response:
+                if response.status == 200:
+                    stream_url = (await response.json()).get('stream_url', '')
+                    if '/proxy/stream/' in stream_url:
+                        paths.append('/proxy/stream/' + stream_url.split('/proxy/stream/', 1)[1])
+    return paths
+
+
+def make_scenario(name, base_url, api_key, args, proxy_paths=None):
+    """Request factory for one scenario: counter -> (url, params, headers)"""
+    def query(counter):
+        return f'bench song {counter % args.unique_queries if args.unique_queries else counter}'
+
+    if name == 'proxy':
+        headers = {'Range': args.proxy_range} if args.proxy_range else None
+        return lambda counter: (base_url + proxy_paths[counter % len(proxy_paths)], None, headers)
+
+    endpoint = '/api/stream' if name == 'stream' else '/api/search'
+    return lambda counter: (f'{base_url}{endpoint}', {'api_key': api_key, 'query': query(counter)}, None)
+
+
+def run_scenarios(base_url, api_key, args):
+    results = {}
+    for name in args.scenarios:
+        proxy_paths = None
+        if name == 'proxy':
+            proxy_paths = asyncio.run(collect_proxy_paths(base_url, api_key, args.proxy_songs))
+            if not proxy_paths:
+                results[name] = {'error': 'no proxy URLs could be issued'}
+                continue
+        make_request = make_scenario(name, base_url, api_key, args, proxy_paths)
+        results[name] = [
+            asyncio.run(drive(make_request, concurrency, args.duration))
+            for concurrency in args.concurrency
+        ]
+    return results
+
+
+def start_server(name, port, args, env):
+    """Boot the app under gunicorn in a subprocess, logging to args.server_log"""
+    if args.mongomock:
+        # gunicorn is started from this script so the workers inherit the patched client
+        command = [sys.executable, os.path.abspath(__file__), '--serve-mongomock', str(port),
+                   '--workers', str(args.workers), '--threads', str(args.threads)]
+    else:
+        command = [
+            sys.executable, '-m', 'gunicorn',
+            '--bind', f'127.0.0.1:{port}',
+            '--workers', str(args.workers),
+            '--timeout', '120',
+            '--log-level', 'warning',
+        ]
+        if name == 'aiohttp':
+            command += ['--worker-class', 'aiohttp.GunicornWebWorker', 'aio_app:create_app']
+        else:
+            command += ['--worker-class', 'gthread', '--threads', str(args.threads), 'main:app']
+
+    with open(args.server_log, 'ab') as log:
+        process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    wait_for_port(port, process, name)
+    return process
+
+
+def serve_with_mongomock(port, workers, threads):
+    """Run the Flask app under gunicorn against an in-memory mongomock database"""
+    import mongomock
+    import pymongo
+    from gunicorn.app.base import BaseApplication
+
+    pymongo.MongoClient = mongomock.MongoClient
+    from app import app, api_keys_collection
+
+    api_keys_collection.insert_one(dict(
+        KEY_DOCUMENT,
+        api_key=os.environ['LOAD_TEST_API_KEY'],
+        created_at=datetime.utcnow(),
+        expires_at=datetime.utcnow() + timedelta(days=1)
+    ))
+
+    class Server(BaseApplication):
+        def load_config(self):
+            # The app is already loaded here, so forked workers share its database
+            for name, value in {'bind': f'127.0.0.1:{port}', 'workers': workers, 'worker_class': 'gthread',
+                                'threads': threads, 'timeout': 120, 'loglevel': 'warning'}.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+def compare(results, baseline):
+    """Relative change of RPS and latency percentiles against a previous run"""
+    changes = {}
+    metrics = ('requests_per_second', 'p50_ms', 'p95_ms', 'p99_ms', 'errors')
+    for server, scenarios in results.items():
+        for scenario, levels in scenarios.items():
+            previous = baseline.get('servers', {}).get(server, {}).get(scenario)
+            if not isinstance(levels, list) or not isinstance(previous, list):
+                continue
+            by_concurrency = {level['concurrency']: level for level in previous}
+            for level in levels:
+                before = by_concurrency.get(level['concurrency'])
+                if not before:
+                    continue
+                changes.setdefault(server, {}).setdefault(scenario, []).append(dict(
+                    {'concurrency': level['concurrency']},
+                    **{
+                        f'{metric}_change_pct': round((level[metric] - before[metric]) / before[metric] * 100, 1)
+                        for metric in metrics
+                        if before.get(metric) and metric in level
+                    }
+                ))
+    return changes
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                  capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', choices=SERVERS, default=['flask'])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=16, help='gthread threads per Flask worker')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per concurrency level')
+    parser.add_argument('--unique-queries', type=int, default=50,
+                        help='cycle through N queries (0 = every request is a cache miss)')
+    parser.add_argument('--proxy-songs', type=int, default=20, help='distinct tracks the proxy scenario replays')
+    parser.add_argument('--proxy-range', default='bytes=0-65535',
+                        help="Range header sent to /proxy/stream ('' fetches whole tracks)")
+    parser.add_argument('--latency', type=float, default=0.05, help='fake upstream latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of upstream API calls that fail')
+    parser.add_argument('--results', type=int, default=None, help='songs per upstream search response')
+    parser.add_argument('--audio-size', type=int, default=1024 * 1024, help='bytes per upstream audio file')
+    parser.add_argument('--mongomock', action='store_true', help='in-memory MongoDB instead of MONGO_URI')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare against')
+    parser.add_argument('--server-log', default=os.devnull, help='file receiving server output')
+    parser.add_argument('--serve-mongomock', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_mongomock:
+        serve_with_mongomock(args.serve_mongomock, args.workers, args.threads)
+        return
+
+    if args.mongomock and 'aiohttp' in args.servers:
+        parser.error('--mongomock only supports the flask server (aio_app needs motor and a real MongoDB)')
+
+    api_key = 'bench_' + secrets.token_hex(12)
+    upstream = start_in_thread('127.0.0.1', latency=args.latency, audio_size=args.audio_size,
+                               error_rate=args.error_rate, results=args.results)
+    env = dict(os.environ, JIOSAAVN_API_URL=upstream, LOAD_TEST_API_KEY=api_key)
+
+    api_keys = None
+    if args.mongomock:
+        # mongomock never connects, but it still resolves mongodb+srv:// URIs
+        env['MONGO_URI'] = 'mongodb://localhost:27017'
+        if args.workers > 1:
+            env.setdefault('PROXY_URL_MODE', 'token')
+            env.setdefault('PROXY_TOKEN_SECRET', secrets.token_hex(16))
+    else:
+        from pymongo import MongoClient
+        env['MONGO_URI'] = os.environ.get('MONGO_URI', 'mongodb://localhost:27017')
+        api_keys = MongoClient(env['MONGO_URI']).flaks_music_api.api_keys
+        api_keys.insert_one(dict(
+            KEY_DOCUMENT,
+            api_key=api_key,
+            created_at=datetime.utcnow(),
+            expires_at=datetime.utcnow() + timedelta(days=1)
+        ))
+
+    report = {
+        'revision': git_revision(),
+        'config': {
+            name: getattr(args, name)
+            for name in ('workers', 'threads', 'duration', 'unique_queries', 'proxy_songs', 'proxy_range',
+                         'latency', 'error_rate', 'results', 'audio_size', 'mongomock')
+        },
+        'servers': {}
+    }
+    report['config']['proxy_url_mode'] = env.get('PROXY_URL_MODE', 'mongo')
+    try:
+        for name in args.servers:
+            port = free_port()
+            process = start_server(name, port, args, env)
+            try:
+                report['servers'][name] = run_scenarios(f'http://127.0.0.1:{port}', api_key, args)
+            finally:
+                process.terminate()
+                process.wait(10)
+    finally:
+        if api_keys is not None:
+            api_keys.delete_one({"api_key": api_key})
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['baseline'] = {'revision': baseline.get('revision'), 'changes': compare(report['servers'], baseline)}
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /proxy/stream throughput, time to first byte and CPU cost
+
+Serves synthetic multi-megabyte tracks from a local origin (fake_saavn in a
+subprocess), boots one gunicorn worker and replays player sessions against
+signed proxy tokens: an opening "Range: bytes=0-" read of the whole track,
+a few seeks that read a little and abort, then a run of small Range requests.
+Each configuration (server x audio cache off/on x chunk size) is driven at
+rising concurrency. Reported per level: TTFB percentiles per request kind,
+per-stream and aggregate MB/s, and server CPU seconds per GB relayed. A level
+is sustainable when every stream outpaces --bitrate-kbps with headroom and
+opening TTFB p95 stays under --ttfb-slo; the highest such level is reported
+as max_streams for the worker.
+
+CPU is read from /proc, so the cpu figures need Linux. The aiohttp server
+needs a reachable MONGO_URI; the Flask one also runs with --mongomock.
+
+    python benchmarks/proxy_bench.py --mongomock --chunk-sizes 16384 65536 262144
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from benchmarks.compare_servers import free_port, wait_for_port
+from benchmarks.load_test import git_revision, percentile, start_server
+from proxy_tokens import ProxyTokenCodec
+
+REQUEST_KINDS = ('open', 'seek', 'range')
+
+
+def process_tree_cpu(root_pid):
+    """User + system CPU seconds of a process and all its descendants (Linux /proc)"""
+    children = defaultdict(list)
+    times = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; fields resume after its ')'
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        children[int(fields[1])].append(int(entry))
+        times[int(entry)] = int(fields[11]) + int(fields[12])
+
+    total, pending = 0, [root_pid]
+    while pending:
+        pid = pending.pop()
+        total += times.get(pid, 0)
+        pending.extend(children.get(pid, ()))
+    return total / os.sysconf('SC_CLK_TCK')
+
+
+async def timed_get(session, url, headers, limit=None):
+    """GET url; return (ttfb, seconds, bytes read, status). Stops reading after limit bytes."""
+    start = time.perf_counter()
+    async with session.get(url, headers=headers) as response:
+        if response.status not in (200, 206):
+            await response.read()
+            return None, time.perf_counter() - start, 0, response.status
+        first = await response.content.readany()
+        ttfb = time.perf_counter() - start
+        received = len(first)
+        while limit is None or received < limit:
+            chunk = await response.content.readany()
+            if not chunk:
+                break
+            received += len(chunk)
+        if limit is not None and received >= limit:
+            response.close()  # The player seeks away mid-body
+        return ttfb, time.perf_counter() - start, received, response.status
+
+
+async def player(session, url, args, samples, deadline):
+    """Loop player sessions against one track until the deadline"""
+    while time.perf_counter() < deadline:
+        requests = [('open', {'Range': 'bytes=0-'}, None)]
+        for _ in range(args.seeks):
+            offset = random.randrange(args.audio_size // 2)
+            requests.append(('seek', {'Range': f'bytes={offset}-'}, args.seek_read))
+        for _ in range(args.small_ranges):
+            offset = random.randrange(args.audio_size - args.range_size)
+            requests.append(('range', {'Range': f'bytes={offset}-{offset + args.range_size - 1}'}, None))
+
+        for kind, headers, limit in requests:
+            try:
+                ttfb, seconds, received, status = await timed_get(session, url, headers, limit)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                samples['errors'] += 1
+                continue
+            if ttfb is None:
+                samples['errors'] += 1
+                continue
+            samples['bytes'] += received
+            samples['ttfb'][kind].append(ttfb)
+            if kind == 'open':
+                samples['stream_mbps'].append(received / seconds / 1e6)
+        samples['sessions'] += 1
+
+
+async def drive(urls, concurrency, args):
+    samples = {'ttfb': defaultdict(list), 'stream_mbps': [], 'bytes': 0, 'errors': 0, 'sessions': 0}
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as session:
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            player(session, urls[index % len(urls)], args, samples, deadline)
+            for index in range(concurrency)
+        ))
+        samples['elapsed'] = time.perf_counter() - started
+    return samples
+
+
+def summarize(concurrency, samples, cpu_seconds, args):
+    result = {
+        'concurrency': concurrency,
+        'sessions': samples['sessions'],
+        'errors': samples['errors'],
+        'aggregate_mb_per_second': round(samples['bytes'] / samples['elapsed'] / 1e6, 2),
+        'cpu_seconds': round(cpu_seconds, 2),
+        'cpu_seconds_per_gb': round(cpu_seconds / (samples['bytes'] / 1e9), 2) if samples['bytes'] else None,
+        'ttfb_ms': {}
+    }
+    for kind in REQUEST_KINDS:
+        values = sorted(samples['ttfb'][kind])
+        if values:
+            result['ttfb_ms'][kind] = {
+                'count': len(values),
+                'p50': round(percentile(values, 0.50) * 1000, 2),
+                'p95': round(percentile(values, 0.95) * 1000, 2),
+                'p99': round(percentile(values, 0.99) * 1000, 2)
+            }
+    rates = sorted(samples['stream_mbps'])
+    if rates:
+        result['stream_mb_per_second'] = {
+            'min': round(rates[0], 2),
+            'p05': round(percentile(rates, 0.05), 2),
+            'p50': round(percentile(rates, 0.50), 2)
+        }
+
+    # A player needs its bitrate plus headroom to keep its buffer from draining
+    needed = args.bitrate_kbps * 1000 / 8 / 1e6 * args.headroom
+    open_ttfb = result['ttfb_ms'].get('open')
+    result['sustainable'] = bool(
+        rates and not samples['errors']
+        and rates[0] >= needed
+        and open_ttfb and open_ttfb['p95'] <= args.ttfb_slo * 1000
+    )
+    return result
+
+
+async def warm(urls):
+    """Fetch every track once so the disk cache holds it before measuring"""
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
+        for url in urls:
+            async with session.get(url) as response:
+                await response.read()
+
+
+def start_origin(args):
+    port = free_port()
+    command = [sys.executable, os.path.join(ROOT, 'benchmarks', 'fake_saavn.py'),
+               '--port', str(port), '--audio-size', str(args.audio_size)]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port, process, 'origin')
+    return process, f'http://127.0.0.1:{port}'
+
+
+def run_configuration(server, cache, chunk_size, origin, args):
+    secret = secrets.token_hex(16)
+    codec = ProxyTokenCodec(secret)
+    cache_dir = tempfile.mkdtemp(prefix='proxy_bench_')
+    env = dict(
+        os.environ,
+        PROXY_URL_MODE='token',
+        PROXY_TOKEN_SECRET=secret,
+        PROXY_CHUNK_SIZE=str(chunk_size),
+        AUDIO_CACHE_DIR=cache_dir,
+        AUDIO_CACHE_MAX_BYTES=str(args.audio_size * args.tracks * 2 if cache else 0),
+        LOAD_TEST_API_KEY='bench_' + secrets.token_hex(12)
+    )
+    if args.mongomock:
+        env['MONGO_URI'] = 'mongodb://localhost:27017'
+
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    # No song id in the tokens: an expired origin URL should fail, not re-resolve
+    urls = [
+        f"{base_url}/proxy/stream/{codec.encode(f'{origin}/audio/track{index}_320.mp4', 3600)}"
+        for index in range(args.tracks)
+    ]
+
+    server_args = SimpleNamespace(mongomock=args.mongomock, workers=1, threads=args.threads,
+                                  server_log=args.server_log)
+    process = start_server(server, port, server_args, env)
+    levels = []
+    try:
+        if cache:
+            asyncio.run(warm(urls))
+        for concurrency in args.concurrency:
+            cpu_before = process_tree_cpu(process.pid)
+            samples = asyncio.run(drive(urls, concurrency, args))
+            levels.append(summarize(concurrency, samples, process_tree_cpu(process.pid) - cpu_before, args))
+            if args.stop_when_unsustainable and not levels[-1]['sustainable']:
+                break
+    finally:
+        process.terminate()
+        process.wait(10)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    max_streams = 0
+    for level in levels:
+        if not level['sustainable']:
+            break
+        max_streams = level['concurrency']
+    return {'max_streams': max_streams, 'levels': levels}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', choices=('flask', 'aiohttp'), default=['flask'])
+    parser.add_argument('--cache', nargs='+', choices=('off', 'on'), default=['off', 'on'],
+                        help='run with the on-disk audio cache disabled and/or enabled')
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[16384, 65536, 262144])
+    parser.add_argument('--threads', type=int, default=16, help='gthread threads of the Flask worker')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 32, 64])
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per concurrency level')
+    parser.add_argument('--stop-when-unsustainable', action='store_true',
+                        help='skip higher concurrency levels once one is unsustainable')
+    parser.add_argument('--audio-size', type=int, default=8 * 1024 * 1024, help='bytes per synthetic track')
+    parser.add_argument('--tracks', type=int, default=8, help='distinct tracks the players cycle through')
+    parser.add_argument('--seeks', type=int, default=2, help='seeks per player session')
+    parser.add_argument('--seek-read', type=int, default=512 * 1024, help='bytes read after each seek')
+    parser.add_argument('--small-ranges', type=int, default=8, help='small Range requests per session')
+    parser.add_argument('--range-size', type=int, default=64 * 1024, help='bytes per small Range request')
+    parser.add_argument('--bitrate-kbps', type=int, default=320, help='playback bitrate a stream must sustain')
+    parser.add_argument('--headroom', type=float, default=4.0, help='required multiple of the bitrate')
+    parser.add_argument('--ttfb-slo', type=float, default=0.5, help='max opening TTFB p95 in seconds')
+    parser.add_argument('--mongomock', action='store_true', help='in-memory MongoDB instead of MONGO_URI')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--server-log', default=os.devnull, help='file receiving server output')
+    args = parser.parse_args()
+
+    if args.mongomock and 'aiohttp' in args.servers:
+        parser.error('--mongomock only supports the flask server (aio_app needs motor and a real MongoDB)')
+
+    origin_process, origin = start_origin(args)
+    report = {
+        'revision': git_revision(),
+        'config': {
+            name: getattr(args, name)
+            for name in ('threads', 'duration', 'audio_size', 'tracks', 'seeks', 'seek_read', 'small_ranges',
+                         'range_size', 'bitrate_kbps', 'headroom', 'ttfb_slo', 'mongomock')
+        },
+        'results': {}
+    }
+    try:
+        for server in args.servers:
+            for cache in args.cache:
+                for chunk_size in args.chunk_sizes:
+                    name = f'{server}/cache-{cache}/chunk-{chunk_size}'
+                    report['results'][name] = run_configuration(server, cache == 'on', chunk_size, origin, args)
+                    print(f"{name}: max_streams={report['results'][name]['max_streams']}", file=sys.stderr)
+    finally:
+        origin_process.terminate()
+        origin_process.wait(10)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker for one upstream source"""
+
+    def __init__(self, name, failure_rate=0.5, min_calls=5, window=60, open_seconds=30, probe_timeout=20):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout
+
+        self._lock = threading.Lock()
+        self._outcomes = deque()  # (timestamp, succeeded) within the rolling window
+        self.state = CLOSED
+        self.opened_at = None
+        self._probe_started = None
+
+        self.rejected = 0
+        self.times_opened = 0
+        self.last_failure = None
+
+    def _trim(self, now):
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self._probe_started = None
+        self.times_opened += 1
+        logger.warning(f"Circuit for {self.name} opened; skipping it for {self.open_seconds}s")
+
+    def allow(self):
+        """True if a call may go upstream; an open circuit lets one probe through after open_seconds"""
+        now = time.time()
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+            # Half-open: one probe at a time; a probe that never reported back is replaced
+            if self.state == HALF_OPEN and (self._probe_started is None or now - self._probe_started >= self.probe_timeout):
+                self._probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def is_open(self):
+        """True while calls are being skipped (and counts one as skipped); does not claim the half-open probe"""
+        with self._lock:
+            skipped = self.state == OPEN and time.time() - self.opened_at < self.open_seconds
+            if skipped:
+                self.rejected += 1
+            return skipped
+
+    def record_success(self):
+        now = time.time()
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit for {self.name} closed after a successful probe")
+                self.state = CLOSED
+                self.opened_at = None
+                self._probe_started = None
+                self._outcomes.clear()
+            self._outcomes.append((now, True))
+            self._trim(now)
+
+    def record_failure(self, reason=''):
+        now = time.time()
+        with self._lock:
+            self.last_failure = {'at': now, 'reason': str(reason)[:200]}
+            if self.state == HALF_OPEN:
+                self._open(now)
+                return
+            if self.state == OPEN:
+                return
+            self._outcomes.append((now, False))
+            self._trim(now)
+            calls = len(self._outcomes)
+            failures = sum(1 for _, succeeded in self._outcomes if not succeeded)
+            if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                self._open(now)
+
+    def get_stats(self):
+        now = time.time()
+        with self._lock:
+            self._trim(now)
+            calls = len(self._outcomes)
+            failures = sum(1 for _, succeeded in self._outcomes if not succeeded)
+            state = self.state
+            if state == OPEN and now - self.opened_at >= self.open_seconds:
+                state = HALF_OPEN  # The next call will probe
+            return {
+                'state': state,
+                'calls': calls,
+                'failures': failures,
+                'failure_rate': round(failures / calls, 4) if calls else 0.0,
+                'rejected': self.rejected,
+                'times_opened': self.times_opened,
+                'retry_in': max(0, round(self.opened_at + self.open_seconds - now, 1)) if state == OPEN else None,
+                'last_failure': self.last_failure
+            }
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name):
+    """Process-wide breaker for an upstream source, configured from BREAKER_* settings"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(
+                name,
+                failure_rate=float(os.environ.get('BREAKER_FAILURE_RATE', 0.5)),
+                min_calls=int(os.environ.get('BREAKER_MIN_CALLS', 5)),
+                window=int(os.environ.get('BREAKER_WINDOW', 60)),
+                open_seconds=int(os.environ.get('BREAKER_OPEN_SECONDS', 30))
+            )
+        return breaker
+
+def get_all_stats():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.get_stats() for breaker in breakers}
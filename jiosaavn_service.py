@@ -1,19 +1,27 @@
 import aiohttp
 import asyncio
 import logging
+import os
 from typing import Dict, List, Optional
 
+import metrics
+from circuit_breaker import CLOSED, get_breaker
+
 logger = logging.getLogger(__name__)
 
 class JioSaavnService:
     """JioSaavn service for music search and 320kbps streaming - Optimized"""
     
-    def __init__(self):
-        self.base_url = "https://saavn.dev/api"
-        self.search_url = "https://saavn.dev/api/search/songs"
-        self.song_details_url = "https://saavn.dev/api/songs"
+    def __init__(self, base_url=None, catalog=None):
+        # Optional SongCatalog that records every song the API returns
+        self.catalog = catalog
+        # Shared by every JioSaavnService in the process: an outage is skipped, not waited out
+        self.breaker = get_breaker('jiosaavn')
+        self.base_url = (base_url or os.environ.get("JIOSAAVN_API_URL", "https://saavn.dev/api")).rstrip('/')
+        self.search_url = f"{self.base_url}/search/songs"
+        self.song_details_url = f"{self.base_url}/songs"
         
-        # Connection settings - will be created when needed
+        # Connection settings for the shared session - created on first use
         self.connector_settings = {
             'limit': 20,
             'limit_per_host': 10, 
@@ -22,9 +30,51 @@ class JioSaavnService:
             'keepalive_timeout': 15
         }
         self.session = None
+        self._session_loop = None
+        self._session_pid = None
+    
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Return the pooled session, creating it on the running loop if needed"""
+        loop = asyncio.get_running_loop()
         
+        if self.session is not None and not self.session.closed:
+            if self._session_pid == os.getpid() and self._session_loop is loop:
+                return self.session
+            # Inherited through fork() or bound to another loop: its sockets are not
+            # ours to use or close, so just drop the reference
+            logger.debug("Discarding JioSaavn session from another process or event loop")
+        
+        connector = aiohttp.TCPConnector(**self.connector_settings)
+        self.session = aiohttp.ClientSession(connector=connector)
+        self._session_loop = loop
+        self._session_pid = os.getpid()
+        return self.session
+    
+    async def close(self):
+        """Close the pooled session (must run on the loop that owns it)"""
+        session = self.session
+        if session is None or session.closed or self._session_pid != os.getpid():
+            return
+        if self._session_loop is not asyncio.get_running_loop():
+            logger.warning("JioSaavn session close() called from a foreign event loop; skipping")
+            return
+        self.session = None
+        await session.close()
+        
+    def _record_status(self, status):
+        """Feed an upstream HTTP status to the breaker; only server-side errors count as failures"""
+        if status >= 500 or status == 429:
+            self.breaker.record_failure(f"HTTP {status}")
+        else:
+            self.breaker.record_success()
+    
     async def search_songs(self, query: str) -> List[Dict]:
         """Search for songs on JioSaavn using proxy API"""
+        if not self.breaker.allow():
+            logger.debug(f"JioSaavn circuit open, skipping search for: {query}")
+            metrics.stage_duration.observe(0.0, stage='jiosaavn_search', source='jiosaavn', outcome='skipped')
+            return []
+        
         try:
             params = {
                 'query': query,
@@ -32,19 +82,22 @@ class JioSaavnService:
                 'limit': 3  # Reduced for faster response
             }
             
-            # Use faster timeout and optimized connection
+            # Use faster timeout and the pooled keep-alive connection
             timeout = aiohttp.ClientTimeout(total=5, connect=2)
-            connector = aiohttp.TCPConnector(**self.connector_settings)
+            session = await self.get_session()
             
-            async with aiohttp.ClientSession(connector=connector) as session:
+            with metrics.span('jiosaavn_search', source='jiosaavn') as span:
                 async with session.get(self.search_url, params=params, timeout=timeout) as response:
+                    self._record_status(response.status)
                     if response.status == 200:
                         data = await response.json()
-                        
+                    
                         # Extract songs from response
                         songs = []
                         results = data.get('data', {}).get('results', [])
-                        
+                        if self.catalog:
+                            self.catalog.add([self.catalog.from_api_song(song) for song in results])
+                    
                         for song in results:
                             songs.append({
                                 'id': song.get('id', ''),
@@ -53,45 +106,61 @@ class JioSaavnService:
                                 'image': song.get('image', [{}])[-1].get('url', '') if song.get('image') else '',
                                 'download_url': song.get('downloadUrl', [{}])[-1].get('url', '') if song.get('downloadUrl') else ''
                             })
-                        
+                    
                         logger.debug(f"Found {len(songs)} songs on JioSaavn for: {query}")
+                        span.outcome = 'ok' if songs else 'empty'
                         return songs
                     else:
+                        span.outcome = 'http_error'
                         logger.warning(f"JioSaavn search failed with status: {response.status}")
                         return []
                         
         except Exception as e:
+            self.breaker.record_failure(e)
             logger.error(f"JioSaavn search error: {str(e)}")
             return []
     
     async def get_song_details(self, song_id: str) -> Optional[Dict]:
         """Get detailed song information with download URLs"""
+        if not self.breaker.allow():
+            logger.debug(f"JioSaavn circuit open, skipping details for {song_id}")
+            metrics.stage_duration.observe(0.0, stage='jiosaavn_details', source='jiosaavn', outcome='skipped')
+            return None
+        
         try:
             url = f"{self.song_details_url}/{song_id}"
             
-            async with aiohttp.ClientSession() as session:
+            session = await self.get_session()
+            with metrics.span('jiosaavn_details', outcome='empty', source='jiosaavn') as span:
                 async with session.get(url, timeout=aiohttp.ClientTimeout(total=15)) as response:
-                    if response.status == 200:
+                    self._record_status(response.status)
+                    if response.status != 200:
+                        span.outcome = 'http_error'
+                    else:
                         data = await response.json()
-                        
+                    
                         if 'data' in data and len(data['data']) > 0:
                             song_data = data['data'][0]
-                            
+                            if self.catalog:
+                                self.catalog.add([self.catalog.from_api_song(song_data)])
+                        
                             # Get highest quality download URL
                             download_urls = song_data.get('downloadUrl', [])
                             stream_url = ''
-                            
+                        
                             # Look for 320kbps first
                             for url_obj in download_urls:
                                 if url_obj.get('quality') == '320kbps':
                                     stream_url = url_obj.get('url', '')
                                     break
-                            
+                        
                             # Fallback to highest quality
                             if not stream_url and download_urls:
                                 stream_url = download_urls[-1].get('url', '')
-                            
+                        
+                            span.outcome = 'ok'
                             return {
+                                'song_id': song_data.get('id', song_id),
                                 'stream_url': stream_url,
                                 'title': song_data.get('name', ''),
                                 'album': song_data.get('album', {}).get('name', '') if song_data.get('album') else '',
@@ -99,14 +168,19 @@ class JioSaavnService:
                                 'duration': song_data.get('duration', ''),
                                 'image': song_data.get('image', [{}])[-1].get('url', '') if song_data.get('image') else ''
                             }
-                            
+                        
         except Exception as e:
+            self.breaker.record_failure(e)
             logger.error(f"Error getting JioSaavn song details for {song_id}: {str(e)}")
             return None
     
     async def search_and_get_stream(self, query: str, max_attempts: int = 2) -> Optional[Dict]:
         """Search for a song and get its streaming URL - Optimized for speed"""
         for attempt in range(max_attempts):
+            if self.breaker.is_open():
+                # Fail fast instead of spending the attempts and sleeps on a source that is down
+                logger.debug(f"JioSaavn circuit open, giving up on: {query}")
+                return None
             try:
                 logger.debug(f"JioSaavn attempt {attempt + 1}/{max_attempts} for: {query}")
                 
@@ -115,7 +189,7 @@ class JioSaavnService:
                 
                 if not songs:
                     logger.debug(f"No songs found on attempt {attempt + 1}")
-                    if attempt < max_attempts - 1:
+                    if attempt < max_attempts - 1 and self.breaker.state == CLOSED:
                         await asyncio.sleep(0.5)  # Faster retry
                     continue
                 
@@ -124,6 +198,7 @@ class JioSaavnService:
                     # First check if we already have download_url from search (fastest)
                     if song.get('download_url'):
                         return {
+                            'song_id': song['id'],
                             'stream_url': song['download_url'],
                             'title': song['title'],
                             'artists': song['subtitle'],
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+def check_key_data(key_data, cost=1):
+    """Check an API key document; returns (is_valid, message)"""
+    if not key_data:
+        return False, "Invalid API key"
+    
+    if not key_data.get("is_active", False):
+        return False, "API key is inactive"
+    
+    # Check expiry date if it exists
+    if key_data.get("expires_at"):
+        if key_data.get("expires_at") < datetime.utcnow():
+            return False, "API key has expired"
+    elif key_data.get("expiry_date"):
+        # Handle string date format
+        expiry_str = key_data.get("expiry_date")
+        try:
+            expiry_date = datetime.strptime(expiry_str, "%Y-%m-%d")
+            if expiry_date < datetime.utcnow():
+                return False, "API key has expired"
+        except:
+            pass  # Skip validation if date format is invalid
+    
+    # Check daily limit
+    if key_data.get("requests_today", 0) + cost > key_data.get("daily_limit", 1000):
+        if cost > 1:
+            return False, "Batch exceeds remaining daily request limit"
+        return False, "Daily request limit exceeded"
+    
+    return True, "Valid"
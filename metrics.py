@@ -0,0 +1,177 @@
+import bisect
+import functools
+import hmac
+import inspect
+import os
+import threading
+import time
+
+# Upper bounds in seconds; spans range from sub-millisecond cache hits to 15 s upstream timeouts
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+# Search sources a client may ask for. Label values that come from request input
+# are mapped onto this set, so junk input cannot create new series
+SOURCE_LABELS = frozenset(['auto', 'jiosaavn', 'hybrid', 'youtube', 'free'])
+
+def source_label(source):
+    return source if source in SOURCE_LABELS else 'other'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + list(extra or ())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in items) + '}'
+
+def quantile_from_counts(buckets, counts, q, count=None):
+    """Estimate a quantile from per-bucket counts (last count is +Inf) by interpolating inside its bucket"""
+    if count is None:
+        count = sum(counts)
+    if not count:
+        return 0.0
+    rank = q * count
+    cumulative = 0
+    for index, bucket_count in enumerate(counts):
+        if cumulative + bucket_count >= rank and bucket_count:
+            if index >= len(buckets):
+                return buckets[-1]  # Beyond the last bound: report the bound
+            lower = buckets[index - 1] if index else 0.0
+            upper = buckets[index]
+            return lower + (upper - lower) * (rank - cumulative) / bucket_count
+        cumulative += bucket_count
+    return buckets[-1]
+
+class _Series:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+class Histogram:
+    """Fixed-bucket latency histogram family with label sets, cheap enough for every request"""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, seconds)  # len(buckets) is the +Inf bucket
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(len(self.buckets) + 1)
+            series.counts[index] += 1
+            series.sum += seconds
+            series.count += 1
+
+    def _snapshot(self):
+        with self._lock:
+            return [(key, list(s.counts), s.sum, s.count) for key, s in self._series.items()]
+
+    def quantile(self, q, counts, count):
+        return quantile_from_counts(self.buckets, counts, q, count)
+
+    def render(self):
+        """Prometheus text exposition: the histogram plus a gauge family of estimated quantiles"""
+        snapshot = sorted(self._snapshot())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+
+        quantile_name = f"{self.name}_quantile"
+        lines.append(f"# HELP {quantile_name} Estimated quantiles of {self.name} since worker start")
+        lines.append(f"# TYPE {quantile_name} gauge")
+        for key, counts, total, count in snapshot:
+            for q in QUANTILES:
+                lines.append(f"{quantile_name}{_format_labels(key, [('quantile', q)])} {self.quantile(q, counts, count):.6f}")
+        return '\n'.join(lines)
+
+    def summary(self):
+        """Per label set count, mean and estimated percentiles, for JSON views"""
+        result = []
+        for key, counts, total, count in sorted(self._snapshot()):
+            entry = dict(key)
+            entry['count'] = count
+            entry['mean_ms'] = round(total / count * 1000, 2) if count else 0.0
+            for q in QUANTILES:
+                entry[f"p{int(q * 100)}_ms"] = round(self.quantile(q, counts, count) * 1000, 2)
+            result.append(entry)
+        return result
+
+class Span:
+    """Times a block into the stage histogram; outcome is 'error' if it raises, else whatever was set"""
+    __slots__ = ('stage', 'labels', 'outcome', 'start')
+
+    def __init__(self, stage, outcome='ok', **labels):
+        self.stage = stage
+        self.labels = labels
+        self.outcome = outcome
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        outcome = self.outcome
+        if exc_type is not None:
+            # A cancelled race loser is not an upstream error
+            outcome = 'cancelled' if exc_type.__name__ == 'CancelledError' else 'error'
+        stage_duration.observe(time.perf_counter() - self.start, stage=self.stage, outcome=outcome, **self.labels)
+        return False
+
+request_duration = Histogram(
+    'flaks_request_duration_seconds',
+    'HTTP request latency by endpoint, method and status'
+)
+stage_duration = Histogram(
+    'flaks_stage_duration_seconds',
+    'Latency of the stages inside a request by stage, source and outcome'
+)
+
+def span(stage, outcome='ok', **labels):
+    """with span('jiosaavn_search', source='jiosaavn') as s: ...; s.outcome = 'miss'"""
+    return Span(stage, outcome=outcome, **labels)
+
+def timed(stage, **labels):
+    """Decorator form of span for source lookups: outcome is 'ok' on a result, 'miss' on None"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with Span(stage, **labels) as s:
+                    result = await func(*args, **kwargs)
+                    s.outcome = 'ok' if result else 'miss'
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Span(stage, **labels) as s:
+                result = func(*args, **kwargs)
+                s.outcome = 'ok' if result else 'miss'
+                return result
+        return wrapper
+    return decorator
+
+def render():
+    return '\n'.join([request_duration.render(), stage_duration.render()]) + '\n'
+
+def is_authorized(token):
+    """/metrics is open unless METRICS_TOKEN is set"""
+    expected = os.environ.get('METRICS_TOKEN')
+    return not expected or hmac.compare_digest((token or '').encode(), expected.encode())
@@ -1,7 +1,43 @@
 from datetime import datetime, timedelta
-from app import api_keys_collection, usage_stats_collection, admin_users_collection
+from app import api_keys_collection, usage_stats_collection, usage_rollups_collection, admin_users_collection
+from key_validation import check_key_data
+from ttl_cache import TTLCache
+from usage_writer import UsageWriter
+import usage_analytics
+import usage_rollups
+import os
 import secrets
 import string
+import threading
+
+# In-process cache of key documents: changes made by other workers become
+# visible within API_KEY_CACHE_TTL seconds; local changes invalidate at once
+api_key_cache = TTLCache(
+    max_entries=int(os.environ.get("API_KEY_CACHE_SIZE", 10000)),
+    default_ttl=float(os.environ.get("API_KEY_CACHE_TTL", 5))
+)
+api_key_cache_lock = threading.Lock()
+
+# Usage counters, rollups and request logs are written behind the response in batches
+usage_writer = None
+if os.environ.get("USAGE_WRITE_BEHIND", "true").lower() == "true":
+    usage_writer = UsageWriter(
+        api_keys_collection,
+        usage_stats_collection,
+        max_queue=int(os.environ.get("USAGE_WRITE_QUEUE_SIZE", 10000)),
+        batch_size=int(os.environ.get("USAGE_WRITE_BATCH_SIZE", 500)),
+        flush_interval=float(os.environ.get("USAGE_WRITE_FLUSH_INTERVAL", 1.0)),
+        usage_rollups_collection=usage_rollups_collection
+    )
+
+usage_analytics.ensure_indexes(usage_stats_collection)
+usage_rollups.ensure_indexes(usage_rollups_collection)
+
+# Key fields the admin dashboard displays
+KEY_LIST_PROJECTION = {
+    "_id": 0, "api_key": 1, "owner_name": 1, "daily_limit": 1, "requests_today": 1,
+    "total_requests": 1, "expires_at": 1, "is_active": 1
+}
 
 class APIKey:
     @staticmethod
@@ -25,64 +61,89 @@ class APIKey:
             "last_used": None
         }
         api_keys_collection.insert_one(key_data)
+        api_key_cache.delete(api_key)
         return api_key
     
     @staticmethod
     def get_api_key(api_key):
-        """Get API key data"""
-        return api_keys_collection.find_one({"api_key": api_key})
+        """Get API key data (served from the short-TTL local cache when fresh)"""
+        cached = api_key_cache.get(api_key)
+        if cached is not None:
+            return cached or None  # {} marks a key known not to exist
+        
+        key_data = api_keys_collection.find_one({"api_key": api_key})
+        api_key_cache.set(api_key, key_data or {})
+        return key_data
     
     @staticmethod
-    def validate_api_key(api_key):
-        """Validate API key and check limits"""
-        key_data = api_keys_collection.find_one({"api_key": api_key})
-        
-        if not key_data:
-            return False, "Invalid API key"
-        
-        if not key_data.get("is_active", False):
-            return False, "API key is inactive"
-        
-        # Check expiry date if it exists
-        if key_data.get("expires_at"):
-            if key_data.get("expires_at") < datetime.utcnow():
-                return False, "API key has expired"
-        elif key_data.get("expiry_date"):
-            # Handle string date format
-            expiry_str = key_data.get("expiry_date")
-            try:
-                expiry_date = datetime.strptime(expiry_str, "%Y-%m-%d")
-                if expiry_date < datetime.utcnow():
-                    return False, "API key has expired"
-            except:
-                pass  # Skip validation if date format is invalid
-        
-        # Check daily limit
-        if key_data.get("requests_today", 0) >= key_data.get("daily_limit", 1000):
-            return False, "Daily request limit exceeded"
+    def validate_api_key(api_key, cost=1):
+        """Validate API key and check that `cost` more requests fit in today's limit"""
+        return check_key_data(APIKey.get_api_key(api_key), cost)
+    
+    @staticmethod
+    def increment_usage(api_key, count=1):
+        """Increment API key usage by `count` requests in one atomic update"""
+        if usage_writer:
+            usage_writer.increment_usage(api_key, count)
+        else:
+            api_keys_collection.update_one(
+                {"api_key": api_key},
+                {
+                    "$inc": {"requests_today": count, "total_requests": count},
+                    "$set": {"last_used": datetime.utcnow()}
+                }
+            )
         
-        return True, "Valid"
+        APIKey._adjust_cached_usage(api_key, count)
     
     @staticmethod
-    def increment_usage(api_key):
-        """Increment API key usage"""
-        api_keys_collection.update_one(
-            {"api_key": api_key},
+    def reserve_usage(api_key, count):
+        """
+        Charge `count` requests at once, only if they still fit in today's limit.
+        The check and the charge are one conditional update, so concurrent
+        batches cannot overshoot the limit together; returns False when they do not fit.
+        """
+        key_data = APIKey.get_api_key(api_key) or {}
+        limit = key_data.get("daily_limit", 1000)
+        result = api_keys_collection.update_one(
+            {"api_key": api_key, "requests_today": {"$lte": limit - count}},
             {
-                "$inc": {"requests_today": 1, "total_requests": 1},
+                "$inc": {"requests_today": count, "total_requests": count},
                 "$set": {"last_used": datetime.utcnow()}
             }
         )
+        if not result.modified_count:
+            return False
+        APIKey._adjust_cached_usage(api_key, count)
+        return True
+    
+    @staticmethod
+    def _adjust_cached_usage(api_key, count):
+        # Keep the local view of the counters current so the quota check stays tight
+        with api_key_cache_lock:
+            key_data, ttl = api_key_cache.get_with_ttl(api_key)
+            if key_data:
+                key_data = dict(key_data)
+                key_data["requests_today"] = key_data.get("requests_today", 0) + count
+                key_data["total_requests"] = key_data.get("total_requests", 0) + count
+                api_key_cache.set(api_key, key_data, ttl=ttl)
     
     @staticmethod
     def get_all_keys():
-        """Get all API keys for admin panel"""
-        return list(api_keys_collection.find())
+        """Get all API keys for admin panel (displayed fields only)"""
+        return list(api_keys_collection.find({}, KEY_LIST_PROJECTION))
+    
+    @staticmethod
+    def count_keys():
+        """(total, active) key counts without loading the documents"""
+        return api_keys_collection.count_documents({}), api_keys_collection.count_documents({"is_active": True})
     
     @staticmethod
     def delete_api_key(api_key):
         """Delete an API key"""
-        return api_keys_collection.delete_one({"api_key": api_key})
+        result = api_keys_collection.delete_one({"api_key": api_key})
+        api_key_cache.delete(api_key)
+        return result
     
     @staticmethod
     def reset_daily_counters():
@@ -91,19 +152,40 @@ class APIKey:
             {},
             {"$set": {"requests_today": 0}}
         )
+        api_key_cache.clear()
 
 class UsageStats:
     @staticmethod
     def log_request(api_key, endpoint, query, response_time, success):
-        """Log API request for analytics"""
-        usage_stats_collection.insert_one({
-            "api_key": api_key,
-            "endpoint": endpoint,
-            "query": query,
-            "response_time": response_time,
-            "success": success,
-            "timestamp": datetime.utcnow()
-        })
+        """Count an API request in the per-minute rollups; a sample is also kept as a raw log"""
+        UsageStats.log_requests([(api_key, endpoint, query, response_time, success)])
+    
+    @staticmethod
+    def log_requests(entries):
+        """Log several API requests in one round trip; entries are log_request argument tuples"""
+        if not entries:
+            return
+        timestamp = datetime.utcnow()
+        documents = [
+            {
+                "api_key": api_key,
+                "endpoint": endpoint,
+                "query": query,
+                "response_time": response_time,
+                "success": success,
+                "timestamp": timestamp
+            }
+            for api_key, endpoint, query, response_time, success in entries
+        ]
+        keep_raw = [usage_rollups.keep_raw_log(document["success"]) for document in documents]
+        if usage_writer:
+            for document, keep in zip(documents, keep_raw):
+                usage_writer.log_request(document, keep_raw=keep)
+        else:
+            usage_rollups_collection.bulk_write(usage_rollups.build_rollup_operations(documents), ordered=False)
+            raw_documents = [document for document, keep in zip(documents, keep_raw) if keep]
+            if raw_documents:
+                usage_stats_collection.insert_many(raw_documents, ordered=False)
     
     @staticmethod
     def get_usage_stats(api_key=None, days=7):
@@ -113,3 +195,14 @@ class UsageStats:
             match_filter["api_key"] = api_key
         
         return list(usage_stats_collection.find(match_filter).sort("timestamp", -1))
+    
+    @staticmethod
+    def get_usage_summary(api_key=None, days=7):
+        """Counts, success rate and latency percentiles overall, per key and per day, from the rollups"""
+        return usage_analytics.summarize_rollups(usage_rollups_collection, days=days, api_key=api_key)
+    
+    @staticmethod
+    def get_usage_logs(page=1, per_page=50, api_key=None, days=7):
+        """One page of raw (sampled) request logs, newest first"""
+        return usage_analytics.get_usage_logs(usage_stats_collection, page=page, per_page=per_page,
+                                              api_key=api_key, days=days)
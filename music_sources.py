@@ -5,28 +5,193 @@ import time
 from urllib.parse import quote
 import re
 import base64
+import os
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from async_runner import async_runner
+from circuit_breaker import get_breaker
 from jiosaavn_service import JioSaavnService
+from query_classifier import default_classifier as lyrics_classifier
+from search_cache import SearchCache
+from single_flight import SingleFlight, MongoLease
+from song_catalog import create_song_catalog
+from trending_cache import TRENDING_SOURCES, TrendingCache
 from youtube_search_service import YouTubeSearchService
 
 class MusicSources:
-    def __init__(self):
+    def __init__(self, runner=None, mongo_client=None, coalesce_across_workers=None,
+                 race_mode=None, race_budget=None):
+        # Async services run on one long-lived loop per worker instead of a loop per call
+        self.runner = runner or async_runner
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
-        self.jiosaavn_service = JioSaavnService()
+        # Every song JioSaavn returns is catalogued so repeat and misspelled queries resolve locally
+        self.song_catalog = create_song_catalog(mongo_client)
+        self.jiosaavn_service = JioSaavnService(catalog=self.song_catalog)
+        # Close the pooled JioSaavn session on the loop that owns it at worker exit
+        self.runner.add_shutdown_callback(self.jiosaavn_service.close)
         self.youtube_service = YouTubeSearchService()
+        # Per-source breakers: a source that keeps failing is skipped instead of timing out every call
+        self.jiosaavn_breaker = self.jiosaavn_service.breaker
+        self.free_music_breaker = get_breaker('freemusicarchive')
+        self.search_cache = SearchCache(mongo_client=mongo_client)
+        
+        # Identical concurrent searches share one upstream resolution
+        self.single_flight = SingleFlight()
+        if coalesce_across_workers is None:
+            coalesce_across_workers = os.environ.get('SEARCH_COALESCE_ACROSS_WORKERS', 'false').lower() == 'true'
+        self.search_lease = MongoLease(mongo_client) if (mongo_client and coalesce_across_workers) else None
+        
+        # Racing mode starts the candidate sources concurrently instead of one after another
+        if race_mode is None:
+            race_mode = os.environ.get('SEARCH_RACE_MODE', 'false').lower() == 'true'
+        self.race_mode = race_mode
+        self.race_budget = race_budget or float(os.environ.get('SEARCH_RACE_BUDGET', 6.0))
+        self._async_in_flight = {}
+        
+        # Blocking (requests-based) fallbacks get their own bounded pool instead of the
+        # loop's default executor, so abandoned race contestants cannot crowd it out
+        self.blocking_workers = int(os.environ.get('SEARCH_BLOCKING_WORKERS', 4))
+        self._blocking_executor = None
+        self._blocking_executor_pid = None
+        
+        # Trending is the same for every caller, so it is refreshed in the background
+        # and requests are answered from memory, stale-while-revalidate
+        self.trending_cache = TrendingCache(
+            self.fetch_trending,
+            refresh_interval=int(os.environ.get('TRENDING_REFRESH_INTERVAL', 600)),
+            cold_wait=float(os.environ.get('TRENDING_COLD_WAIT', 2.0))
+        )
     
     def search_music(self, query, source="auto"):
+        """Search for music with a two-tier result cache in front of the source cascade"""
+        start_time = time.time()
+        
+        with metrics.span('cache_lookup', source=metrics.source_label(source)) as span:
+            result = self.search_cache.get(query, source)
+            span.outcome = 'hit' if result else 'miss'
+        if result:
+            result['response_time'] = round(time.time() - start_time, 2)
+            logging.info(f"Search cache HIT for: '{query}' ({source})")
+            return result
+        
+        key = self.search_cache.make_key(query, source)
+        result = self.single_flight.do(key, lambda: self._resolve_and_cache(query, source))
+        if result:
+            # Coalesced callers share one result object, so hand out copies
+            result = dict(result)
+            result['response_time'] = round(time.time() - start_time, 2)
+        return result
+    
+    async def search_music_async(self, query, source="auto"):
+        """
+        Native asyncio counterpart of search_music for the async server.
+        Uses the in-process cache tier only, so build this instance without a mongo_client.
+        """
+        start_time = time.time()
+        
+        with metrics.span('cache_lookup', source=metrics.source_label(source)) as span:
+            result = self.search_cache.get(query, source)
+            span.outcome = 'hit' if result else 'miss'
+        if result:
+            result['response_time'] = round(time.time() - start_time, 2)
+            return result
+        
+        key = self.search_cache.make_key(query, source)
+        future = self._async_in_flight.get(key)
+        if future is not None:
+            # Coalesce with the identical search already running on this loop
+            self.single_flight.coalesced += 1
+            result = await asyncio.shield(future)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._async_in_flight[key] = future
+            self.single_flight.executions += 1
+            result = None
+            try:
+                if self.race_mode:
+                    result = await self._race_sources(query, source, self.race_budget)
+                else:
+                    result = await self._resolve_music_async(query, source)
+                if result:
+                    self.search_cache.set(query, source, result)
+            finally:
+                self._async_in_flight.pop(key, None)
+                future.set_result(result)
+        
+        if result:
+            result = dict(result)
+            result['response_time'] = round(time.time() - start_time, 2)
+        return result
+    
+    def _resolve_and_cache(self, query, source):
+        """Resolve a query upstream and store the result, at most once across workers if enabled"""
+        # A previous leader may have finished between our cache miss and taking the lead
+        result = self.search_cache.local.get(self.search_cache.make_key(query, source))
+        if result:
+            return result
+        
+        lease_name = token = None
+        if self.search_lease:
+            lease_name = SearchCache.key_name(self.search_cache.make_key(query, source))
+            token = self.search_lease.acquire(lease_name)
+            if not token:
+                # Another worker is resolving this query; wait for it to land in the shared cache
+                result = self._wait_for_shared_result(query, source, lease_name)
+                if result:
+                    return result
+        
+        try:
+            if self.race_mode:
+                result = self._race_music(query, source)
+            else:
+                result = self._resolve_music(query, source)
+            if result:
+                self.search_cache.set(query, source, result)
+            return result
+        finally:
+            if token:
+                self.search_lease.release(lease_name, token)
+    
+    def _wait_for_shared_result(self, query, source, lease_name, poll_interval=0.05):
+        """Poll the shared cache tier while another worker holds the lease"""
+        deadline = time.time() + self.search_lease.ttl
+        while time.time() < deadline:
+            result = self.search_cache.get(query, source, count=False)
+            if result:
+                logging.info(f"Search coalesced with another worker for: '{query}'")
+                return result
+            if not self.search_lease.is_held(lease_name):
+                return self.search_cache.get(query, source, count=False)
+            time.sleep(poll_interval)
+        return None
+    
+    def _resolve_music(self, query, source="auto"):
+        """Run the source cascade on the shared event loop"""
+        try:
+            return self.runner.run(self._resolve_music_async(query, source))
+        except Exception as e:
+            logging.error(f"Error searching music: {str(e)}")
+        
+        return None
+    
+    async def _resolve_music_async(self, query, source="auto"):
         """Search for music from multiple sources with lyrics support - OPTIMIZED"""
         start_time = time.time()
         
         try:
+            result = await self._match_catalog(query, source)
+            if result:
+                result['response_time'] = round(time.time() - start_time, 2)
+                return result
+            
             # Quick optimization: Try JioSaavn async first for fastest response
             if source in ["auto", "jiosaavn"]:
                 logging.info(f"Attempting FAST JioSaavn search for: '{query}'")
-                result = self._search_jiosaavn_async(query)
+                result = await self._fetch_jiosaavn(query)
                 if result:
                     result['response_time'] = round(time.time() - start_time, 2)
                     result['source'] = 'optimized_search'
@@ -41,7 +206,7 @@ class MusicSources:
             # Try the YouTube → JioSaavn approach for complex queries
             if source in ["auto", "hybrid"] and is_lyrics_query:
                 logging.info(f"Attempting YouTube → JioSaavn hybrid search for: '{query}'")
-                result = self._search_youtube_to_jiosaavn(query)
+                result = await self._fetch_youtube_to_jiosaavn(query)
                 if result:
                     result['response_time'] = round(time.time() - start_time, 2)
                     result['source'] = 'hybrid_search'
@@ -63,7 +228,7 @@ class MusicSources:
                 
                 # Fallback to JioSaavn for lyrics
                 if source in ["auto", "jiosaavn"]:
-                    result = self._search_jiosaavn_async(query)
+                    result = await self._fetch_jiosaavn(query)
                     if result:
                         result['response_time'] = str(time.time() - start_time)
                         result['source'] = 'jiosaavn'
@@ -71,7 +236,7 @@ class MusicSources:
             else:
                 # For song names, keep JioSaavn as primary (better quality)
                 if source in ["auto", "jiosaavn"]:
-                    result = self._search_jiosaavn_async(query)
+                    result = await self._fetch_jiosaavn(query)
                     if result:
                         result['response_time'] = str(time.time() - start_time)
                         result['source'] = 'jiosaavn'
@@ -87,62 +252,131 @@ class MusicSources:
             
             # Last resort: Free music APIs
             if source in ["auto", "free"]:
-                result = self._search_free_music_api(query)
+                result = await self._run_blocking(self._search_free_music_api, query)
                 if result:
                     result['response_time'] = str(time.time() - start_time)
                     result['source'] = 'free_api'
                     return result
                     
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logging.error(f"Error searching music: {str(e)}")
         
         return None
     
+    def _race_music(self, query, source="auto"):
+        """Resolve a query by racing the candidate sources within the latency budget"""
+        start_time = time.time()
+        
+        try:
+            result = self.runner.run(self._race_sources(query, source, self.race_budget), timeout=self.race_budget + 1)
+            if result:
+                result['response_time'] = round(time.time() - start_time, 2)
+                logging.info(f"Raced search won by {result['search_method']} in {result['response_time']}s for: '{query}'")
+                return result
+        except Exception as e:
+            logging.error(f"Error racing music sources: {str(e)}")
+        
+        return None
+    
+    def _race_strategies(self, query, source):
+        """Candidate strategies in the same priority order as the sequential cascade"""
+        is_lyrics_query = self._is_lyrics_query(query)
+        strategies = []
+        
+        if source in ["auto", "jiosaavn"]:
+            strategies.append(('optimized_search', 'fast_jiosaavn', lambda: self._fetch_jiosaavn(query)))
+        if source in ["auto", "hybrid"] and is_lyrics_query:
+            strategies.append(('hybrid_search', 'youtube_to_jiosaavn', lambda: self._fetch_youtube_to_jiosaavn(query)))
+        if source in ["auto", "youtube"]:
+            strategies.append(('youtube', 'youtube', lambda: self._fetch_youtube_public(query)))
+        if source in ["auto", "free"]:
+            strategies.append(('free_api', 'free_api', lambda: self._run_blocking(self._search_free_music_api, query)))
+        
+        return strategies
+    
+    async def _race_sources(self, query, source, budget):
+        """
+        Start every strategy at once and return the highest-priority success.
+        A lower-priority result only wins once everything above it has failed,
+        or when the budget runs out; the losers are cancelled. A cancelled
+        blocking contestant (free_api) still finishes in its pool thread.
+        """
+        result = await self._match_catalog(query, source)
+        if result:
+            return result
+        
+        strategies = self._race_strategies(query, source)
+        tasks = [asyncio.create_task(factory()) for _, _, factory in strategies]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + budget
+        
+        def outcome(task):
+            if not task.done() or task.cancelled() or task.exception() is not None:
+                return None
+            return task.result()
+        
+        def winner(index):
+            result = dict(outcome(tasks[index]))
+            result['source'], result['search_method'] = strategies[index][0], strategies[index][1]
+            return result
+        
+        try:
+            pending = set(tasks)
+            while pending:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                
+                _, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                for index, task in enumerate(tasks):
+                    if not task.done():
+                        break  # A higher-priority source is still running
+                    if outcome(task):
+                        return winner(index)
+            
+            # Budget exhausted (or all failed): take the best result that did arrive
+            for index, task in enumerate(tasks):
+                if outcome(task):
+                    logging.info(f"Search race budget of {budget}s exhausted for: '{query}'")
+                    return winner(index)
+            return None
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    async def _run_blocking(self, func, *args):
+        """
+        Run a blocking source fetch on the bounded pool, recreated in each forked worker.
+        Cancelling the await does not stop the thread: it keeps its pool slot until
+        the fetch's own request timeout (5-10s) ends it.
+        """
+        if self._blocking_executor is None or self._blocking_executor_pid != os.getpid():
+            self._blocking_executor = ThreadPoolExecutor(max_workers=self.blocking_workers,
+                                                         thread_name_prefix='source-fetch')
+            self._blocking_executor_pid = os.getpid()
+        return await asyncio.get_running_loop().run_in_executor(self._blocking_executor, func, *args)
+    
+    async def _fetch_youtube_public(self, query):
+        """The YouTube fallback is an in-memory lookup, so it runs on the loop without a thread"""
+        return self._search_youtube_public(query)
+    
     def _is_lyrics_query(self, query):
         """Detect if the query appears to be song lyrics"""
-        # Common indicators of lyrics queries
-        lyrics_indicators = [
-            'lyrics', 'गाने के बोल', 'बोल', 'song with lyrics',
-            'the song that goes', 'song with words',
-            'मैं', 'तू', 'तेरे', 'मेरे', 'प्यार', 'दिल', 'इश्क',
-            'i love', 'you are', 'baby', 'heart', 'love you',
-            'na na na', 'la la la', 'oh oh oh', 'hey hey'
-        ]
-        
-        query_lower = query.lower()
-        
-        # Check for lyrics indicators
-        for indicator in lyrics_indicators:
-            if indicator in query_lower:
-                return True
-        
-        # Check query length and structure (lyrics are usually longer phrases)
-        words = query.split()
-        if len(words) >= 4:  # 4+ words likely lyrics
-            return True
-        
-        # Check for common lyrics patterns
-        if any(word in query_lower for word in ['में', 'है', 'हैं', 'को', 'से', 'and', 'the', 'of', 'in', 'on']):
-            return True
-        
-        return False
+        return lyrics_classifier.is_lyrics(query)
     
-    def _search_youtube_to_jiosaavn(self, query):
+    @metrics.timed('source_fetch', source='hybrid')
+    async def _fetch_youtube_to_jiosaavn(self, query):
         """
         Revolutionary approach: Search YouTube for clean title, then search JioSaavn
         Best of both worlds: YouTube's search accuracy + JioSaavn's audio quality
         """
         try:
             # Step 1: Search YouTube to get clean, accurate song title
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            try:
-                youtube_result = loop.run_until_complete(
-                    self.youtube_service.search_and_get_title(query, limit=1)
-                )
-            finally:
-                loop.close()
+            youtube_result = await self.youtube_service.search_and_get_title(query, limit=1)
             
             if not youtube_result or not youtube_result.get('clean_title'):
                 logging.info("No YouTube result found for hybrid search")
@@ -152,7 +386,7 @@ class MusicSources:
             logging.info(f"YouTube found clean title: '{clean_title}' for query: '{query}'")
             
             # Step 2: Search JioSaavn with the clean YouTube title
-            jiosaavn_result = self._search_jiosaavn_async(clean_title)
+            jiosaavn_result = await self._fetch_jiosaavn(clean_title)
             
             if jiosaavn_result:
                 # Combine the best of both: JioSaavn stream + YouTube metadata
@@ -170,40 +404,74 @@ class MusicSources:
             else:
                 logging.info(f"JioSaavn search failed for YouTube title: '{clean_title}'")
                 
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logging.error(f"YouTube to JioSaavn search error: {str(e)}")
         
         return None
     
-    def _search_jiosaavn_async(self, query):
+    @metrics.timed('catalog_match', source='catalog')
+    async def _match_catalog(self, query, source):
+        """Answer from the local song catalog when it holds a confident match"""
+        if not self.song_catalog or source not in ["auto", "jiosaavn"]:
+            return None
+        
+        record, score = self.song_catalog.match(query)
+        if not record:
+            return None
+        
+        stream_url = self.song_catalog.best_url(record)
+        if self.song_catalog.needs_refresh(record):
+            # Known song, expired URL: one details call instead of a fresh search
+            details = await self.jiosaavn_service.get_song_details(record['id'])
+            if not details or not details.get('stream_url'):
+                return None
+            self.song_catalog.record_refresh()
+            stream_url = details['stream_url']
+        
+        logging.info(f"Song catalog match ({score:.2f}) for: '{query}' -> '{record['title']}'")
+        return {
+            'stream_url': stream_url,
+            'title': record['title'],
+            'artist': ', '.join(record.get('artists') or []),
+            'album': record.get('album', ''),
+            'duration': record.get('duration'),
+            'image_url': record.get('image', ''),
+            'song_id': record['id'],
+            'source': 'catalog',
+            'search_method': 'catalog_match',
+            'match_score': round(score, 3)
+        }
+    
+    @metrics.timed('source_fetch', source='jiosaavn')
+    async def _fetch_jiosaavn(self, query):
         """Search JioSaavn using improved async service"""
         try:
-            # Run the async function in a new event loop
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            try:
-                result = loop.run_until_complete(self.jiosaavn_service.search_and_get_stream(query))
-                if result:
-                    return {
-                        'stream_url': result.get('stream_url', ''),
-                        'title': result.get('title', ''),
-                        'artist': result.get('artists', ''),
-                        'image_url': result.get('image', ''),
-                        'source': 'jiosaavn'
-                    }
-            finally:
-                loop.close()
-                
+            result = await self.jiosaavn_service.search_and_get_stream(query)
+            if result:
+                return {
+                    'stream_url': result.get('stream_url', ''),
+                    'title': result.get('title', ''),
+                    'artist': result.get('artists', ''),
+                    'image_url': result.get('image', ''),
+                    'song_id': result.get('song_id', ''),
+                    'source': 'jiosaavn'
+                }
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logging.error(f"JioSaavn async search error: {str(e)}")
             # Fallback to old method
-            return self._search_jiosaavn(query)
+            return await self._run_blocking(self._search_jiosaavn, query)
         
         return None
     
     def _search_jiosaavn(self, query):
         """Search JioSaavn using actual API calls"""
+        if not self.jiosaavn_breaker.allow():
+            return None
+        
         try:
             # Use requests for synchronous API calls
             import requests
@@ -222,6 +490,7 @@ class MusicSources:
             }
             
             response = requests.get(search_url, params=params, headers=headers, timeout=10)
+            self.jiosaavn_service._record_status(response.status_code)
             
             if response.status_code == 200:
                 data = response.json()
@@ -250,11 +519,13 @@ class MusicSources:
                             'artist': ', '.join([artist.get('name', '') for artist in song.get('artists', {}).get('primary', [])]),
                             'duration': str(song.get('duration', '180')),
                             'stream_url': stream_url,
+                            'song_id': song.get('id', ''),
                             'source': 'jiosaavn',
                             'quality': '320kbps'
                         }
             
         except Exception as e:
+            self.jiosaavn_breaker.record_failure(e)
             logging.error(f"JioSaavn API error: {str(e)}")
         
         return None
@@ -342,13 +613,22 @@ class MusicSources:
         except:
             return 'Unknown'
     
+    @metrics.timed('source_fetch', source='freemusicarchive')
     def _search_free_music_api(self, query):
         """Search using free music APIs"""
+        if not self.free_music_breaker.allow():
+            logging.debug(f"Free Music Archive circuit open, skipping: '{query}'")
+            return None
+        
         try:
             # Free Music Archive API
             fma_url = f"https://freemusicarchive.org/api/get/tracks.json?api_key=60BLHNQCAOUFPIBZ&limit=1&search={quote(query)}"
             
             response = self.session.get(fma_url, timeout=8)
+            if response.status_code >= 500 or response.status_code == 429:
+                self.free_music_breaker.record_failure(f"HTTP {response.status_code}")
+            else:
+                self.free_music_breaker.record_success()
             if response.status_code == 200:
                 data = response.json()
                 
@@ -366,10 +646,12 @@ class MusicSources:
                             'quality': '128kbps'
                         }
         except Exception as e:
+            self.free_music_breaker.record_failure(e)
             logging.debug(f"Free Music API error: {str(e)}")
         
         return None
     
+    @metrics.timed('source_fetch', source='youtube')
     def _search_youtube_public(self, query):
         """Search YouTube using public/unofficial APIs with lyrics support"""
         try:
@@ -556,28 +838,44 @@ class MusicSources:
         
         return None
     
-    def get_trending_music(self, source="jiosaavn", limit=10):
-        """Get trending music from sources"""
+    def fetch_trending(self, source="jiosaavn", region="in"):
+        """Fetch the full trending list for a source and region from upstream"""
+        if source != "jiosaavn":
+            return []
+        
+        # JioSaavn trending API
+        trending_url = f"https://www.jiosaavn.com/api.php?__call=content.getTrending&api_version=4&_format=json&ctx=web6dot0&_marker=0&cc={quote(region)}"
+        
+        response = self.session.get(trending_url, timeout=5)
+        response.raise_for_status()
+        data = response.json()
+        songs = []
+        
+        for item in data.get('list', []):
+            if item.get('type') == 'song':
+                primary_artists = item.get('more_info', {}).get('artistMap', {}).get('primary_artists') or [{}]
+                songs.append({
+                    'title': item.get('title', ''),
+                    'artist': primary_artists[0].get('name', 'Unknown'),
+                    'image': item.get('image', ''),
+                    'id': item.get('id', '')
+                })
+        
+        return songs
+    
+    def get_trending_page(self, source="jiosaavn", limit=10, region="in", page=1):
+        """Serve a page of the background-refreshed trending list; returns (songs, total, updated_at, stale)"""
+        if source not in TRENDING_SOURCES:
+            # Unknown sources have no feed; never create (and keep refreshing) one for them
+            return [], 0, 0, False
+        songs, updated_at, stale = self.trending_cache.get(source, region)
+        start = (page - 1) * limit
+        return songs[start:start + limit], len(songs), updated_at, stale
+    
+    def get_trending_music(self, source="jiosaavn", limit=10, region="in", page=1):
+        """Get trending music from the trending cache"""
         try:
-            if source == "jiosaavn":
-                # JioSaavn trending API
-                trending_url = "https://www.jiosaavn.com/api.php?__call=content.getTrending&api_version=4&_format=json&ctx=web6dot0&_marker=0&cc=in"
-                
-                response = self.session.get(trending_url, timeout=5)
-                if response.status_code == 200:
-                    data = response.json()
-                    songs = []
-                    
-                    for item in data.get('list', [])[:limit]:
-                        if item.get('type') == 'song':
-                            songs.append({
-                                'title': item.get('title', ''),
-                                'artist': item.get('more_info', {}).get('artistMap', {}).get('primary_artists', [{}])[0].get('name', 'Unknown'),
-                                'image': item.get('image', ''),
-                                'id': item.get('id', '')
-                            })
-                    
-                    return songs
+            return self.get_trending_page(source, limit, region, page)[0]
         except Exception as e:
             logging.error(f"Trending music error: {str(e)}")
         
@@ -1,12 +1,22 @@
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 from urllib.parse import urlparse, quote
 import hashlib
 import time
-from flask import request, Response, stream_with_context
+from flask import request, Response, send_file
 import os
 from pymongo import MongoClient
+import metrics
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from async_runner import async_runner
+from audio_cache import AudioDiskCache, create_audio_cache
+from jiosaavn_service import JioSaavnService
+from proxy_tokens import create_token_codec, is_proxy_token
+from single_flight import SingleFlight
+from stream_urls import get_stream_url_ttl
+from ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
@@ -21,153 +31,430 @@ class ProxyHandler:
             self.cache_collection = self.db['proxy_cache']
             # Create TTL index for auto-cleanup
             self.cache_collection.create_index("expires_at", expireAfterSeconds=0)
-        else:
-            self.cache = {}  # Fallback in-memory cache
         self.cache_duration = 3600  # 1 hour cache
+        # Entries live as long as their signed upstream URL, up to this bound
+        self.max_entry_ttl = int(os.environ.get("PROXY_MAX_ENTRY_TTL", 86400))
+        
+        # Bounded in-memory map: read-through front for proxy_cache, and the only
+        # store when MongoDB is absent or failing
+        self.cache = TTLCache(
+            max_entries=int(os.environ.get("PROXY_LOCAL_CACHE_SIZE", 10000)),
+            default_ttl=self.cache_duration
+        )
+        # An identical entry is rewritten to MongoDB at most this often (extends its expiry)
+        self.rewrite_interval = int(os.environ.get("PROXY_REWRITE_INTERVAL", 300))
+        
+        # Upstream relay settings
+        self.chunk_size = int(os.environ.get("PROXY_CHUNK_SIZE", 64 * 1024))
+        self.pool_size = int(os.environ.get("PROXY_POOL_SIZE", 32))
+        self.connect_timeout = float(os.environ.get("PROXY_CONNECT_TIMEOUT", 5))
+        self.read_timeout = float(os.environ.get("PROXY_READ_TIMEOUT", 30))
+        self._session = None
+        self._session_pid = None
+        
+        # PROXY_URL_MODE=token: proxy URLs carry a signed token instead of a Mongo id
+        self.token_codec = create_token_codec()
+        
+        # Local disk copy of popular tracks, shared by all workers on this host
+        self.audio_cache = create_audio_cache()
+        
+        # Re-resolution of expired upstream URLs, one lookup per song at a time
+        self.refresh_flight = SingleFlight()
+        self._jiosaavn_service = None
+        
+    def get_session(self) -> requests.Session:
+        """Pooled upstream session, recreated in each forked worker"""
+        if self._session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+                'Accept': 'audio/webm,audio/ogg,audio/wav,audio/*;q=0.9,application/ogg;q=0.7,video/*;q=0.6,*/*;q=0.5',
+                'Accept-Language': 'en-US,en;q=0.5',
+                'Accept-Encoding': 'identity',
+                'Connection': 'keep-alive'
+            })
+            self._session = session
+            self._session_pid = os.getpid()
+        return self._session
         
-    def create_proxy_url(self, original_url: str, api_key: str) -> str:
+    @staticmethod
+    def make_url_hash(original_url: str, api_key: str) -> str:
+        """Hash identifying a proxied URL for one API key within the current hour"""
+        return hashlib.md5(f"{original_url}:{api_key}:{int(time.time() // 3600)}".encode()).hexdigest()
+    
+    def create_proxy_url(self, original_url: str, api_key: str, song_id: str = None) -> str:
         """Create a proxy URL that hides the original stream URL"""
-        # Create a hash of the original URL for security
-        url_hash = hashlib.md5(f"{original_url}:{api_key}:{int(time.time() // 3600)}".encode()).hexdigest()
+        ttl = self.entry_ttl(original_url, song_id)
+        if self.token_codec:
+            # Stateless: the signed token carries the URL, so nothing is stored
+            url_hash = self.token_codec.encode(original_url, ttl, song_id=song_id)
+        else:
+            # Create a hash of the original URL for security
+            url_hash = self.make_url_hash(original_url, api_key)
+            self.store_original_url(url_hash, original_url, api_key, song_id=song_id, ttl=ttl)
+        
+        # Get current domain from request
+        domain = request.host if request else 'localhost:5000'
+        protocol = 'https' if request and request.is_secure else 'http'
+        
+        # Return proxy URL with our domain
+        return f"{protocol}://{domain}/proxy/stream/{url_hash}"
+    
+    def entry_ttl(self, original_url: str, song_id: str = None) -> int:
+        """Lifetime of a proxy entry, following the expiry signed into the upstream URL"""
+        ttl = get_stream_url_ttl(original_url, default_ttl=self.cache_duration, max_ttl=self.max_entry_ttl)
+        if song_id:
+            # Entries that can re-resolve outlive a nearly expired URL
+            ttl = max(ttl, self.cache_duration)
+        return ttl
+    
+    def store_original_url(self, url_hash: str, original_url: str, api_key: str,
+                           song_id: str = None, ttl: int = None):
+        """Remember which upstream URL a proxy hash points to"""
+        ttl = self.entry_ttl(original_url, song_id) if ttl is None else ttl
+        entry = {'original_url': original_url, 'api_key': api_key, 'song_id': song_id}
+        
+        # The hash is stable for the hour, so most calls would rewrite an identical document
+        known, remaining = self.cache.get_with_ttl(url_hash)
+        if known == entry and remaining > ttl - self.rewrite_interval:
+            return
+        
+        self.cache.set(url_hash, entry, ttl=ttl)
         
-        # Store in MongoDB cache or fallback to memory
         if self.mongo_client:
             try:
-                expires_at = datetime.utcnow() + timedelta(seconds=self.cache_duration)
+                expires_at = datetime.utcnow() + timedelta(seconds=ttl)
                 self.cache_collection.replace_one(
                     {'hash': url_hash},
                     {
                         'hash': url_hash,
                         'original_url': original_url,
                         'api_key': api_key,
+                        'song_id': song_id,
                         'created_at': datetime.utcnow(),
                         'expires_at': expires_at
                     },
                     upsert=True
                 )
             except Exception as e:
+                # The in-memory entry still serves this worker
                 logger.error(f"MongoDB cache error: {e}")
-                # Fallback to memory cache
-                self.cache[url_hash] = {
-                    'original_url': original_url,
-                    'timestamp': time.time(),
-                    'api_key': api_key
-                }
-        else:
-            # Store in memory cache
-            self.cache[url_hash] = {
-                'original_url': original_url,
-                'timestamp': time.time(),
-                'api_key': api_key
-            }
+    
+    def get_entry(self, url_hash: str):
+        """Proxy entry {'original_url', 'api_key', 'song_id'} for a hash or token, or None"""
+        # Range requests for the same track hit this repeatedly; serve them from memory.
+        # Tokens land here too once their URL has been re-resolved.
+        cached_item = self.cache.get(url_hash)
+        if cached_item:
+            return cached_item
         
-        # Get current domain from request
-        domain = request.host if request else 'localhost:5000'
-        protocol = 'https' if request and request.is_secure else 'http'
+        if is_proxy_token(url_hash):
+            return self.token_codec.decode(url_hash) if self.token_codec else None
         
-        # Return proxy URL with our domain
-        return f"{protocol}://{domain}/proxy/stream/{url_hash}"
-    
-    def get_original_url(self, url_hash: str) -> str:
-        """Get original URL from hash"""
-        # Try MongoDB cache first
         if self.mongo_client:
             try:
                 cached_item = self.cache_collection.find_one({'hash': url_hash})
                 if cached_item:
                     # Check if still valid (MongoDB TTL handles this, but double-check)
-                    if datetime.utcnow() < cached_item['expires_at']:
-                        return cached_item['original_url']
+                    remaining = (cached_item['expires_at'] - datetime.utcnow()).total_seconds()
+                    if remaining > 0:
+                        entry = {
+                            'original_url': cached_item['original_url'],
+                            'api_key': cached_item.get('api_key'),
+                            'song_id': cached_item.get('song_id')
+                        }
+                        self.cache.set(url_hash, entry, ttl=remaining)
+                        return entry
                     else:
                         # Clean up expired item
                         self.cache_collection.delete_one({'hash': url_hash})
-                        return ""
-                return ""
             except Exception as e:
                 logger.error(f"MongoDB cache read error: {e}")
-                # Fall through to memory cache
         
-        # Fallback to memory cache
-        if url_hash not in self.cache:
-            return ""
-            
-        cached_item = self.cache[url_hash]
+        return None
+    
+    def get_original_url(self, url_hash: str) -> str:
+        """Get original URL from hash"""
+        entry = self.get_entry(url_hash)
+        return entry['original_url'] if entry else ""
+    
+    def get_jiosaavn_service(self) -> JioSaavnService:
+        if self._jiosaavn_service is None:
+            self._jiosaavn_service = JioSaavnService()
+            async_runner.add_shutdown_callback(self._jiosaavn_service.close)
+        return self._jiosaavn_service
+    
+    def refresh_entry(self, url_hash: str, entry: dict):
+        """Re-resolve an entry whose upstream URL was rejected; returns the updated entry or None"""
+        song_id = entry.get('song_id')
+        if not song_id:
+            return None
         
-        # Check if cache is still valid
-        if time.time() - cached_item['timestamp'] > self.cache_duration:
-            del self.cache[url_hash]
-            return ""
-            
-        return cached_item['original_url']
+        try:
+            details = self.refresh_flight.do(
+                song_id,
+                lambda: async_runner.run(self.get_jiosaavn_service().get_song_details(song_id), timeout=20)
+            )
+        except Exception as e:
+            logger.error(f"Error re-resolving song {song_id}: {e}")
+            return None
+        
+        stream_url = (details or {}).get('stream_url')
+        if not stream_url or stream_url == entry['original_url']:
+            return None
+        
+        refreshed = dict(entry, original_url=stream_url)
+        ttl = self.entry_ttl(stream_url, song_id)
+        if entry.get('expires_at'):
+            # A token's own expiry still bounds how long it can be used
+            ttl = min(ttl, entry['expires_at'] - time.time())
+        self.cache.set(url_hash, refreshed, ttl=ttl)
+        
+        if self.mongo_client and not is_proxy_token(url_hash):
+            try:
+                self.cache_collection.update_one(
+                    {'hash': url_hash},
+                    {'$set': {
+                        'original_url': stream_url,
+                        'expires_at': datetime.utcnow() + timedelta(seconds=ttl)
+                    }}
+                )
+            except Exception as e:
+                logger.error(f"MongoDB cache error: {e}")
+        
+        logger.info(f"Re-resolved expired stream URL for song {song_id}")
+        return refreshed
+    
+    @staticmethod
+    def make_etag(cache_key: str) -> str:
+        """Validator for upstreams that send none: CDN audio paths never change content"""
+        return f'"fl-{cache_key[:24]}"'
+    
+    @classmethod
+    def validator_headers(cls, upstream_headers, cache_key: str) -> dict:
+        """ETag/Last-Modified to send: propagated from upstream, else synthesized"""
+        headers = {'ETag': upstream_headers.get('ETag') or cls.make_etag(cache_key)}
+        if upstream_headers.get('Last-Modified'):
+            headers['Last-Modified'] = upstream_headers['Last-Modified']
+        return headers
+    
+    @staticmethod
+    def stored_validators(meta: dict, cache_key: str) -> dict:
+        """ETag/Last-Modified of a disk-cached copy: the ones its relayed response carried"""
+        headers = {'ETag': meta.get('etag') or ProxyHandler.make_etag(cache_key)}
+        if meta.get('last_modified'):
+            headers['Last-Modified'] = meta['last_modified']
+        return headers
+    
+    @staticmethod
+    def is_not_modified(client_headers, validators: dict) -> bool:
+        """Whether If-None-Match (or, without it, If-Modified-Since) matches a stored copy's validators"""
+        if_none_match = client_headers.get('If-None-Match')
+        if if_none_match:
+            if if_none_match.strip() == '*':
+                return True
+            etag = validators['ETag'].removeprefix('W/')
+            return etag in (tag.strip().removeprefix('W/') for tag in if_none_match.split(','))
+        
+        if_modified_since = client_headers.get('If-Modified-Since')
+        if if_modified_since and validators.get('Last-Modified'):
+            try:
+                return parsedate_to_datetime(validators['Last-Modified']) <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+    
+    @staticmethod
+    def if_range_matches(if_range: str, validators: dict) -> bool:
+        """Whether a Range guarded by If-Range still applies: strong ETag match or the exact Last-Modified date"""
+        if not if_range:
+            return True
+        if if_range.startswith(('"', 'W/')):
+            return not if_range.startswith('W/') and if_range == validators['ETag']
+        return if_range == validators.get('Last-Modified')
+    
+    @classmethod
+    def upstream_headers(cls, client_headers, cache_key: str):
+        """Range/conditional headers to forward upstream, or None when a 304 can be sent right away"""
+        # Synthesized validators can be checked here without touching upstream
+        own_etag = cls.make_etag(cache_key)
+        if_none_match = client_headers.get('If-None-Match', '')
+        if own_etag in if_none_match or if_none_match.strip() == '*':
+            return None
+        
+        # Forward only the conditional/range headers the player actually sent
+        headers = {
+            name: client_headers[name]
+            for name in ('Range', 'If-None-Match', 'If-Modified-Since')
+            if client_headers.get(name)
+        }
+        if_range = client_headers.get('If-Range')
+        if if_range and 'Range' in headers:
+            if if_range.startswith('"fl-'):
+                # One of our tags: same track means the range still applies, else send it all
+                if if_range != own_etag:
+                    del headers['Range']
+            else:
+                headers['If-Range'] = if_range
+        return headers
     
     def stream_audio(self, url_hash: str):
-        """Stream audio through proxy"""
-        original_url = self.get_original_url(url_hash)
+        """Stream audio through proxy (GET and HEAD)"""
+        with metrics.span('proxy_lookup') as span:
+            entry = self.get_entry(url_hash)
+            span.outcome = 'ok' if entry else 'miss'
         
-        if not original_url:
+        if not entry:
             return Response("Stream not found or expired", status=404)
         
+        cache_key = AudioDiskCache.make_key(entry['original_url'], entry.get('song_id'))
+        if self.audio_cache:
+            with metrics.span('audio_cache_lookup') as span:
+                cached = self.audio_cache.get(cache_key)
+                span.outcome = 'hit' if cached else 'miss'
+            if cached:
+                return self.send_cached_audio(cache_key, *cached)
+        
+        headers = self.upstream_headers(request.headers, cache_key)
+        if headers is None:
+            return Response(status=304, headers={
+                'ETag': self.make_etag(cache_key),
+                'Cache-Control': 'public, max-age=3600',
+                'Access-Control-Allow-Origin': '*'
+            })
+        
+        method = 'HEAD' if request.method == 'HEAD' else 'GET'
         try:
-            # Headers for audio streaming
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                'Accept': 'audio/webm,audio/ogg,audio/wav,audio/*;q=0.9,application/ogg;q=0.7,video/*;q=0.6,*/*;q=0.5',
-                'Accept-Language': 'en-US,en;q=0.5',
-                'Accept-Encoding': 'identity',
-                'Range': request.headers.get('Range', ''),
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1'
-            }
-            
-            # Make request to original URL
-            response = requests.get(original_url, headers=headers, stream=True, timeout=10)
-            
-            if response.status_code == 200 or response.status_code == 206:
-                # Create response with proper headers
-                def generate():
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            yield chunk
-                
-                # Set response headers
-                response_headers = {
-                    'Content-Type': response.headers.get('Content-Type', 'audio/mpeg'),
-                    'Content-Length': response.headers.get('Content-Length', ''),
-                    'Accept-Ranges': 'bytes',
-                    'Cache-Control': 'public, max-age=3600',
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Range'
-                }
-                
-                # Add range header if present
-                if 'Content-Range' in response.headers:
-                    response_headers['Content-Range'] = response.headers['Content-Range']
-                
-                return Response(
-                    stream_with_context(generate()),
-                    status=response.status_code,
-                    headers=response_headers
+            # Time to upstream response headers, the proxy's share of time-to-first-byte
+            with metrics.span('upstream_connect', method=method) as span:
+                response = self.get_session().request(
+                    method,
+                    entry['original_url'],
+                    headers=headers,
+                    stream=True,
+                    timeout=(self.connect_timeout, self.read_timeout)
                 )
-            else:
-                logger.error(f"Failed to fetch audio: {response.status_code}")
-                return Response("Failed to fetch audio", status=500)
-                
+                span.outcome = str(response.status_code)
+            
+            # Signed CDN URLs expire mid-session; fetch a fresh one and carry on
+            if response.status_code in (403, 410):
+                with metrics.span('proxy_refresh') as span:
+                    refreshed = self.refresh_entry(url_hash, entry)
+                    span.outcome = 'ok' if refreshed else 'failed'
+                if refreshed:
+                    response.close()
+                    with metrics.span('upstream_connect', method=method) as span:
+                        response = self.get_session().request(
+                            method,
+                            refreshed['original_url'],
+                            headers=headers,
+                            stream=True,
+                            timeout=(self.connect_timeout, self.read_timeout)
+                        )
+                        span.outcome = str(response.status_code)
         except Exception as e:
             logger.error(f"Error streaming audio: {str(e)}")
             return Response("Error streaming audio", status=500)
+        
+        if response.status_code == 304:
+            response.close()
+            return Response(status=304, headers=dict(
+                self.validator_headers(response.headers, cache_key),
+                **{'Cache-Control': 'public, max-age=3600', 'Access-Control-Allow-Origin': '*'}
+            ))
+        
+        if response.status_code == 416:
+            response.close()
+            return Response(
+                "Requested range not satisfiable",
+                status=416,
+                headers={'Content-Range': response.headers.get('Content-Range', '')}
+            )
+        
+        if response.status_code not in (200, 206):
+            logger.error(f"Failed to fetch audio: {response.status_code}")
+            response.close()
+            return Response("Failed to fetch audio", status=500)
+        
+        content_type = response.headers.get('Content-Type', 'audio/mpeg')
+        validators = self.validator_headers(response.headers, cache_key)
+        
+        # Set response headers
+        response_headers = {
+            'Content-Type': content_type,
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': 'public, max-age=3600',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Headers': 'Range'
+        }
+        response_headers.update(validators)
+        
+        for name in ('Content-Length', 'Content-Range'):
+            if name in response.headers:
+                response_headers[name] = response.headers[name]
+        
+        if method == 'HEAD':
+            response.close()
+            return Response(status=response.status_code, headers=response_headers)
+        
+        # Write-through only when this response carries the whole track
+        writer = None
+        body_size = AudioDiskCache.complete_body_size(
+            response.status_code,
+            response.headers.get('Content-Length'),
+            response.headers.get('Content-Range')
+        )
+        if self.audio_cache and body_size:
+            writer = self.audio_cache.open_writer(cache_key)
+        
+        def generate():
+            # Release the pooled connection even if the player disconnects mid-track
+            try:
+                for chunk in response.raw.stream(self.chunk_size, decode_content=False):
+                    if chunk:
+                        if writer:
+                            writer.write(chunk)
+                        yield chunk
+                if writer:
+                    writer.commit(content_type, body_size, validators)
+            except Exception as e:
+                logger.error(f"Error streaming audio: {str(e)}")
+            finally:
+                if writer:
+                    writer.abort()
+                response.close()
+        
+        return Response(
+            generate(),
+            status=response.status_code,
+            headers=response_headers,
+            direct_passthrough=True
+        )
+    
+    def send_cached_audio(self, cache_key: str, path: str, meta: dict):
+        """Serve a cached track; Werkzeug answers Range/If-Range/If-None-Match and uses sendfile where available"""
+        response = send_file(
+            path,
+            mimetype=meta.get('content_type', 'audio/mpeg'),
+            conditional=False,
+            etag=False,
+            max_age=3600
+        )
+        # Same validators the relayed response carried, so client caches stay valid
+        response.headers.update(self.stored_validators(meta, cache_key))
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Headers'] = 'Range'
+        return response.make_conditional(request, accept_ranges=True, complete_length=meta['size'])
     
     def cleanup_cache(self):
         """Clean up expired cache entries"""
-        current_time = time.time()
-        expired_keys = [
-            key for key, value in self.cache.items()
-            if current_time - value['timestamp'] > self.cache_duration
-        ]
-        
-        for key in expired_keys:
-            del self.cache[key]
-        
-        logger.info(f"Cleaned up {len(expired_keys)} expired cache entries")
+        removed = self.cache.purge_expired()
+        logger.info(f"Cleaned up {removed} expired cache entries")
+        return removed
 
 # Global proxy handler instance
 proxy_handler = ProxyHandler()
\ No newline at end of file
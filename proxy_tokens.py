@@ -0,0 +1,101 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # Needed for the default encrypted tokens; signed-only tokens need only the stdlib
+    Fernet = None
+    InvalidToken = Exception
+
+logger = logging.getLogger(__name__)
+
+SIGNED_PREFIX = 's.'
+ENCRYPTED_PREFIX = 'e.'
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def is_proxy_token(value):
+    """Tokens carry a mode prefix; legacy proxy ids are bare hex hashes"""
+    return value.startswith((SIGNED_PREFIX, ENCRYPTED_PREFIX))
+
+class ProxyTokenCodec:
+    """Self-contained, expiring proxy tokens: any node holding the secret can resolve them.
+
+    Tokens are encrypted by default. encrypt=False issues signed-only tokens
+    whose payload (the upstream URL) anyone holding the proxy URL can read.
+    """
+
+    def __init__(self, secret, encrypt=True):
+        secret = secret.encode() if isinstance(secret, str) else secret
+        self.signing_key = hmac.new(secret, b'proxy-token-signing', hashlib.sha256).digest()
+        self.fernet = None
+        if encrypt:
+            if Fernet is None:
+                raise RuntimeError("Encrypted proxy tokens need the 'cryptography' package")
+            encryption_key = hmac.new(secret, b'proxy-token-encryption', hashlib.sha256).digest()
+            self.fernet = Fernet(base64.urlsafe_b64encode(encryption_key))
+
+    def encode(self, original_url, ttl, song_id=None):
+        """Token for original_url, valid for ttl seconds. Tokens reach clients, so no API key goes in."""
+        data = {'u': original_url, 'e': int(time.time() + ttl)}
+        if song_id:
+            data['s'] = song_id
+        payload = json.dumps(data, separators=(',', ':')).encode()
+
+        if self.fernet:
+            return ENCRYPTED_PREFIX + self.fernet.encrypt(payload).decode()
+
+        body = _b64encode(payload)
+        signature = _b64encode(hmac.new(self.signing_key, body.encode(), hashlib.sha256).digest())
+        return f"{SIGNED_PREFIX}{body}.{signature}"
+
+    def decode(self, token):
+        """Return {'original_url', 'api_key', 'song_id', 'expires_at'} for a valid, unexpired token, else None.
+        Tokens do not carry the API key, so 'api_key' is always None."""
+        try:
+            if token.startswith(ENCRYPTED_PREFIX):
+                if not self.fernet:
+                    return None
+                payload = self.fernet.decrypt(token[len(ENCRYPTED_PREFIX):].encode())
+            elif token.startswith(SIGNED_PREFIX):
+                body, _, signature = token[len(SIGNED_PREFIX):].partition('.')
+                expected = hmac.new(self.signing_key, body.encode(), hashlib.sha256).digest()
+                if not hmac.compare_digest(expected, _b64decode(signature)):
+                    return None
+                payload = _b64decode(body)
+            else:
+                return None
+            data = json.loads(payload)
+            if data['e'] < time.time():
+                return None
+            return {'original_url': data['u'], 'api_key': None, 'song_id': data.get('s'), 'expires_at': data['e']}
+        except (InvalidToken, ValueError, TypeError, KeyError) as e:
+            logger.debug(f"Rejected proxy token: {e}")
+            return None
+
+def create_token_codec():
+    """Codec for PROXY_URL_MODE=token, or None to keep Mongo-backed proxy ids"""
+    if os.environ.get("PROXY_URL_MODE", "mongo").lower() != "token":
+        return None
+    secret = os.environ.get("PROXY_TOKEN_SECRET") or os.environ.get("SESSION_SECRET")
+    if not secret:
+        logger.error("PROXY_URL_MODE=token needs PROXY_TOKEN_SECRET (shared by all nodes); using Mongo proxy ids")
+        return None
+    # Signed-only tokens expose the upstream URL to whoever holds the proxy URL; operators must opt in
+    encrypt = os.environ.get("PROXY_TOKEN_ENCRYPT", "true").lower() != "false"
+    if encrypt and Fernet is None:
+        logger.error("PROXY_URL_MODE=token encrypts tokens and needs the 'cryptography' package "
+                     "(or PROXY_TOKEN_ENCRYPT=false to expose upstream URLs); using Mongo proxy ids")
+        return None
+    if not encrypt:
+        logger.warning("PROXY_TOKEN_ENCRYPT=false: proxy tokens are signed only and reveal the upstream URL")
+    return ProxyTokenCodec(secret, encrypt=encrypt)
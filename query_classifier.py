@@ -0,0 +1,77 @@
+import math
+import re
+
+# Word characters for boundary checks: \w misses Devanagari vowel signs, which
+# would otherwise split words like "है" or "मैं" in the middle
+WORD_CHARS = '\\w\u0900-\u097f'
+
+# Phrases suggesting a query is a line of lyrics rather than a title, strongest first
+STRONG_INDICATORS = (
+    'lyrics', 'song with lyrics', 'the song that goes', 'song with words',
+    'गाने के बोल', 'बोल',
+    'na na na', 'la la la', 'oh oh oh', 'hey hey'
+)
+LYRIC_WORDS = (
+    'मैं', 'तू', 'तेरे', 'मेरे', 'प्यार', 'दिल', 'इश्क',
+    'i love', 'you are', 'baby', 'heart', 'love you'
+)
+FUNCTION_WORDS = (
+    'में', 'है', 'हैं', 'को', 'से',
+    'and', 'the', 'of', 'in', 'on'
+)
+
+WEIGHTS = {'strong': 3.0, 'lyric': 1.5, 'function': 0.5}
+LONG_QUERY_WORDS = 4
+LONG_QUERY_WEIGHT = 1.5
+THRESHOLD = 1.5
+
+def _alternation(phrases):
+    # Longest first, so "song with lyrics" wins over "lyrics"
+    return '|'.join(re.escape(phrase) for phrase in sorted(phrases, key=len, reverse=True))
+
+class QueryClassifier:
+    """Single-pass lyrics/title classifier over one compiled regex"""
+
+    def __init__(self, weights=None, threshold=THRESHOLD, long_query_words=LONG_QUERY_WORDS,
+                 long_query_weight=LONG_QUERY_WEIGHT):
+        weights = dict(WEIGHTS, **(weights or {}))
+        self.threshold = threshold
+        self.long_query_words = long_query_words
+        self.long_query_weight = long_query_weight
+
+        # Phrase -> weight; the regex only finds phrases, the dict scores them
+        self.phrase_weights = {}
+        for group, phrases in (('strong', STRONG_INDICATORS), ('lyric', LYRIC_WORDS), ('function', FUNCTION_WORDS)):
+            for phrase in phrases:
+                self.phrase_weights.setdefault(phrase, weights[group])
+        # A plain capture group and a consumed leading separator keep this on
+        # the regex engine's fast path; named groups and lookbehinds double the cost
+        self.pattern = re.compile(f"[^{WORD_CHARS}]({_alternation(self.phrase_weights)})(?![{WORD_CHARS}])")
+
+    def score(self, query):
+        """Summed evidence that query is lyrics; each distinct phrase counts once"""
+        total = 0.0
+        phrases = self.pattern.findall(f" {query.lower()}")
+        if phrases:
+            for phrase in set(phrases):
+                total += self.phrase_weights[phrase]
+        if len(query.split()) >= self.long_query_words:
+            total += self.long_query_weight
+        return total
+
+    def is_lyrics(self, query):
+        """Label only, for routing; skips the confidence computation"""
+        return self.score(query or '') >= self.threshold
+
+    def classify(self, query):
+        """Return ('lyrics' | 'title', confidence in [0.5, 1.0])"""
+        score = self.score(query or '')
+        label = 'lyrics' if score >= self.threshold else 'title'
+        # Confidence grows with the distance from the decision threshold
+        confidence = 0.5 + 0.5 * (1 - math.exp(-abs(score - self.threshold) / self.threshold))
+        return label, round(confidence, 3)
+
+default_classifier = QueryClassifier()
+
+def classify_query(query):
+    return default_classifier.classify(query)
@@ -1,12 +1,60 @@
-from flask import render_template, request, jsonify, session, redirect, url_for, flash
-from app import app, db, proxy_handler
-from models import APIKey, UsageStats
+from flask import render_template, request, jsonify, session, redirect, url_for, flash, Response, stream_with_context, g
+from app import app, db, client, proxy_handler
+from models import APIKey, UsageStats, usage_writer
 from music_sources import MusicSources
+from trending_cache import REGION_PATTERN, TRENDING_SOURCES
+import circuit_breaker
+import metrics
+from async_runner import async_runner
 import time
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
-music_sources = MusicSources()
+# All async services used by the handlers run on the worker's shared event loop
+music_sources = MusicSources(runner=async_runner, mongo_client=client)
+# Start filling the default trending feed before the first request asks for it
+music_sources.trending_cache.warm('jiosaavn', 'in')
+
+# Batch resolution: bounded parallelism shared by all batch requests in this worker
+BATCH_MAX_QUERIES = 50
+batch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='batch-search')
+
+def build_stream_url(original_stream_url, api_key, direct, song_id=None):
+    """Return the direct upstream URL or a proxy URL that hides it"""
+    if direct:
+        # Return direct stream URL for Telegram bots
+        return original_stream_url
+    if original_stream_url:
+        # Create proxy URL for security; the song id lets it re-resolve once the URL expires
+        return proxy_handler.create_proxy_url(original_stream_url, api_key, song_id=song_id)
+    return ""
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_duration(response):
+    """Time to response start per endpoint; streamed proxy bodies are not included"""
+    start = g.get('request_start')
+    if start is not None and request.url_rule is not None and request.endpoint not in ('metrics_endpoint', 'static'):
+        metrics.request_duration.observe(
+            time.perf_counter() - start,
+            endpoint=request.url_rule.rule,
+            method=request.method,
+            status=str(response.status_code)
+        )
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint for this worker's latency histograms"""
+    token = request.args.get('token') or request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not metrics.is_authorized(token):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -43,14 +91,54 @@ def admin_dashboard():
     # Get all API keys
     api_keys = APIKey.get_all_keys()
     
-    # Get usage statistics
-    usage_stats = UsageStats.get_usage_stats()
+    # Aggregated usage statistics plus the latest requests
+    usage_summary = UsageStats.get_usage_summary()
+    recent_logs = UsageStats.get_usage_logs(per_page=10)['logs']
+    owners = {key['api_key']: key.get('owner_name') for key in api_keys}
+    for row in usage_summary['per_key']:
+        row['owner_name'] = owners.get(row['api_key'])
     
     return render_template('admin.html', 
                          api_keys=api_keys, 
-                         usage_stats=usage_stats,
+                         usage_summary=usage_summary,
+                         recent_logs=recent_logs,
+                         cache_stats=music_sources.search_cache.get_stats(),
+                         breaker_stats=circuit_breaker.get_all_stats(),
                          dashboard=True)
 
+@app.route('/admin/stats')
+def admin_stats():
+    """Headline counters for the dashboard's auto-refresh"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    total_keys, active_keys = APIKey.count_keys()
+    usage_summary = UsageStats.get_usage_summary()
+    return jsonify({
+        'success': True,
+        'total_keys': total_keys,
+        'active_users': active_keys,
+        'total_requests': usage_summary['totals']['requests'],
+        'usage': usage_summary
+    })
+
+@app.route('/admin/usage_logs')
+def admin_usage_logs():
+    """Paginated raw request logs, optionally for one API key"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 50))
+        days = min(max(int(request.args.get('days', 7)), 1), 90)
+    except ValueError:
+        return jsonify({'error': 'page, per_page and days must be integers'}), 400
+    
+    result = UsageStats.get_usage_logs(page=page, per_page=per_page,
+                                       api_key=request.args.get('api_key') or None, days=days)
+    return jsonify(dict(result, success=True))
+
 @app.route('/admin/logout')
 def admin_logout():
     """Admin logout"""
@@ -98,6 +186,69 @@ def delete_api_key():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/admin/cache/stats')
+def search_cache_stats():
+    """Search result cache hit/miss counters"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({
+        'success': True,
+        'search_cache': music_sources.search_cache.get_stats(),
+        'coalescing': music_sources.single_flight.get_stats(),
+        'audio_cache': proxy_handler.audio_cache.get_stats() if proxy_handler.audio_cache else None,
+        'trending': music_sources.trending_cache.get_stats(),
+        'song_catalog': music_sources.song_catalog.get_stats() if music_sources.song_catalog else None
+    })
+
+@app.route('/admin/usage_writer/stats')
+def usage_writer_stats():
+    """Write-behind usage accounting queue and flush counters"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({
+        'success': True,
+        'enabled': usage_writer is not None,
+        'usage_writer': usage_writer.get_stats() if usage_writer else {}
+    })
+
+@app.route('/admin/breakers/stats')
+def breaker_stats():
+    """Circuit breaker state per upstream source in this worker"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify({
+        'success': True,
+        'breakers': circuit_breaker.get_all_stats()
+    })
+
+@app.route('/admin/cache/purge', methods=['POST'])
+def purge_search_cache():
+    """Purge cached search results for a query"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    data = request.get_json()
+    query = data.get('query')
+    
+    if not query:
+        return jsonify({'error': 'Query is required'}), 400
+    
+    try:
+        removed = music_sources.search_cache.purge(query)
+        search_cache = music_sources.search_cache
+        return jsonify({
+            'success': True,
+            'removed': removed,
+            # Other workers only see the purge through the shared MongoDB generation
+            'all_workers': search_cache.collection is not None,
+            'sync_seconds': search_cache.sync_interval
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/stream')
 def stream_music():
     """Main music streaming endpoint"""
@@ -116,34 +267,30 @@ def stream_music():
         return jsonify({'error': 'Query is required'}), 400
     
     # Validate API key
-    is_valid, message = APIKey.validate_api_key(api_key)
+    with metrics.span('validate_key', endpoint='/api/stream') as span:
+        is_valid, message = APIKey.validate_api_key(api_key)
+        span.outcome = 'ok' if is_valid else 'rejected'
     if not is_valid:
         return jsonify({'error': message}), 401
     
     try:
         # Search for music
-        result = music_sources.search_music(query, source)
+        with metrics.span('search', endpoint='/api/stream', source=metrics.source_label(source)) as span:
+            result = music_sources.search_music(query, source)
+            span.outcome = 'ok' if result else 'miss'
         
         if result:
-            # Increment API usage
-            APIKey.increment_usage(api_key)
-            
-            # Log usage statistics
-            response_time = time.time() - start_time
-            UsageStats.log_request(api_key, '/api/stream', query, response_time, True)
+            with metrics.span('usage_log', endpoint='/api/stream'):
+                # Increment API usage
+                APIKey.increment_usage(api_key)
+                
+                # Log usage statistics
+                response_time = time.time() - start_time
+                UsageStats.log_request(api_key, '/api/stream', query, response_time, True)
             
             # Handle stream URL based on direct parameter
-            original_stream_url = result.get('stream_url', '')
-            
-            if direct:
-                # Return direct stream URL for Telegram bots
-                final_stream_url = original_stream_url
-            else:
-                # Create proxy URL for security
-                if original_stream_url:
-                    final_stream_url = proxy_handler.create_proxy_url(original_stream_url, api_key)
-                else:
-                    final_stream_url = ""
+            with metrics.span('proxy_url', endpoint='/api/stream', mode='direct' if direct else 'proxy'):
+                final_stream_url = build_stream_url(result.get('stream_url', ''), api_key, direct, result.get('song_id'))
             
             # Return professional response with hidden source details
             return jsonify({
@@ -178,6 +325,108 @@ def stream_music():
             'response_time': response_time
         }), 500
 
+@app.route('/api/stream/batch', methods=['POST'])
+def stream_music_batch():
+    """Resolve many queries under one API key; optionally streamed back as NDJSON"""
+    start_time = time.time()
+    data = request.get_json(silent=True) or {}
+    
+    api_key = data.get('api_key') or request.args.get('api_key')
+    queries = data.get('queries')
+    source = data.get('source', 'auto')
+    direct = str(data.get('direct', 'false')).lower() == 'true'
+    stream = str(data.get('stream', request.args.get('stream', 'false'))).lower() == 'true'
+    
+    if not api_key:
+        return jsonify({'error': 'API key is required'}), 400
+    
+    if not queries or not isinstance(queries, list) or not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify({'error': 'Queries must be a non-empty list of strings'}), 400
+    
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({'error': f'At most {BATCH_MAX_QUERIES} queries per batch'}), 400
+    
+    # Validate API key once, with room for the whole batch
+    is_valid, message = APIKey.validate_api_key(api_key, cost=len(queries))
+    if not is_valid:
+        return jsonify({'error': message}), 401
+    
+    # Charge the whole batch atomically up front; queries that find nothing are refunded below
+    try:
+        reserved = APIKey.reserve_usage(api_key, len(queries))
+    except Exception as e:
+        logging.error(f"Batch quota reservation error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+    if not reserved:
+        return jsonify({'error': 'Batch exceeds remaining daily request limit'}), 401
+    
+    def resolve(index, query):
+        item_start = time.time()
+        try:
+            return index, query, music_sources.search_music(query, source), time.time() - item_start
+        except Exception as e:
+            logging.error(f"Batch item error for '{query}': {str(e)}")
+            return index, query, None, time.time() - item_start
+    
+    def format_item(index, query, result):
+        if not result:
+            return {'index': index, 'query': query, 'success': False, 'error': 'No music found for the given query'}
+        return {
+            'index': index,
+            'query': query,
+            'success': True,
+            'title': result.get('title', ''),
+            'artist': result.get('artist', ''),
+            'duration': result.get('duration', ''),
+            # Proxy URLs need the request context, so they are built here rather than in the pool
+            'stream_url': build_stream_url(result.get('stream_url', ''), api_key, direct, result.get('song_id')),
+            'quality': result.get('quality', '320kbps')
+        }
+    
+    def generate_items():
+        futures = [batch_executor.submit(resolve, index, query) for index, query in enumerate(queries)]
+        log_entries = []
+        try:
+            for future in as_completed(futures):
+                index, query, result, item_time = future.result()
+                log_entries.append((api_key, '/api/stream/batch', query, item_time, bool(result)))
+                yield format_item(index, query, result)
+        finally:
+            for future in futures:
+                future.cancel()
+            # Only resolved tracks are charged: refund the rest of the reservation
+            unresolved = len(queries) - sum(1 for entry in log_entries if entry[4])
+            try:
+                if unresolved:
+                    APIKey.increment_usage(api_key, -unresolved)
+                UsageStats.log_requests(log_entries)
+            except Exception as e:
+                logging.error(f"Batch usage accounting error: {str(e)}")
+    
+    def summary(items):
+        resolved = sum(1 for item in items if item['success'])
+        return {
+            'success': resolved > 0,
+            'resolved': resolved,
+            'failed': len(queries) - resolved,
+            'response_time': round(time.time() - start_time, 2),
+            'api_owner': 'https://t.me/INNOCENT_FUCKER',
+            'powered_by': 'Flaks Music API'
+        }
+    
+    if stream:
+        def generate_ndjson():
+            items = []
+            for item in generate_items():
+                items.append(item)
+                yield json.dumps(item) + '\n'
+            yield json.dumps(dict(summary(items), done=True)) + '\n'
+        
+        return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    
+    items = sorted(generate_items(), key=lambda item: item['index'])
+    return jsonify(dict(summary(items), results=items))
+
 @app.route('/api/search')
 def search_music():
     """Search music without streaming"""
@@ -192,21 +441,25 @@ def search_music():
         return jsonify({'error': 'Query is required'}), 400
     
     # Validate API key
-    is_valid, message = APIKey.validate_api_key(api_key)
+    with metrics.span('validate_key', endpoint='/api/search') as span:
+        is_valid, message = APIKey.validate_api_key(api_key)
+        span.outcome = 'ok' if is_valid else 'rejected'
     if not is_valid:
         return jsonify({'error': message}), 401
     
     try:
-        result = music_sources.search_music(query, source)
+        with metrics.span('search', endpoint='/api/search', source=metrics.source_label(source)) as span:
+            result = music_sources.search_music(query, source)
+            span.outcome = 'ok' if result else 'miss'
         
         if result:
             APIKey.increment_usage(api_key)
             return jsonify({
                 'success': True,
-                'title': result['title'],
-                'artist': result['artist'],
-                'duration': result['duration'],
-                'quality': result['quality'],
+                'title': result.get('title', ''),
+                'artist': result.get('artist', ''),
+                'duration': result.get('duration', ''),
+                'quality': result.get('quality', '320kbps'),
                 'api_owner': 'https://t.me/INNOCENT_FUCKER',
                 'powered_by': 'Flaks Music API'
             })
@@ -222,24 +475,41 @@ def get_trending():
     """Get trending music"""
     api_key = request.args.get('api_key')
     source = request.args.get('source', 'jiosaavn')
-    limit = int(request.args.get('limit', 10))
+    region = request.args.get('region', 'in').lower()
     
     if not api_key:
         return jsonify({'error': 'API key is required'}), 400
     
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+        page = max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        return jsonify({'error': 'limit and page must be integers'}), 400
+    if not REGION_PATTERN.match(region):
+        return jsonify({'error': 'region must be a two-letter country code'}), 400
+    if source not in TRENDING_SOURCES:
+        return jsonify({'error': f"source must be one of: {', '.join(TRENDING_SOURCES)}"}), 400
+    
     # Validate API key
     is_valid, message = APIKey.validate_api_key(api_key)
     if not is_valid:
         return jsonify({'error': message}), 401
     
     try:
-        trending = music_sources.get_trending_music(source, limit)
+        # Served from the in-memory trending cache; upstream is only hit by the background refresher
+        trending, total, updated_at, stale = music_sources.get_trending_page(source, limit, region, page)
         APIKey.increment_usage(api_key)
         
         return jsonify({
             'success': True,
             'trending': trending,
-            'source': source
+            'source': source,
+            'region': region,
+            'page': page,
+            'limit': limit,
+            'total': total,
+            'updated_at': int(updated_at) or None,
+            'stale': stale
         })
         
     except Exception as e:
@@ -268,7 +538,7 @@ def api_status():
         'is_active': key_data.get('is_active')
     })
 
-@app.route('/proxy/stream/<url_hash>')
+@app.route('/proxy/stream/<url_hash>', methods=['GET', 'HEAD'])
 def proxy_stream(url_hash):
     """Proxy stream endpoint to hide original URLs"""
     return proxy_handler.stream_audio(url_hash)
@@ -0,0 +1,196 @@
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+from stream_urls import get_stream_url_ttl
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Results backed by a JioSaavn song are cached until their stream URL expires;
+# anything else is a fallback (YouTube, free APIs) and only cached briefly
+AUTHORITATIVE_SOURCES = frozenset(['optimized_search', 'hybrid_search', 'jiosaavn', 'catalog'])
+GENERATION_ID = 'generation'
+
+def normalize_query(query):
+    """Normalize a search query so trivially different spellings share a cache key"""
+    query = unicodedata.normalize('NFKC', query or '').casefold()
+    return WHITESPACE_PATTERN.sub(' ', query).strip()
+
+class SearchCache:
+    """Two-tier cache of search_music results: in-process LRU backed by MongoDB"""
+
+    def __init__(self, mongo_client=None, max_entries=2000, default_ttl=3600, max_ttl=86400,
+                 fallback_ttl=None, sync_interval=None):
+        self.local = TTLCache(max_entries=max_entries, default_ttl=default_ttl)
+        self.default_ttl = default_ttl
+        self.max_ttl = max_ttl
+        if fallback_ttl is None:
+            fallback_ttl = int(os.environ.get("SEARCH_CACHE_FALLBACK_TTL", 60))
+        self.fallback_ttl = fallback_ttl
+
+        self.mongo_client = mongo_client
+        self.collection = None
+        self.meta_collection = None
+        if self.mongo_client:
+            self.collection = self.mongo_client['flaks_music_api']['search_cache']
+            self.meta_collection = self.mongo_client['flaks_music_api']['search_cache_meta']
+            try:
+                # Create TTL index for auto-cleanup and an index for purge-by-query
+                self.collection.create_index("expires_at", expireAfterSeconds=0)
+                self.collection.create_index("query")
+            except Exception as e:
+                logger.error(f"Search cache index error: {e}")
+
+        # Purges bump a shared generation; each worker drops its local tier when it sees a new one
+        if sync_interval is None:
+            sync_interval = float(os.environ.get("SEARCH_CACHE_SYNC_INTERVAL", 5))
+        self.sync_interval = sync_interval
+        self._generation = 0
+        self._generation = self._read_generation()
+        self._generation_checked = time.monotonic()
+
+        self._stats_lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @staticmethod
+    def make_key(query, source):
+        return (normalize_query(query), source or 'auto')
+
+    def get(self, query, source="auto", count=True):
+        """Return a copy of the cached result for query/source, or None"""
+        key = self.make_key(query, source)
+
+        result = self.local.get(key) if self._local_is_current() else None
+        if result is not None:
+            if count:
+                self._count('local_hits')
+            return dict(result)
+
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one({'_id': self.key_name(key)})
+                if doc and doc['expires_at'] > datetime.utcnow():
+                    remaining = (doc['expires_at'] - datetime.utcnow()).total_seconds()
+                    self.local.set(key, doc['result'], ttl=remaining)
+                    if count:
+                        self._count('shared_hits')
+                    return dict(doc['result'])
+            except Exception as e:
+                logger.error(f"Search cache read error: {e}")
+
+        if count:
+            self._count('misses')
+        return None
+
+    def set(self, query, source, result):
+        """Cache a result until shortly before its stream URL expires, or for fallback_ttl if it is a fallback"""
+        ttl = get_stream_url_ttl(result.get('stream_url', ''), self.default_ttl, self.max_ttl)
+        if result.get('source') not in AUTHORITATIVE_SOURCES:
+            ttl = min(ttl, self.fallback_ttl)
+        if ttl <= 0:
+            return
+
+        key = self.make_key(query, source)
+        result = {k: v for k, v in result.items() if k != 'response_time'}
+        self.local.set(key, result, ttl=ttl)
+
+        if self.collection is not None:
+            try:
+                self.collection.replace_one(
+                    {'_id': self.key_name(key)},
+                    {
+                        'query': key[0],
+                        'source': key[1],
+                        'result': result,
+                        'created_at': datetime.utcnow(),
+                        'expires_at': datetime.utcnow() + timedelta(seconds=ttl)
+                    },
+                    upsert=True
+                )
+            except Exception as e:
+                logger.error(f"Search cache write error: {e}")
+
+    def purge(self, query):
+        """
+        Remove every cached source variant of a query from both tiers.
+        Other workers drop their local tier within sync_interval; without
+        MongoDB the purge only reaches this worker.
+        """
+        normalized = normalize_query(query)
+        removed = self.local.delete_where(lambda key: key[0] == normalized)
+
+        if self.collection is not None:
+            try:
+                removed = max(removed, self.collection.delete_many({'query': normalized}).deleted_count)
+                doc = self.meta_collection.find_one_and_update(
+                    {'_id': GENERATION_ID},
+                    {'$inc': {'value': 1}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                if doc['value'] == self._generation + 1:
+                    # Nobody else purged in between, so this worker is already current
+                    self._generation = doc['value']
+            except Exception as e:
+                logger.error(f"Search cache purge error: {e}")
+
+        logger.info(f"Purged {removed} search cache entries for: '{normalized}'")
+        return removed
+
+    def _read_generation(self):
+        if self.meta_collection is None:
+            return 0
+        try:
+            doc = self.meta_collection.find_one({'_id': GENERATION_ID})
+            return doc['value'] if doc else 0
+        except Exception as e:
+            logger.error(f"Search cache generation read error: {e}")
+            return self._generation
+
+    def _local_is_current(self):
+        """Clear the local tier if another worker purged since the last check (at most every sync_interval)"""
+        if self.meta_collection is None or time.monotonic() - self._generation_checked < self.sync_interval:
+            return True
+        self._generation_checked = time.monotonic()
+        generation = self._read_generation()
+        if generation == self._generation:
+            return True
+        self._generation = generation
+        self.local.clear()
+        return False
+
+    def get_stats(self):
+        """Hit/miss counters for the admin panel"""
+        with self._stats_lock:
+            hits = self.local_hits + self.shared_hits
+            lookups = hits + self.misses
+            return {
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'local_entries': len(self.local),
+                'generation': self._generation,
+                'local_evictions': self.local.evictions
+            }
+
+    @staticmethod
+    def key_name(key):
+        """Flat string form of a cache key, used as the Mongo _id"""
+        return f"{key[1]}:{key[0]}"
+
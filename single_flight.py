@@ -0,0 +1,111 @@
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single execution"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, timeout=None):
+        """Run fn() once for all threads asking for key at the same time and share its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not call.event.wait(timeout):
+                logger.warning(f"Timed out waiting for in-flight call {key!r}; running it directly")
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls)
+            }
+
+class MongoLease:
+    """Short-lived named lock shared by all workers through a MongoDB collection"""
+
+    def __init__(self, mongo_client, collection_name='search_locks', ttl=10):
+        self.collection = mongo_client['flaks_music_api'][collection_name]
+        self.ttl = ttl
+        try:
+            # Backstop for leases of crashed workers; acquire() also expires them itself
+            self.collection.create_index("expires_at", expireAfterSeconds=0)
+        except Exception as e:
+            logger.error(f"Lease index error: {e}")
+
+    def acquire(self, name):
+        """Return an owner token if the lease was taken, None if another worker holds it"""
+        token = f"{os.getpid()}:{uuid.uuid4().hex}"
+        now = datetime.utcnow()
+
+        for _ in range(2):
+            try:
+                self.collection.insert_one({
+                    '_id': name,
+                    'owner': token,
+                    'expires_at': now + timedelta(seconds=self.ttl)
+                })
+                return token
+            except DuplicateKeyError:
+                # Take over the lease only if its holder let it expire
+                if not self.collection.delete_one({'_id': name, 'expires_at': {'$lt': now}}).deleted_count:
+                    return None
+            except Exception as e:
+                logger.error(f"Lease acquire error: {e}")
+                return token  # Fail open: resolve locally rather than block
+
+        return None
+
+    def is_held(self, name):
+        try:
+            doc = self.collection.find_one({'_id': name}, {'expires_at': 1})
+            return bool(doc and doc['expires_at'] > datetime.utcnow())
+        except Exception as e:
+            logger.error(f"Lease read error: {e}")
+            return False
+
+    def release(self, name, token):
+        try:
+            self.collection.delete_one({'_id': name, 'owner': token})
+        except Exception as e:
+            logger.error(f"Lease release error: {e}")
@@ -0,0 +1,268 @@
+import html
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from search_cache import normalize_query
+from stream_urls import get_stream_url_ttl
+
+logger = logging.getLogger(__name__)
+
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]+')
+BRACKETED_PATTERN = re.compile(r'\s*[\(\[][^\)\]]*[\)\]]')
+QUALITY_ORDER = ('320kbps', '160kbps', '96kbps', '48kbps', '12kbps')
+
+def normalize_text(text):
+    """Lowercase, entity-free, punctuation-free form of a title or artist string"""
+    text = normalize_query(html.unescape(text or ''))
+    return normalize_query(PUNCTUATION_PATTERN.sub(' ', text))
+
+def trigrams(text):
+    """Character trigrams of each word, padded so word starts and ends count"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def dice(a, b):
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+class _Song:
+    __slots__ = ('data', 'title_grams', 'full_grams', 'served')
+
+    def __init__(self, data):
+        self.data = data
+        # "Tum Hi Ho (From "Aashiqui 2")" is matched as "tum hi ho"
+        title = normalize_text(BRACKETED_PATTERN.sub('', html.unescape(data.get('title', '')))) \
+            or normalize_text(data.get('title', ''))
+        self.title_grams = trigrams(title)
+        self.full_grams = self.title_grams | trigrams(normalize_text(' '.join(data.get('artists', []))))
+        self.served = 0
+
+class SongCatalog:
+    """Every JioSaavn song we have seen, with a trigram index for typo-tolerant title lookup"""
+
+    def __init__(self, mongo_client=None, max_songs=50000, min_score=0.8, candidates=20, sync_interval=60,
+                 max_postings=5000):
+        self.max_songs = max_songs
+        self.min_score = min_score
+        self.candidates = candidates
+        self.sync_interval = sync_interval
+        # Song ids counted per lookup. Candidates come from the query's rarest trigrams
+        # first; common ones ("  t", "ove") say little about which song is meant
+        # but would dominate the counting cost
+        self.max_postings = max_postings
+
+        self._lock = threading.Lock()
+        self._songs = OrderedDict()  # song id -> _Song, least recently stored first
+        self._index = {}  # trigram -> set of song ids
+        self._writer = None
+        self._writer_pid = None
+        self._last_sync = None
+        self._next_sync = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+        self.collection = None
+        if mongo_client:
+            self.collection = mongo_client['flaks_music_api']['song_catalog']
+            try:
+                self.collection.create_index("updated_at")
+            except Exception as e:
+                logger.error(f"Song catalog index error: {e}")
+
+    @staticmethod
+    def from_api_song(song):
+        """Catalog record from a saavn.dev song object (search or details response)"""
+        download_urls = {
+            item.get('quality'): item.get('url')
+            for item in song.get('downloadUrl') or []
+            if item.get('quality') and item.get('url')
+        }
+        return {
+            'id': song.get('id', ''),
+            'title': html.unescape(song.get('name', '')),
+            'artists': [artist.get('name', '') for artist in (song.get('artists') or {}).get('primary') or []],
+            'album': html.unescape((song.get('album') or {}).get('name') or ''),
+            'duration': song.get('duration'),
+            'image': song.get('image', [{}])[-1].get('url', '') if song.get('image') else '',
+            'download_urls': download_urls
+        }
+
+    @staticmethod
+    def best_url(record):
+        """Highest quality download URL of a record"""
+        urls = record.get('download_urls') or {}
+        for quality in QUALITY_ORDER:
+            if urls.get(quality):
+                return urls[quality]
+        return next(iter(urls.values()), '')
+
+    def _insert(self, record):
+        song_id = record['id']
+        self._remove(song_id)
+        song = _Song(record)
+        self._songs[song_id] = song
+        for gram in song.full_grams:
+            self._index.setdefault(gram, set()).add(song_id)
+        while len(self._songs) > self.max_songs:
+            self._remove(next(iter(self._songs)))
+
+    def _remove(self, song_id):
+        song = self._songs.pop(song_id, None)
+        if song is None:
+            return
+        for gram in song.full_grams:
+            ids = self._index.get(gram)
+            if ids is not None:
+                ids.discard(song_id)
+                if not ids:
+                    del self._index[gram]
+
+    def add(self, records):
+        """Index songs now; persist them to MongoDB in the background"""
+        records = [record for record in records if record.get('id') and record.get('title')]
+        if not records:
+            return
+        with self._lock:
+            for record in records:
+                self._insert(record)
+        if self.collection is not None:
+            self._get_writer().submit(self._persist, records)
+
+    def _get_writer(self):
+        # Executor threads do not survive fork(), so each worker gets its own
+        if self._writer is None or self._writer_pid != os.getpid():
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='song-catalog')
+            self._writer_pid = os.getpid()
+        return self._writer
+
+    def _persist(self, records):
+        now = datetime.utcnow()
+        for record in records:
+            try:
+                self.collection.replace_one(
+                    {'_id': record['id']},
+                    dict(record, updated_at=now),
+                    upsert=True
+                )
+            except Exception as e:
+                logger.error(f"Song catalog write error: {e}")
+
+    def sync(self):
+        """Pull songs other workers stored since the last sync"""
+        if self.collection is None:
+            return 0
+        query = {'updated_at': {'$gt': self._last_sync}} if self._last_sync else {}
+        try:
+            docs = list(
+                self.collection.find(query, {'_id': 0})
+                .sort('updated_at', -1)
+                .limit(self.max_songs)
+            )
+        except Exception as e:
+            logger.error(f"Song catalog sync error: {e}")
+            return 0
+        if not docs:
+            return 0
+        with self._lock:
+            for doc in reversed(docs):
+                self._insert({k: v for k, v in doc.items() if k != 'updated_at'})
+        self._last_sync = docs[0]['updated_at']
+        return len(docs)
+
+    def _maybe_sync(self):
+        now = time.time()
+        if now < self._next_sync:
+            return
+        self._next_sync = now + self.sync_interval
+        # Lookups run on the event loop, so the Mongo read happens on the writer thread
+        self._get_writer().submit(self.sync)
+
+    def match(self, query):
+        """Return (record, score) for the best confident match of query, or (None, score)"""
+        if self.collection is not None:
+            self._maybe_sync()
+
+        query_grams = trigrams(normalize_text(query))
+        if len(query_grams) < 4:
+            return None, 0.0
+
+        # Copy the (bounded) posting lists under the lock and count outside it,
+        # so concurrent lookups and inserts do not queue behind the counting
+        with self._lock:
+            postings, budget = [], self.max_postings
+            for ids in sorted(filter(None, map(self._index.get, query_grams)), key=len):
+                if len(ids) > budget:
+                    break
+                postings.append(tuple(ids))
+                budget -= len(ids)
+        shared = Counter()
+        for ids in postings:
+            shared.update(ids)
+
+        with self._lock:
+            best, best_key = None, (0.0, 0)
+            for song_id, _ in shared.most_common(self.candidates):
+                song = self._songs.get(song_id)
+                if song is None:
+                    continue  # Evicted since the postings were copied
+                # The query must spell out (most of) the title; an artist name alone
+                # matches many songs and is left to upstream ranking
+                if len(query_grams & song.title_grams) < self.min_score * len(song.title_grams):
+                    continue
+                score = max(dice(query_grams, song.title_grams), dice(query_grams, song.full_grams))
+                # Equal scores go to the song this catalog has served most
+                if (score, song.served) > best_key:
+                    best, best_key = song, (score, song.served)
+
+            score = best_key[0]
+            if best is None or score < self.min_score:
+                self.misses += 1
+                return None, score
+            best.served += 1
+            self.hits += 1
+            return dict(best.data), score
+
+    def record_refresh(self):
+        with self._lock:
+            self.refreshes += 1
+
+    def needs_refresh(self, record, min_ttl=300):
+        """True when the record's stream URL is about to expire"""
+        url = self.best_url(record)
+        return not url or get_stream_url_ttl(url, default_ttl=min_ttl) < min_ttl
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'songs': len(self._songs),
+                'trigrams': len(self._index),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'refreshes': self.refreshes
+            }
+
+def create_song_catalog(mongo_client=None):
+    """Build the catalog from CATALOG_MAX_SONGS / CATALOG_MIN_SCORE; None when disabled"""
+    max_songs = int(os.environ.get("CATALOG_MAX_SONGS", 50000))
+    if max_songs <= 0:
+        return None
+    return SongCatalog(
+        mongo_client=mongo_client,
+        max_songs=max_songs,
+        min_score=float(os.environ.get("CATALOG_MIN_SCORE", 0.8)),
+        max_postings=int(os.environ.get("CATALOG_MAX_POSTINGS", 5000))
+    )
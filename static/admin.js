@@ -79,6 +79,43 @@ async function deleteApiKey(apiKey) {
     }
 }
 
+// Purge cached search results for a query
+async function purgeSearchCache() {
+    const query = document.getElementById('purgeQuery').value;
+    
+    if (!query.trim()) {
+        alert('Please enter a query');
+        return;
+    }
+    
+    try {
+        const response = await fetch('/admin/cache/purge', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                query: query
+            })
+        });
+        
+        const data = await response.json();
+        
+        if (data.success) {
+            const scope = data.all_workers
+                ? `other workers drop it within ${data.sync_seconds}s`
+                : 'only this worker was purged (no MongoDB)';
+            alert(`Purged ${data.removed} cached entries; ${scope}`);
+            document.getElementById('purgeQuery').value = '';
+        } else {
+            alert('Error purging cache: ' + data.error);
+        }
+    } catch (error) {
+        console.error('Error:', error);
+        alert('Network error occurred');
+    }
+}
+
 // Copy API key to clipboard
 async function copyApiKey(apiKey) {
     try {
@@ -117,17 +154,27 @@ function initializeUsageChart() {
     const ctx = document.getElementById('usageChart');
     if (!ctx) return;
     
-    // Sample data for the chart
+    // Per-day aggregates rendered by the server
+    const daily = JSON.parse(ctx.dataset.daily || '[]');
     const chartData = {
-        labels: ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'],
+        labels: daily.map(day => day.day),
         datasets: [{
             label: 'API Requests',
-            data: [120, 190, 300, 500, 200, 300, 450],
+            data: daily.map(day => day.requests),
             backgroundColor: 'rgba(29, 185, 84, 0.1)',
             borderColor: '#1DB954',
             borderWidth: 2,
             fill: true,
-            tension: 0.4
+            tension: 0.4,
+            yAxisID: 'y'
+        }, {
+            label: 'p95 Latency (ms)',
+            data: daily.map(day => day.p95_ms),
+            borderColor: '#FFB020',
+            borderWidth: 2,
+            fill: false,
+            tension: 0.4,
+            yAxisID: 'latency'
         }]
     };
     
@@ -154,6 +201,16 @@ function initializeUsageChart() {
                         color: 'rgba(255, 255, 255, 0.1)'
                     }
                 },
+                latency: {
+                    position: 'right',
+                    beginAtZero: true,
+                    ticks: {
+                        color: '#FFB020'
+                    },
+                    grid: {
+                        drawOnChartArea: false
+                    }
+                },
                 x: {
                     ticks: {
                         color: '#FFFFFF'
@@ -181,7 +238,6 @@ function autoRefreshStats() {
                 document.getElementById('totalKeys').textContent = data.total_keys || 0;
                 document.getElementById('totalRequests').textContent = data.total_requests || 0;
                 document.getElementById('activeUsers').textContent = data.active_users || 0;
-                document.getElementById('revenue').textContent = `₹${data.revenue || 0}`;
             }
         } catch (error) {
             console.error('Error refreshing stats:', error);
@@ -0,0 +1,37 @@
+import re
+import time
+from urllib.parse import urlparse, parse_qs
+
+# Query parameters CDNs use to carry an absolute expiry (epoch seconds)
+EXPIRY_PARAMS = ('expires', 'expiry', 'exp', 'e', 'x-amz-expires-at')
+
+# Akamai-style token: __gda__=exp=1700000000~hmac=... or hdnea=st=...~exp=...
+AKAMAI_EXP_PATTERN = re.compile(r'(?:^|~)exp=(\d{9,11})')
+
+def get_stream_url_expiry(url):
+    """Return the epoch second at which a signed stream URL expires, or None"""
+    if not url:
+        return None
+
+    try:
+        params = parse_qs(urlparse(url).query)
+    except ValueError:
+        return None
+
+    for name, values in params.items():
+        lowered = name.lower()
+        for value in values:
+            if lowered in EXPIRY_PARAMS and value.isdigit() and 9 <= len(value) <= 11:
+                return int(value)
+            match = AKAMAI_EXP_PATTERN.search(value)
+            if match:
+                return int(match.group(1))
+
+    return None
+
+def get_stream_url_ttl(url, default_ttl=3600, max_ttl=86400, margin=60):
+    """Seconds a stream URL can safely be reused, derived from its encoded expiry"""
+    expires_at = get_stream_url_expiry(url)
+    if expires_at is None:
+        return default_ttl
+    return max(0, min(max_ttl, int(expires_at - time.time()) - margin))
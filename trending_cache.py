@@ -0,0 +1,160 @@
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Trending feeds are keyed by source and ISO country code
+REGION_PATTERN = re.compile(r'^[a-z]{2}$')
+TRENDING_SOURCES = ('jiosaavn',)
+
+class _Feed:
+    def __init__(self):
+        self.items = None
+        self.updated_at = 0.0
+        self.last_requested = time.time()
+        self.last_error = None
+        self.refreshing = False
+        self.ready = threading.Event()
+
+class TrendingCache:
+    """Per (source, region) trending lists, refreshed in the background and served stale-while-revalidate"""
+
+    def __init__(self, fetch, refresh_interval=300, idle_timeout=86400, cold_wait=2.0):
+        self.fetch = fetch  # fetch(source, region) -> full list of songs
+        self.refresh_interval = refresh_interval
+        self.idle_timeout = idle_timeout
+        self.cold_wait = cold_wait
+
+        self._lock = threading.Lock()
+        self._feeds = {}
+        self._thread = None
+        self._pid = None
+        self._wakeup = threading.Event()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.cold_misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def _ensure_started(self):
+        # The refresher thread does not survive fork(), so each worker starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            for feed in self._feeds.values():
+                feed.refreshing = False
+            self._thread = threading.Thread(target=self._run, name='trending-refresh', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(min(self.refresh_interval, 30))
+            self._wakeup.clear()
+            now = time.time()
+            with self._lock:
+                for key, feed in list(self._feeds.items()):
+                    if now - feed.last_requested > self.idle_timeout:
+                        del self._feeds[key]
+                due = [
+                    key for key, feed in self._feeds.items()
+                    if not feed.refreshing and now - feed.updated_at >= self.refresh_interval
+                ]
+                for key in due:
+                    self._feeds[key].refreshing = True
+            for key in due:
+                self._refresh(key)
+
+    def _refresh(self, key):
+        source, region = key
+        try:
+            items = self.fetch(source, region)
+            error = None
+        except Exception as e:
+            items, error = None, str(e)
+
+        with self._lock:
+            feed = self._feeds.get(key)
+            if feed is None:
+                return
+            feed.refreshing = False
+            # An empty or failed refresh keeps serving the previous list
+            if items:
+                feed.items = items
+                feed.updated_at = time.time()
+                feed.last_error = None
+                self.refreshes += 1
+            else:
+                feed.last_error = error or 'empty response'
+                self.refresh_errors += 1
+                if feed.items is None:
+                    # Retry a cold feed on the next pass rather than after a full interval
+                    feed.updated_at = 0.0
+            feed.ready.set()
+
+        if error:
+            logger.error(f"Trending refresh error for {source}/{region}: {error}")
+
+    def warm(self, source, region):
+        """Schedule a feed for background refresh without waiting for it"""
+        self._ensure_started()
+        with self._lock:
+            if (source, region) not in self._feeds:
+                self._feeds[(source, region)] = _Feed()
+        self._wakeup.set()
+
+    def is_warm(self, source, region):
+        """True when get() will answer from memory without waiting"""
+        feed = self._feeds.get((source, region))
+        return feed is not None and feed.items is not None
+
+    def get(self, source, region):
+        """Return (items, updated_at, stale); only a feed's very first request waits, up to cold_wait"""
+        self._ensure_started()
+        key = (source, region)
+        with self._lock:
+            feed = self._feeds.get(key)
+            if feed is None:
+                feed = self._feeds[key] = _Feed()
+            feed.last_requested = time.time()
+            items = feed.items
+            stale = time.time() - feed.updated_at >= self.refresh_interval
+
+            if items is not None:
+                if stale:
+                    self.stale_hits += 1
+                else:
+                    self.hits += 1
+                if stale and not feed.refreshing:
+                    self._wakeup.set()
+                return items, feed.updated_at, stale
+            self.cold_misses += 1
+
+        self._wakeup.set()
+        feed.ready.wait(self.cold_wait)
+        with self._lock:
+            return feed.items or [], feed.updated_at, True
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'cold_misses': self.cold_misses,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'feeds': {
+                    f"{source}/{region}": {
+                        'items': len(feed.items or []),
+                        'age_seconds': round(time.time() - feed.updated_at, 1) if feed.updated_at else None,
+                        'last_error': feed.last_error
+                    }
+                    for (source, region), feed in self._feeds.items()
+                }
+            }
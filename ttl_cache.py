@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU map with a per-entry expiry"""
+
+    def __init__(self, max_entries=1000, default_ttl=3600):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Return a live value and mark it most recently used"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if item[0] <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return item[1]
+
+    def get_with_ttl(self, key):
+        """Return (value, remaining_seconds) or (None, 0)"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None, 0
+            remaining = item[0] - time.time()
+            if remaining <= 0:
+                del self._data[key]
+                return None, 0
+            self._data.move_to_end(key)
+            return item[1], remaining
+
+    def set(self, key, value, ttl=None):
+        """Store a value, evicting the least recently used entries beyond max_entries"""
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def delete_where(self, predicate):
+        """Delete every entry whose key matches predicate; returns the count"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def purge_expired(self):
+        """Drop expired entries; returns the count"""
+        now = time.time()
+        with self._lock:
+            keys = [key for key, item in self._data.items() if item[0] <= now]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def items(self):
+        """Snapshot of live (key, value) pairs"""
+        now = time.time()
+        with self._lock:
+            return [(key, item[1]) for key, item in self._data.items() if item[0] > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
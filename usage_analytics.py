@@ -0,0 +1,122 @@
+import logging
+from datetime import datetime, timedelta
+
+from metrics import DEFAULT_BUCKETS, quantile_from_counts
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (0.5, 0.95, 0.99)
+# Fields the dashboard and the usage log drill-down display
+LOG_PROJECTION = {'_id': 0, 'api_key': 1, 'endpoint': 1, 'query': 1, 'response_time': 1, 'success': 1, 'timestamp': 1}
+MAX_PER_PAGE = 100
+
+def _summary_group(group_id):
+    return {'$group': {
+        '_id': group_id,
+        'requests': {'$sum': '$count'},
+        'successes': {'$sum': '$successes'},
+        'latency_sum': {'$sum': '$latency_sum'}
+    }}
+
+def _histogram_facet(group_id):
+    return [
+        {'$unwind': '$h'},
+        {'$group': {'_id': {'g': group_id, 'b': '$h.k'}, 'n': {'$sum': '$h.v'}}}
+    ]
+
+def _histogram_percentiles(rows):
+    """Percentiles per group from (group, bucket index, count) histogram rows"""
+    counts = {}
+    for row in rows:
+        group_counts = counts.setdefault(row['_id'].get('g'), [0] * (len(DEFAULT_BUCKETS) + 1))
+        group_counts[int(row['_id']['b'])] += row['n']
+    return {
+        group: [quantile_from_counts(DEFAULT_BUCKETS, group_counts, q) for q in PERCENTILES]
+        for group, group_counts in counts.items()
+    }
+
+def _format_row(row, percentiles=None):
+    requests = row.get('requests', 0)
+    result = {
+        'requests': requests,
+        'successes': row.get('successes', 0),
+        'success_rate': round(row.get('successes', 0) / requests, 4) if requests else 0.0,
+        'avg_ms': round(row.get('latency_sum', 0) / requests * 1000, 1) if requests else 0.0
+    }
+    for q, value in zip(PERCENTILES, percentiles or [None] * len(PERCENTILES)):
+        result[f"p{int(q * 100)}_ms"] = round(value * 1000, 1) if value is not None else None
+    return result
+
+def summarize_rollups(collection, days=7, api_key=None, top_keys=50):
+    """Request counts, success rate and latency percentiles overall, per key and per day, from usage rollups"""
+    match = {'minute': {'$gte': datetime.utcnow() - timedelta(days=days)}}
+    if api_key:
+        match['api_key'] = api_key
+
+    # Percentiles merge the per-minute latency histograms; MongoDB returns
+    # at most one row per group and bucket, however many requests there were
+    result = next(collection.aggregate([
+        {'$match': match},
+        {'$project': {
+            'api_key': 1, 'count': 1, 'successes': 1, 'latency_sum': 1,
+            'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$minute'}},
+            'h': {'$objectToArray': '$h'}
+        }},
+        {'$facet': {
+            'totals': [_summary_group(None)],
+            'per_key': [_summary_group('$api_key'), {'$sort': {'requests': -1}}, {'$limit': top_keys}],
+            'per_day': [_summary_group('$day'), {'$sort': {'_id': 1}}],
+            'key_histograms': _histogram_facet('$api_key'),
+            'day_histograms': _histogram_facet('$day')
+        }}
+    ]))
+
+    key_percentiles = _histogram_percentiles(result['key_histograms'])
+    day_percentiles = _histogram_percentiles(result['day_histograms'])
+    total_percentiles = _histogram_percentiles(
+        [{'_id': {'b': row['_id']['b']}, 'n': row['n']} for row in result['day_histograms']]
+    ).get(None)
+
+    return {
+        'days': days,
+        'totals': _format_row(result['totals'][0] if result['totals'] else {}, total_percentiles),
+        'per_key': [
+            dict(_format_row(row, key_percentiles.get(row['_id'])), api_key=row['_id'])
+            for row in result['per_key']
+        ],
+        'per_day': [
+            dict(_format_row(row, day_percentiles.get(row['_id'])), day=row['_id'])
+            for row in result['per_day']
+        ]
+    }
+
+def get_usage_logs(collection, page=1, per_page=50, api_key=None, days=7):
+    """One page of raw request logs, newest first, with only the displayed fields"""
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    page = max(1, page)
+    match = {'timestamp': {'$gte': datetime.utcnow() - timedelta(days=days)}}
+    if api_key:
+        match['api_key'] = api_key
+
+    logs = list(
+        collection.find(match, LOG_PROJECTION)
+        .sort('timestamp', -1)
+        .skip((page - 1) * per_page)
+        .limit(per_page)
+    )
+    total = collection.count_documents(match)
+    return {
+        'logs': logs,
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'pages': (total + per_page - 1) // per_page
+    }
+
+def ensure_indexes(collection):
+    """Indexes behind the time-window and per-key queries above"""
+    try:
+        collection.create_index([('timestamp', -1)])
+        collection.create_index([('api_key', 1), ('timestamp', -1)])
+    except Exception as e:
+        logger.error(f"Usage stats index error: {e}")
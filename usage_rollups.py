@@ -0,0 +1,63 @@
+import bisect
+import logging
+import os
+import random
+
+from pymongo import UpdateOne
+
+from metrics import DEFAULT_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+def raw_sample_rate():
+    return float(os.environ.get("USAGE_RAW_SAMPLE_RATE", 0.01))
+
+def keep_raw_log(success, rate=None):
+    """Whether a request also gets a raw usage_stats document; failures are always kept while raw logging is on"""
+    rate = raw_sample_rate() if rate is None else rate
+    return rate > 0 and (not success or rate >= 1 or random.random() < rate)
+
+def latency_bucket(seconds):
+    """Index of the first DEFAULT_BUCKETS bound >= seconds; len(DEFAULT_BUCKETS) is +Inf"""
+    return bisect.bisect_left(DEFAULT_BUCKETS, seconds or 0.0)
+
+def rollup_key(document):
+    """(api_key, endpoint, minute) bucket a request document counts towards"""
+    return (
+        document.get("api_key"),
+        document.get("endpoint"),
+        document["timestamp"].replace(second=0, microsecond=0)
+    )
+
+def build_rollup_operations(documents):
+    """Merge request documents into one $inc upsert per (api_key, endpoint, minute)"""
+    buckets = {}
+    for document in documents:
+        increments = buckets.setdefault(rollup_key(document), {})
+        response_time = document.get("response_time") or 0.0
+        for field, amount in (
+            ("count", 1),
+            ("successes", 1 if document.get("success") else 0),
+            ("latency_sum", response_time),
+            (f"h.{latency_bucket(response_time)}", 1)
+        ):
+            increments[field] = increments.get(field, 0) + amount
+
+    return [
+        UpdateOne(
+            {"api_key": api_key, "endpoint": endpoint, "minute": minute},
+            {"$inc": increments},
+            upsert=True
+        )
+        for (api_key, endpoint, minute), increments in buckets.items()
+    ]
+
+def ensure_indexes(collection):
+    """Unique bucket key, plus a TTL on minute so old rollups age out after USAGE_ROLLUP_TTL_DAYS"""
+    try:
+        collection.create_index([("api_key", 1), ("endpoint", 1), ("minute", 1)], unique=True)
+        ttl_days = int(os.environ.get("USAGE_ROLLUP_TTL_DAYS", 90))
+        if ttl_days > 0:
+            collection.create_index("minute", expireAfterSeconds=ttl_days * 86400)
+    except Exception as e:
+        logger.error(f"Usage rollup index error: {e}")
@@ -0,0 +1,304 @@
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from usage_rollups import build_rollup_operations
+
+logger = logging.getLogger(__name__)
+
+class UsageWriter:
+    """Write-behind buffer for API key usage counters, per-minute usage rollups and request logs"""
+
+    def __init__(self, api_keys_collection, usage_stats_collection,
+                 max_queue=10000, batch_size=500, flush_interval=1.0, usage_rollups_collection=None):
+        self.api_keys_collection = api_keys_collection
+        self.usage_stats_collection = usage_stats_collection
+        self.usage_rollups_collection = usage_rollups_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'usage_updates_written': 0,
+            'rollup_updates_written': 0,
+            'logs_written': 0,
+            'failed_writes': 0,
+            'flushes': 0,
+            'last_flush_ms': 0.0
+        }
+        atexit.register(self.stop)
+
+    def _ensure_started(self):
+        # The flusher thread does not survive fork(), so each worker starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='usage-writer', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _bump(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _enqueue(self, item):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(item)
+            self._bump('enqueued')
+            return True
+        except queue.Full:
+            self._bump('dropped')
+            return False
+
+    def increment_usage(self, api_key, count=1):
+        """Queue a usage counter increment for api_key"""
+        return self._enqueue(('usage', api_key, count, datetime.utcnow()))
+
+    def log_request(self, document, keep_raw=True):
+        """Queue a request for the rollups, and as a usage_stats document if keep_raw"""
+        return self._enqueue(('log', document, keep_raw))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = []
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+
+    def _drain(self):
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def flush(self):
+        """Synchronously write everything currently queued"""
+        items = self._drain()
+        for start in range(0, len(items), self.batch_size):
+            self._write(items[start:start + self.batch_size])
+
+    @staticmethod
+    def build_operations(items):
+        """Merge queued items into (usage bulk_write operations, rollup operations, raw log documents)"""
+        # Merge increments per key so a burst becomes one update per key
+        usage = {}
+        requests = []
+        logs = []
+        for item in items:
+            if item[0] == 'usage':
+                _, api_key, count, used_at = item
+                total, last_used = usage.get(api_key, (0, used_at))
+                usage[api_key] = (total + count, max(last_used, used_at))
+            else:
+                _, document, keep_raw = item
+                requests.append(document)
+                if keep_raw:
+                    logs.append(document)
+
+        operations = [
+            UpdateOne(
+                {"api_key": api_key},
+                {
+                    "$inc": {"requests_today": count, "total_requests": count},
+                    "$set": {"last_used": last_used}
+                }
+            )
+            for api_key, (count, last_used) in usage.items()
+        ]
+        return operations, build_rollup_operations(requests), logs
+
+    def _write(self, items):
+        start_time = time.time()
+        operations, rollups, logs = self.build_operations(items)
+
+        with self._flush_lock:
+            if operations:
+                try:
+                    self.api_keys_collection.bulk_write(operations, ordered=False)
+                    self._bump('usage_updates_written', len(operations))
+                except Exception as e:
+                    self._bump('failed_writes', len(operations))
+                    logger.error(f"Usage counter flush error: {e}")
+
+            if rollups and self.usage_rollups_collection is not None:
+                try:
+                    self.usage_rollups_collection.bulk_write(rollups, ordered=False)
+                    self._bump('rollup_updates_written', len(rollups))
+                except Exception as e:
+                    self._bump('failed_writes', len(rollups))
+                    logger.error(f"Usage rollup flush error: {e}")
+
+            if logs:
+                try:
+                    self.usage_stats_collection.insert_many(logs, ordered=False)
+                    self._bump('logs_written', len(logs))
+                except Exception as e:
+                    self._bump('failed_writes', len(logs))
+                    logger.error(f"Usage log flush error: {e}")
+
+        with self._stats_lock:
+            self.stats['flushes'] += 1
+            self.stats['last_flush_ms'] = round((time.time() - start_time) * 1000, 2)
+
+    def stop(self, timeout=5):
+        """Stop the flusher and write whatever is still queued"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self._queue.qsize()
+        return stats
+
+class AsyncUsageWriter:
+    """asyncio/motor version of UsageWriter for the async server"""
+
+    def __init__(self, api_keys_collection, usage_stats_collection,
+                 max_queue=10000, batch_size=500, flush_interval=1.0, usage_rollups_collection=None):
+        self.api_keys_collection = api_keys_collection
+        self.usage_stats_collection = usage_stats_collection
+        self.usage_rollups_collection = usage_rollups_collection
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = None
+        self._task = None
+        self.stats = {
+            'enqueued': 0,
+            'dropped': 0,
+            'usage_updates_written': 0,
+            'rollup_updates_written': 0,
+            'logs_written': 0,
+            'failed_writes': 0,
+            'flushes': 0,
+            'last_flush_ms': 0.0
+        }
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    def _enqueue(self, item):
+        try:
+            self._queue.put_nowait(item)
+            self.stats['enqueued'] += 1
+            return True
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            return False
+
+    def increment_usage(self, api_key, count=1):
+        return self._enqueue(('usage', api_key, count, datetime.utcnow()))
+
+    def log_request(self, document, keep_raw=True):
+        return self._enqueue(('log', document, keep_raw))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            try:
+                while len(batch) < self.batch_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # Stopped while collecting: write what was already taken off the queue
+                await self._write(batch)
+                raise
+            # Shielded so stop() cannot lose a batch that is already being written
+            await asyncio.shield(self._write(batch))
+
+    async def _write(self, items):
+        start_time = time.time()
+        operations, rollups, logs = UsageWriter.build_operations(items)
+
+        if operations:
+            try:
+                await self.api_keys_collection.bulk_write(operations, ordered=False)
+                self.stats['usage_updates_written'] += len(operations)
+            except Exception as e:
+                self.stats['failed_writes'] += len(operations)
+                logger.error(f"Usage counter flush error: {e}")
+
+        if rollups and self.usage_rollups_collection is not None:
+            try:
+                await self.usage_rollups_collection.bulk_write(rollups, ordered=False)
+                self.stats['rollup_updates_written'] += len(rollups)
+            except Exception as e:
+                self.stats['failed_writes'] += len(rollups)
+                logger.error(f"Usage rollup flush error: {e}")
+
+        if logs:
+            try:
+                await self.usage_stats_collection.insert_many(logs, ordered=False)
+                self.stats['logs_written'] += len(logs)
+            except Exception as e:
+                self.stats['failed_writes'] += len(logs)
+                logger.error(f"Usage log flush error: {e}")
+
+        self.stats['flushes'] += 1
+        self.stats['last_flush_ms'] = round((time.time() - start_time) * 1000, 2)
+
+    async def stop(self):
+        """Stop the flusher and write whatever is still queued"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        items = []
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        for start in range(0, len(items), self.batch_size):
+            await self._write(items[start:start + self.batch_size])
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['queue_depth'] = self._queue.qsize() if self._queue else 0
+        return stats
@@ -3,8 +3,66 @@ import logging
 import requests
 import re
 import json
+from functools import lru_cache
 from urllib.parse import quote_plus
 
+# Common meaningful music keywords that often appear in song titles
+MUSIC_KEYWORDS = frozenset([
+    'pyaar', 'mohabbat', 'ishq', 'dil', 'tere', 'mera', 'tera', 'meri',
+    'sapno', 'raat', 'din', 'chandni', 'sitare', 'aankhon', 'khushi',
+    'gham', 'yaad', 'judaai', 'milna', 'bichadna', 'hasna', 'rona',
+    'love', 'heart', 'dream', 'night', 'moon', 'stars', 'eyes',
+    'smile', 'tears', 'together', 'forever', 'beautiful', 'baby'
+])
+FILLER_WORDS = frozenset(['main', 'mein', 'the', 'and', 'or', 'but'])
+
+NON_WORD_PATTERN = re.compile(r'[^\w]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# YouTube decorations removed wherever they appear: (Official Video), [Audio], (4K), ...
+DECORATION_PATTERN = re.compile(
+    r'\((?:Official.*?|Music Video|Audio|HD|4K|Lyrics|Full Song|Full Video)\)'
+    r'|\[(?:Official.*?|Music Video|Audio|HD|4K|Lyrics|Full Song|Full Video)\]',
+    re.IGNORECASE
+)
+# Then everything from the first credit or label mention onwards. Applied after
+# the "|" cut, as before, so a label named past the "|" does not truncate the title.
+CREDITS_PATTERN = re.compile(
+    r'-(?=.*(?:Record|Music)).*'  # Record label / music company mentions
+    r'|ft\..*|feat\..*|featuring.*',  # "ft.", "feat.", "featuring" and everything after
+    re.IGNORECASE
+)
+
+@lru_cache(maxsize=4096)
+def clean_music_title(title):
+    """Memoized title cleaner; YouTube results repeat across searches and slider pages"""
+    if not title:
+        return ""
+    
+    # For long lyrics queries, extract meaningful keywords
+    words = title.lower().split()
+    if len(words) > 6:  # Likely lyrics
+        # Extract relevant keywords from lyrics
+        keywords = []
+        for word in words:
+            clean_word = NON_WORD_PATTERN.sub('', word)
+            if len(clean_word) >= 3 and clean_word in MUSIC_KEYWORDS:
+                keywords.append(clean_word)
+        
+        if keywords:
+            # Return the most meaningful keywords (max 3 words)
+            return ' '.join(keywords[:3])
+        # Fallback: take first few meaningful words
+        meaningful_words = [w for w in words if len(w) >= 3 and w not in FILLER_WORDS]
+        return ' '.join(meaningful_words[:3]) if meaningful_words else title[:20]
+    
+    # For regular titles, clean YouTube-specific patterns
+    cleaned_title = DECORATION_PATTERN.sub('', title)
+    cleaned_title = cleaned_title.partition('|')[0]  # Everything after |
+    cleaned_title = CREDITS_PATTERN.sub('', cleaned_title, count=1)
+    
+    # Remove extra spaces, then leading/trailing dashes or other punctuation
+    return WHITESPACE_PATTERN.sub(' ', cleaned_title).strip().strip(' -–—|')
 
 class YouTubeSearchService:
     """
@@ -73,10 +131,9 @@ class YouTubeSearchService:
             
             titles = []
             if results and results.get('result'):
-                for video in results['result']:
-                    clean_title = self._clean_title_for_music_search(video.get('title', ''))
-                    if clean_title and clean_title not in titles:
-                        titles.append(clean_title)
+                cleaned = self.clean_titles([video.get('title', '') for video in results['result']])
+                # Keep the first occurrence of each distinct non-empty title
+                titles = [title for title in dict.fromkeys(cleaned) if title]
             
             return titles
             
@@ -95,78 +152,21 @@ class YouTubeSearchService:
         Returns:
             str: Cleaned keywords for music search
         """
-        if not title:
-            return ""
+        cleaned_title = clean_music_title(title)
+        logging.debug(f"Cleaned title: '{title}' -> '{cleaned_title}'")
+        return cleaned_title
+    
+    def clean_titles(self, titles):
+        """
+        Clean a batch of titles, e.g. every result of one YouTube search
         
-        # For long lyrics queries, extract meaningful keywords
-        if len(title.split()) > 6:  # Likely lyrics
-            # Extract meaningful Hindi/English music keywords
-            keywords = []
-            words = title.lower().split()
-            
-            # Common meaningful music keywords that often appear in song titles
-            music_keywords = [
-                'pyaar', 'mohabbat', 'ishq', 'dil', 'tere', 'mera', 'tera', 'meri',
-                'sapno', 'raat', 'din', 'chandni', 'sitare', 'aankhon', 'khushi',
-                'gham', 'yaad', 'judaai', 'milna', 'bichadna', 'hasna', 'rona',
-                'love', 'heart', 'dream', 'night', 'moon', 'stars', 'eyes',
-                'smile', 'tears', 'together', 'forever', 'beautiful', 'baby'
-            ]
-            
-            # Extract relevant keywords from lyrics
-            for word in words:
-                clean_word = re.sub(r'[^\w]', '', word)
-                if len(clean_word) >= 3 and clean_word in music_keywords:
-                    keywords.append(clean_word)
+        Args:
+            titles (list): Raw titles or lyrics queries
             
-            if keywords:
-                # Return the most meaningful keywords (max 3 words)
-                return ' '.join(keywords[:3])
-            else:
-                # Fallback: take first few meaningful words
-                meaningful_words = [w for w in words if len(w) >= 3 and not w in ['main', 'mein', 'the', 'and', 'or', 'but']]
-                return ' '.join(meaningful_words[:3]) if meaningful_words else title[:20]
-        
-        # For regular titles, clean YouTube-specific patterns
-        patterns_to_remove = [
-            r'\(Official.*?\)',  # (Official Video), (Official Audio), etc.
-            r'\[Official.*?\]',  # [Official Video], [Official Audio], etc.
-            r'\(Music Video\)',  # (Music Video)
-            r'\[Music Video\]',  # [Music Video]
-            r'\(Audio\)',        # (Audio)
-            r'\[Audio\]',        # [Audio]
-            r'\(HD\)',           # (HD)
-            r'\[HD\]',           # [HD]
-            r'\(4K\)',           # (4K)
-            r'\[4K\]',           # [4K]
-            r'\(Lyrics\)',       # (Lyrics)
-            r'\[Lyrics\]',       # [Lyrics]
-            r'\(Full Song\)',    # (Full Song)
-            r'\[Full Song\]',    # [Full Song]
-            r'\(Full Video\)',   # (Full Video)
-            r'\[Full Video\]',   # [Full Video]
-            r'\|.*',             # Everything after |
-            r'-.*Record.*',      # Record label mentions
-            r'-.*Music.*',       # Music company mentions
-            r'ft\..*',           # "ft." and everything after
-            r'feat\..*',         # "feat." and everything after
-            r'featuring.*',      # "featuring" and everything after
-        ]
-        
-        cleaned_title = title
-        
-        # Apply cleaning patterns
-        for pattern in patterns_to_remove:
-            cleaned_title = re.sub(pattern, '', cleaned_title, flags=re.IGNORECASE)
-        
-        # Remove extra spaces and clean up
-        cleaned_title = re.sub(r'\s+', ' ', cleaned_title).strip()
-        
-        # Remove leading/trailing dashes or other punctuation
-        cleaned_title = cleaned_title.strip(' -–—|')
-        
-        logging.info(f"Cleaned title: '{title}' -> '{cleaned_title}'")
-        return cleaned_title
+        Returns:
+            list: Cleaned titles, in input order
+        """
+        return [clean_music_title(title) for title in titles]
     
     async def details(self, query):
         """
@@ -229,11 +229,12 @@ class YouTubeSearchService:
             results = videos_search.result()
             
             if results and results.get('result') and len(results['result']) > query_type:
+                # Clean the whole page at once so paging through the slider hits the memo
+                cleaned = self.clean_titles([item.get('title', '') for item in results['result']])
                 video = results['result'][query_type]
-                clean_title = self._clean_title_for_music_search(video.get('title', ''))
                 
                 return {
-                    "title": clean_title,
+                    "title": cleaned[query_type],
                     "youtube_title": video.get('title', ''),
                     "link": video.get('link', ''),
                     "vidid": video.get('id', ''),